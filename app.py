@@ -5,33 +5,107 @@ This module provides the application factory pattern for creating Flask app inst
 Routes are organized in separate blueprint modules in the routes package.
 """
 
+import os
+from typing import Dict, Optional
+
 from flask import Flask
+import database
+import metrics
+import sql_trace
 from database import init_database, add_sample_data
 from routes import register_blueprints
+from cli import register_commands
+from services import payment_executor, payment_outbox, payment_service
+
+
+def _env_flag(name: str) -> Optional[bool]:
+    """True/False for an environment variable set to 1/0, None when it is unset."""
+    value = os.environ.get(name)
+    return None if value is None else value.strip().lower() in ("1", "true", "yes")
 
 
-def create_app():
+def create_app(config: Optional[Dict] = None):
     """
     Application factory function to create and configure Flask app.
     
+    Args:
+        config: optional settings layered over the defaults, e.g.
+                {"DB_PROFILE": "durable", "DB_PRAGMAS": {"cache_size": -16000}}
+                or {"PRODUCTION": True} to boot without seeding sample data
+    
     Returns:
         Flask: Configured Flask application instance
     """
     app = Flask(__name__)
     app.secret_key = "super secret key"
     
-    # Initialize the database
+    # SQLite performance profile (durable / balanced / fast), overridable per pragma
+    app.config.from_mapping(
+        DB_PROFILE=os.environ.get("LIBRARY_DB_PROFILE", database.DEFAULT_DB_PROFILE),
+        DB_PRAGMAS={},
+        BOOK_CACHE_SIZE=4096,
+        BOOK_CACHE_TTL=60.0,
+        DB_READ_POOL_SIZE=database.DEFAULT_READ_POOL_SIZE,
+        PAYMENT_WORKERS=payment_executor.DEFAULT_PAYMENT_WORKERS,
+        PAYMENT_TIMEOUT=payment_executor.DEFAULT_PAYMENT_TIMEOUT,
+        PAYMENT_GATEWAY_URL=os.environ.get("LIBRARY_PAYMENT_GATEWAY_URL"),
+        PAYMENT_GATEWAY_KEY=os.environ.get("LIBRARY_PAYMENT_GATEWAY_KEY"),
+        PAYMENT_GATEWAY_TIMEOUT=payment_service.DEFAULT_GATEWAY_TIMEOUT,
+        PAYMENT_GATEWAY_RETRIES=payment_service.DEFAULT_GATEWAY_RETRIES,
+        PAYMENT_GATEWAY_BACKOFF=payment_service.DEFAULT_GATEWAY_BACKOFF,
+        PAYMENT_GATEWAY_BACKOFF_MAX=payment_service.DEFAULT_GATEWAY_BACKOFF_MAX,
+        PAYMENT_BREAKER_THRESHOLD=payment_service.DEFAULT_BREAKER_THRESHOLD,
+        PAYMENT_BREAKER_RESET=payment_service.DEFAULT_BREAKER_RESET,
+        PAYMENT_OUTBOX_WORKER=os.environ.get("LIBRARY_OUTBOX_WORKER", "0") == "1",
+        PAYMENT_OUTBOX_POLL=payment_outbox.OUTBOX_POLL_INTERVAL,
+        METRICS_BUCKETS=metrics.DEFAULT_BUCKETS,
+        SQL_TRACE=True,
+        SQL_TRACE_HEADERS=None,
+        SQL_SLOW_QUERY_MS=float(os.environ.get("LIBRARY_SLOW_QUERY_MS", sql_trace.DEFAULT_SLOW_QUERY_MS)),
+        SQL_SLOW_QUERY_LOG=os.environ.get("LIBRARY_SLOW_QUERY_LOG"),
+        PRODUCTION=os.environ.get("LIBRARY_ENV", "development") == "production",
+        # None: seed the demo books unless PRODUCTION is set
+        SEED_SAMPLE_DATA=_env_flag("LIBRARY_SEED_SAMPLE_DATA"),
+    )
+    if config:
+        app.config.update(config)
+    database.configure_database(app.config["DB_PROFILE"], **app.config["DB_PRAGMAS"])
+    database.configure_book_cache(app.config["BOOK_CACHE_SIZE"], app.config["BOOK_CACHE_TTL"])
+    database.configure_read_pool(app.config["DB_READ_POOL_SIZE"])
+    
+    # Per-request query counts and the slow-query log
+    sql_trace.init_app(app)
+    
+    # Bring the schema up to date (a single PRAGMA read when it already is)
     init_database()
     
-    # Add sample data for testing and demonstration
-    add_sample_data()
+    # Add sample data for testing and demonstration (opt-in in production)
+    seed = app.config["SEED_SAMPLE_DATA"]
+    if seed or (seed is None and not app.config["PRODUCTION"]):
+        add_sample_data()
+    
+    # Per-endpoint latency, in-flight and status metrics, served at /metrics
+    metrics.init_app(app)
+    
+    # Share one pooled read-only connection per request, returned on teardown
+    database.init_app(app)
+    
+    # Bounded worker pool for payment gateway calls
+    payment_executor.init_app(app)
+    
+    # Background drain of the durable payment outbox (off by default; see README)
+    payment_outbox.init_app(app)
     
     # Register all route blueprints
     register_blueprints(app)
     
+    # Register maintenance CLI commands (flask fee-ledger, ...)
+    register_commands(app)
+    
     return app
 
 
 if __name__ == '__main__':
-    app = create_app()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app = create_app({"PAYMENT_OUTBOX_WORKER": True})
+    # The reloader would run create_app() again in a child process and start a second outbox worker
+    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,7 @@
+"""
+Benchmarks - performance measurements against synthetic data
+
+    python -m benchmarks.service_bench --books 1000000 --borrows 10000000 --output results.json
+
+See datagen.py for the data model and service_bench.py for what is timed.
+"""
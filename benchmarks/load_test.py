@@ -0,0 +1,308 @@
+"""
+Load test - replays a circulation traffic mix against a real local server
+
+    python -m benchmarks.load_test --rate 200 --duration 30 --db /tmp/load.db --output load.json
+
+Serves create_app() with Werkzeug's threaded WSGI server on a free local port
+(or targets --url) and sends requests open-loop at --rate per second, drawn
+from this mix (override with --mix catalog=1,search=3,...):
+
+    catalog        GET  /catalog
+    search         GET  /api/search?q=...&type=title|author|fulltext
+    borrow         POST /api/borrow          (books come back through 'return')
+    return         POST /api/return
+    late_fee       GET  /api/late_fee/<patron_id>/<book_id>
+    patron_status  GET  /api/patron/<patron_id>/status
+
+Latency is measured from when a request was due to be sent, so requests that
+queue behind a saturated server count against it instead of quietly lowering
+the offered rate. Per route the report gives p50/p95/p99, throughput and the
+error rate (exceptions and 5xx); 4xx answers such as "borrow limit reached"
+are business outcomes and counted as 'rejected'.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import database
+from benchmarks.datagen import LAST_NAMES, WORDS, generate_dataset
+from benchmarks.service_bench import percentile
+
+DEFAULT_MIX = {
+    'catalog': 20,
+    'search': 30,
+    'borrow': 10,
+    'return': 10,
+    'late_fee': 15,
+    'patron_status': 15,
+}
+
+
+class TrafficState:
+    """Patrons, books and open loans shared by all client threads."""
+
+    def __init__(self, patrons: List[str], max_book_id: int, loans: List[Tuple[str, int]], seed: int):
+        self.patrons = patrons or ['123456']
+        self.max_book_id = max(1, max_book_id)
+        self.loans = deque(loans)
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._seed = seed
+        self._seeds = 0
+
+    @property
+    def rng(self) -> random.Random:
+        rng = getattr(self._local, 'rng', None)
+        if rng is None:
+            with self.lock:
+                self._seeds += 1
+                rng = self._local.rng = random.Random(self._seed * 1000 + self._seeds)
+        return rng
+
+    def add_loan(self, loan: Tuple[str, int]) -> None:
+        with self.lock:
+            self.loans.append(loan)
+
+    def take_loan(self) -> Optional[Tuple[str, int]]:
+        with self.lock:
+            return self.loans.popleft() if self.loans else None
+
+    def any_loan(self) -> Tuple[str, int]:
+        with self.lock:
+            if self.loans:
+                return self.loans[self.rng.randrange(len(self.loans))]
+        return self.rng.choice(self.patrons), self.rng.randint(1, self.max_book_id)
+
+
+def _plan(route: str, state: TrafficState) -> Tuple[str, str, Dict, Optional[Callable]]:
+    """Return (method, path, request kwargs, callback on the response) for one request."""
+    rng = state.rng
+    if route == 'catalog':
+        return 'GET', '/catalog', {}, None
+    if route == 'search':
+        search_type = rng.choice(('title', 'author', 'fulltext'))
+        term = rng.choice(LAST_NAMES) if search_type == 'author' else rng.choice(WORDS)
+        return 'GET', '/api/search', {'params': {'q': term, 'type': search_type}}, None
+    if route == 'borrow':
+        loan = (rng.choice(state.patrons), rng.randint(1, state.max_book_id))
+
+        def borrowed(response):
+            if response.status_code == 200 and response.json().get('success'):
+                state.add_loan(loan)
+        return 'POST', '/api/borrow', {'json': {'patron_id': loan[0], 'book_ids': [loan[1]]}}, borrowed
+    if route == 'return':
+        loan = state.take_loan() or state.any_loan()
+        return 'POST', '/api/return', {'json': {'patron_id': loan[0], 'book_ids': [loan[1]]}}, None
+    if route == 'late_fee':
+        patron_id, book_id = state.any_loan()
+        return 'GET', f'/api/late_fee/{patron_id}/{book_id}', {}, None
+    if route == 'patron_status':
+        return 'GET', f'/api/patron/{rng.choice(state.patrons)}/status', {}, None
+    raise ValueError(f'unknown route {route!r}')
+
+
+def _schedule(mix: Dict[str, int], total: int, rng: random.Random) -> List[str]:
+    routes = [route for route, weight in mix.items() if weight > 0]
+    return rng.choices(routes, weights=[mix[r] for r in routes], k=total)
+
+
+def run_load(base_url: str, state: TrafficState, rate: float, duration: float,
+             mix: Optional[Dict[str, int]] = None, concurrency: int = 64, seed: int = 327) -> Dict:
+    """
+    Send rate * duration requests open-loop and summarize them per route.
+
+    Returns:
+        {'routes': {route: stats}, 'total': stats, 'elapsed_seconds': float}
+        where stats = {'requests', 'errors', 'rejected', 'error_rate',
+                       'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'}
+    """
+    plan = _schedule(mix or DEFAULT_MIX, max(1, int(rate * duration)), random.Random(seed))
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: {'errors': 0, 'rejected': 0})
+    record_lock = threading.Lock()
+    sessions = threading.local()
+
+    def send(route: str, due: float) -> None:
+        session = getattr(sessions, 'session', None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        outcome = None
+        try:
+            method, path, kwargs, callback = _plan(route, state)
+            response = session.request(method, base_url + path, timeout=30, **kwargs)
+            if response.status_code >= 500:
+                outcome = 'errors'
+            elif response.status_code >= 400:
+                outcome = 'rejected'
+            if callback is not None:
+                callback(response)
+        except Exception:
+            outcome = 'errors'
+        elapsed = time.perf_counter() - due
+        with record_lock:
+            latencies[route].append(elapsed)
+            if outcome:
+                outcomes[route][outcome] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='load') as pool:
+        for n, route in enumerate(plan):
+            due = started + n / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, route, due)
+    elapsed = time.perf_counter() - started
+
+    def stats(values: List[float], errors: int, rejected: int) -> Dict:
+        values = sorted(values)
+        ms = lambda seconds: round(seconds * 1000, 3)
+        return {
+            'requests': len(values),
+            'errors': errors,
+            'rejected': rejected,
+            'error_rate': round(errors / len(values), 4) if values else 0.0,
+            'throughput_rps': round(len(values) / elapsed, 1) if elapsed > 0 else 0.0,
+            'p50_ms': ms(percentile(values, 50)),
+            'p95_ms': ms(percentile(values, 95)),
+            'p99_ms': ms(percentile(values, 99)),
+            'max_ms': ms(values[-1]) if values else 0.0,
+        }
+
+    routes = {route: stats(values, outcomes[route]['errors'], outcomes[route]['rejected'])
+              for route, values in sorted(latencies.items())}
+    total = stats([v for values in latencies.values() for v in values],
+                  sum(o['errors'] for o in outcomes.values()),
+                  sum(o['rejected'] for o in outcomes.values()))
+    return {'routes': routes, 'total': total, 'elapsed_seconds': round(elapsed, 3)}
+
+
+def load_state(seed: int = 327, sample: int = 1000) -> TrafficState:
+    """Build the traffic state from patrons and open loans in the current database."""
+    with database.db_connection() as conn:
+        max_book = conn.execute('SELECT MAX(id) FROM books').fetchone()[0] or 1
+        patrons = [r[0] for r in conn.execute(
+            'SELECT DISTINCT patron_id FROM borrows ORDER BY random() LIMIT ?', (sample,)).fetchall()]
+        loans = [tuple(r) for r in conn.execute(
+            'SELECT patron_id, book_id FROM borrows WHERE return_date IS NULL ORDER BY random() LIMIT ?',
+            (sample,)).fetchall()]
+    return TrafficState(patrons, max_book, loans, seed)
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class LocalServer:
+    """create_app() served by a threaded Werkzeug server on 127.0.0.1 in a background thread."""
+
+    def __init__(self, app, port: int = 0):
+        self.server = make_server('127.0.0.1', port, app, threaded=True,
+                                  request_handler=_QuietRequestHandler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self._thread = threading.Thread(target=self.server.serve_forever, name='load-server', daemon=True)
+
+    def __enter__(self) -> 'LocalServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(','):
+        route, _, weight = part.partition('=')
+        if route.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown route {route.strip()!r}')
+        mix[route.strip()] = int(weight)
+    return mix
+
+
+def format_table(report: Dict) -> List[str]:
+    lines = [f"{'route':14} {'requests':>8} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"]
+    for route, s in list(report['routes'].items()) + [('TOTAL', report['total'])]:
+        lines.append(f"{route:14} {s['requests']:>8} {s['throughput_rps']:>8.1f} {s['p50_ms']:>9.2f} "
+                     f"{s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['error_rate']:>7.2%}")
+    return lines
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rate', type=float, default=100.0, help='Requests per second to offer.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to send for.')
+    parser.add_argument('--concurrency', type=int, default=64, help='Maximum requests in flight.')
+    parser.add_argument('--mix', type=_parse_mix, default=None, help='e.g. catalog=2,search=3,borrow=1')
+    parser.add_argument('--url', help='Target a running server instead of starting one.')
+    parser.add_argument('--db', help='Database file for the local server (default: a new temporary file).')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--borrows', type=int, default=100000)
+    parser.add_argument('--profile', default=database.DEFAULT_DB_PROFILE, choices=sorted(database.DB_PROFILES))
+    parser.add_argument('--seed', type=int, default=327)
+    parser.add_argument('--output', help='Write JSON here instead of stdout.')
+    args = parser.parse_args(argv)
+
+    # The state is read straight from --db, so --url runs still need the server's database
+    database.DATABASE = args.db or os.path.join(tempfile.mkdtemp(prefix='library-load-'), 'load.db')
+    database.configure_database(args.profile)
+    database.init_database()
+    with database.db_connection() as conn:
+        empty = conn.execute('SELECT COUNT(*) FROM books').fetchone()[0] == 0
+    if empty and not args.url:
+        print(f"Generating {args.books} books / {args.borrows} borrows into {database.DATABASE} ...",
+              file=sys.stderr)
+        generate_dataset(args.books, args.borrows, seed=args.seed)
+    state = load_state(args.seed)
+
+    settings = dict(rate=args.rate, duration=args.duration, mix=args.mix, concurrency=args.concurrency,
+                    seed=args.seed)
+    if args.url:
+        result = run_load(args.url.rstrip('/'), state, **settings)
+    else:
+        from app import create_app
+        app = create_app({'DB_PROFILE': args.profile})
+        with LocalServer(app) as server:
+            result = run_load(server.url, state, **settings)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'target': args.url or 'local werkzeug (threaded)',
+            'rate': args.rate,
+            'duration': args.duration,
+            'concurrency': args.concurrency,
+            'mix': args.mix or DEFAULT_MIX,
+            'db_profile': args.profile,
+        },
+        **result,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+    for line in format_table(report):
+        print(line, file=sys.stderr)
+    return report
+
+
+if __name__ == '__main__':
+    main()
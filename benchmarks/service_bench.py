@@ -0,0 +1,247 @@
+"""
+Service-layer benchmark - times library_service calls on synthetic data
+
+    python -m benchmarks.service_bench --books 1000000 --borrows 10000000 \\
+        --db /tmp/bench.db --output results.json
+    python -m benchmarks.service_bench --db /tmp/bench.db --output new.json --baseline results.json
+
+Generates the dataset (datagen.py) into --db unless it is already populated,
+then times each benchmark --iterations times and writes JSON:
+
+    {"meta": {...commit, versions, settings}, "dataset": {...},
+     "results": {"search_title": {"iterations", "mean_ms", "p50_ms", "p95_ms",
+                                  "p99_ms", "min_ms", "max_ms", "ops_per_second"}, ...}}
+
+--baseline prints the p50/p95 change of every benchmark against an earlier
+results file to stderr.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import database
+from benchmarks.datagen import WORDS, LAST_NAMES, generate_dataset
+from services import library_service
+
+DEFAULT_ITERATIONS = 200
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float]) -> Dict:
+    """Latency statistics in milliseconds for one benchmark."""
+    values = sorted(latencies)
+    total = sum(values)
+    ms = lambda seconds: round(seconds * 1000, 4)
+    return {
+        'iterations': len(values),
+        'mean_ms': ms(total / len(values)) if values else 0.0,
+        'p50_ms': ms(percentile(values, 50)),
+        'p95_ms': ms(percentile(values, 95)),
+        'p99_ms': ms(percentile(values, 99)),
+        'min_ms': ms(values[0]) if values else 0.0,
+        'max_ms': ms(values[-1]) if values else 0.0,
+        'ops_per_second': round(len(values) / total, 1) if total > 0 else 0.0,
+    }
+
+
+def _timed(fn: Callable, calls: Sequence[Tuple]) -> List[float]:
+    latencies = []
+    for args in calls:
+        started = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def _dataset_counts() -> Dict:
+    with database.db_connection() as conn:
+        return {
+            'books': conn.execute('SELECT COUNT(*) FROM books').fetchone()[0],
+            'borrows': conn.execute('SELECT COUNT(*) FROM borrows').fetchone()[0],
+            'active_loans': conn.execute(
+                'SELECT COUNT(*) FROM borrows WHERE return_date IS NULL').fetchone()[0],
+            'patrons': conn.execute('SELECT COUNT(DISTINCT patron_id) FROM borrows').fetchone()[0],
+        }
+
+
+def _sample_inputs(rng: random.Random, iterations: int) -> Dict[str, List]:
+    """Pick benchmark arguments from the data actually in the database."""
+    with database.db_connection() as conn:
+        max_book = conn.execute('SELECT MAX(id) FROM books').fetchone()[0] or 0
+        loans = [tuple(r) for r in conn.execute(
+            'SELECT patron_id, book_id FROM borrows WHERE return_date IS NULL ORDER BY random() LIMIT ?',
+            (iterations,)).fetchall()]
+        patrons = [r[0] for r in conn.execute(
+            'SELECT patron_id FROM borrows GROUP BY patron_id ORDER BY random() LIMIT ?',
+            (iterations,)).fetchall()]
+        isbns = []
+        for _ in range(iterations if max_book else 0):
+            row = conn.execute('SELECT isbn FROM books WHERE id = ?', (rng.randint(1, max_book),)).fetchone()
+            if row:
+                isbns.append(row[0])
+        full = {r[0] for r in conn.execute(
+            'SELECT patron_id FROM borrows WHERE return_date IS NULL GROUP BY patron_id HAVING COUNT(*) >= ?',
+            (library_service.MAX_BORROWED_BOOKS,)).fetchall()}
+
+        # Borrow/return pairs: a patron below the limit and a book with a free copy
+        pairs = []
+        candidates = [p for p in patrons if p not in full] or ['999999']
+        attempts = 0
+        while max_book and len(pairs) < iterations and attempts < iterations * 20:
+            attempts += 1
+            book_id = rng.randint(1, max_book)
+            row = conn.execute('SELECT available_copies FROM books WHERE id = ?', (book_id,)).fetchone()
+            if row and row[0] > 0 and book_id not in {b for _, b in pairs}:
+                pairs.append((candidates[len(pairs) % len(candidates)], book_id))
+
+    return {
+        'title_terms': [rng.choice(WORDS) for _ in range(iterations)],
+        'author_terms': [rng.choice(LAST_NAMES) for _ in range(iterations)],
+        'fulltext_terms': [f"{rng.choice(WORDS)} {rng.choice(WORDS)[:4]}" for _ in range(iterations)],
+        'isbns': isbns,
+        'loans': loans,
+        'patrons': patrons,
+        'pairs': pairs,
+    }
+
+
+def run_benchmarks(iterations: int = DEFAULT_ITERATIONS, seed: int = 327,
+                   only: Optional[Sequence[str]] = None) -> Dict[str, Dict]:
+    """Run every benchmark (or those named in `only`) against the current database."""
+    rng = random.Random(seed)
+    inputs = _sample_inputs(rng, iterations)
+    search = library_service.search_books_in_catalog
+    results: Dict[str, Dict] = {}
+
+    def wanted(name: str) -> bool:
+        return not only or name in only
+
+    for name, search_type, terms in (
+        ('search_title', 'title', inputs['title_terms']),
+        ('search_author', 'author', inputs['author_terms']),
+        ('search_isbn', 'isbn', inputs['isbns']),
+        ('search_fulltext', 'fulltext', inputs['fulltext_terms']),
+    ):
+        if wanted(name) and terms:
+            results[name] = summarize(_timed(search, [(term, search_type) for term in terms]))
+
+    # Each borrow is undone by the matching return, so reruns see the same data
+    if (wanted('borrow_book') or wanted('return_book')) and inputs['pairs']:
+        borrow_latencies, return_latencies = [], []
+        for patron_id, book_id in inputs['pairs']:
+            borrow_latencies += _timed(library_service.borrow_book_by_patron, [(patron_id, book_id)])
+            return_latencies += _timed(library_service.return_book_by_patron, [(patron_id, book_id)])
+        if wanted('borrow_book'):
+            results['borrow_book'] = summarize(borrow_latencies)
+        if wanted('return_book'):
+            results['return_book'] = summarize(return_latencies)
+
+    if wanted('late_fee') and inputs['loans']:
+        results['late_fee'] = summarize(_timed(library_service.calculate_late_fee_for_book, inputs['loans']))
+    if wanted('patron_status') and inputs['patrons']:
+        results['patron_status'] = summarize(
+            _timed(library_service.get_patron_status_report, [(p,) for p in inputs['patrons']]))
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(database.__file__)),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict]) -> List[str]:
+    """One line per benchmark present in both runs: p50 and p95 old -> new and the change."""
+    lines = []
+    for name, new in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        parts = []
+        for key in ('p50_ms', 'p95_ms'):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            parts.append(f"{key[:3]} {old[key]:.3f} -> {new[key]:.3f} ms ({change:+.1f}%)")
+        lines.append(f"{name:16} " + ", ".join(parts))
+    return lines
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--db', help='Database file (default: a new temporary file).')
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--borrows', type=int, default=1000000)
+    parser.add_argument('--patrons', type=int, default=None)
+    parser.add_argument('--active-loans', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=327)
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--profile', default=database.DEFAULT_DB_PROFILE, choices=sorted(database.DB_PROFILES))
+    parser.add_argument('--only', nargs='*', help='Benchmark names to run (default: all).')
+    parser.add_argument('--output', help='Write JSON here instead of stdout.')
+    parser.add_argument('--baseline', help='Earlier results file to compare against.')
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='library-bench-'), 'bench.db')
+    database.DATABASE = db_path
+    database.configure_database(args.profile)
+    database.init_database()
+
+    dataset = _dataset_counts()
+    if dataset['books'] == 0:
+        print(f"Generating {args.books} books / {args.borrows} borrows into {db_path} ...", file=sys.stderr)
+        generated = generate_dataset(args.books, args.borrows, patrons=args.patrons,
+                                     active_loans=args.active_loans, seed=args.seed)
+        dataset = dict(_dataset_counts(), generated_in_seconds=generated['elapsed_seconds'])
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'db_profile': args.profile,
+            'iterations': args.iterations,
+            'seed': args.seed,
+        },
+        'dataset': dataset,
+        'results': run_benchmarks(args.iterations, args.seed, args.only),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as fh:
+            baseline = json.load(fh)['results']
+        for line in compare(report['results'], baseline):
+            print(line, file=sys.stderr)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Command-line interface - Flask CLI commands for maintenance jobs
+
+Run with the Flask CLI, e.g.:
+    flask --app app:create_app fee-ledger --as-of 2025-01-31
+    flask --app app:create_app import-books new_branch.csv
+    flask --app app:create_app drain-payments
+    flask --app app:create_app reconcile-payments --since 2025-01-01
+"""
+
+from datetime import date
+
+import click
+
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app."""
+
+    @app.cli.command('fee-ledger')
+    @click.option('--as-of', 'as_of', default=None, help='Day to compute fees for (YYYY-MM-DD, default today).')
+    def fee_ledger_command(as_of):
+        """Recompute late fees for every active loan into the fees table."""
+        from services.fee_ledger import run_fee_ledger
+
+        try:
+            day = date.fromisoformat(as_of) if as_of else None
+        except ValueError:
+            raise click.BadParameter('must be a date in YYYY-MM-DD format', param_hint='--as-of')
+
+        summary = run_fee_ledger(day)
+        click.echo(
+            f"{summary['as_of']}: {summary['loans_charged']} overdue loans, "
+            f"${summary['total_fees']:.2f} in fees ({summary['elapsed_seconds']:.3f}s)"
+        )
+
+    @app.cli.command('import-books')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+                  help='Input format (default: from the file extension).')
+    @click.option('--batch-size', default=None, type=int, help='Rows per insert transaction.')
+    def import_books_command(path, fmt, batch_size):
+        """Bulk-import books from a CSV or JSON Lines file."""
+        from services.catalog_import import import_books, detect_format, IMPORT_BATCH_SIZE
+
+        fmt = fmt or detect_format(path)
+        if fmt is None:
+            raise click.BadParameter('cannot tell the format from the file name; pass --format', param_hint='PATH')
+
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = import_books(stream, fmt, batch_size=batch_size or IMPORT_BATCH_SIZE)
+
+        for error in report['errors']:
+            click.echo(f"line {error['line']}: {error['error']}", err=True)
+        if report['errors_truncated']:
+            click.echo('... more errors not shown', err=True)
+        click.echo(
+            f"{report['imported']} imported, {report['failed']} failed of {report['rows_read']} rows "
+            f"in {report['elapsed_seconds']:.3f}s ({report['rows_per_second']:.0f} rows/s)"
+        )
+        if report['aborted']:
+            raise click.ClickException(report['aborted'])
+
+    @app.cli.command('drain-payments')
+    @click.option('--once', is_flag=True, help='Process one batch of due entries and exit.')
+    @click.option('--poll-interval', default=None, type=float, help='Seconds between polls when idle.')
+    def drain_payments_command(once, poll_interval):
+        """Send queued payments and refunds from the outbox to the gateway."""
+        from services.payment_outbox import OutboxWorker, drain_outbox, outbox_lease_seconds, OUTBOX_POLL_INTERVAL
+        from services.payment_service import create_gateway
+
+        gateway = create_gateway(app.config)
+        lease = outbox_lease_seconds(gateway)
+        if once:
+            counts = drain_outbox(gateway, lease_seconds=lease)
+            click.echo(
+                f"{counts['claimed']} claimed: {counts['completed']} completed, "
+                f"{counts['pending']} to retry, {counts['failed']} failed"
+            )
+            return
+
+        worker = OutboxWorker(gateway=gateway, poll_interval=poll_interval or OUTBOX_POLL_INTERVAL,
+                              lease_seconds=lease)
+        click.echo('Draining the payment outbox; press Ctrl+C to stop.')
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
+
+    @app.cli.command('reconcile-payments')
+    @click.option('--since', default=None, help='Only check transactions recorded from this time (ISO format).')
+    @click.option('--until', default=None, help='Only check transactions recorded before this time (default now).')
+    @click.option('--concurrency', default=16, type=int, help='Status checks in flight at once.')
+    @click.option('--batch-size', default=None, type=int, help='Transactions verified per checkpoint.')
+    @click.option('--limit', default=None, type=int, help='Stop after this many transactions; rerun to resume.')
+    @click.option('--checkpoint', default=None, help='Checkpoint name, for independent sweeps.')
+    @click.option('--reset', is_flag=True, help='Ignore the saved checkpoint and start from the window start.')
+    def reconcile_payments_command(since, until, concurrency, batch_size, limit, checkpoint, reset):
+        """Verify recorded payments with the gateway and record mismatches."""
+        from datetime import datetime
+        from services.payment_executor import PaymentExecutor, payment_timeout
+        from services.payment_service import create_gateway
+        from services.reconciliation import (
+            reconcile_payments, reset_checkpoint, RECONCILE_BATCH_SIZE, DEFAULT_CHECKPOINT
+        )
+
+        try:
+            window = [datetime.fromisoformat(value) if value else None for value in (since, until)]
+        except ValueError:
+            raise click.BadParameter('must be an ISO date or datetime', param_hint='--since/--until')
+
+        checkpoint = checkpoint or DEFAULT_CHECKPOINT
+        if reset:
+            reset_checkpoint(checkpoint)
+        gateway = create_gateway(app.config)
+        executor = PaymentExecutor(gateway=gateway, max_workers=concurrency,
+                                   timeout=payment_timeout(app.config, gateway))
+        try:
+            report = reconcile_payments(executor, *window, checkpoint=checkpoint,
+                                        batch_size=batch_size or RECONCILE_BATCH_SIZE,
+                                        max_transactions=limit)
+        finally:
+            executor.shutdown(wait=False)
+
+        click.echo(
+            f"{report['checked']} transactions checked, {report['issues']} issues "
+            f"({report['unverified']} unverified) in {report['elapsed_seconds']:.3f}s "
+            f"({report['transactions_per_second']:.1f}/s)"
+        )
+        if report['reservations_recovered']:
+            click.echo(f"{report['reservations_recovered']} interrupted late fee charges handed to the "
+                       "payment outbox.")
+        if not report['complete']:
+            click.echo('Stopped at --limit; run again to resume from the checkpoint.')
@@ -3,25 +3,439 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import os
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from flask import g, has_app_context
+
+import sql_trace
 
 # Database configuration
 DATABASE = 'library.db'
 
-def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
+# Largest value sqlite3 can bind as an INTEGER; larger ints raise OverflowError
+MAX_SQLITE_INTEGER = 2 ** 63 - 1
+
+# Connection performance profiles. Every preset uses WAL so readers never wait
+# behind a writer; they differ in how often SQLite fsyncs and how much memory
+# each connection may use.
+DB_PROFILES: Dict[str, Dict[str, object]] = {
+    'durable': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -8000,        # KiB when negative (~8 MB)
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+    'balanced': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -32000,
+        'mmap_size': 128 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'fast': {
+        'busy_timeout': 10000,
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+DEFAULT_DB_PROFILE = 'balanced'
+
+# Allowed values for the non-numeric pragmas (pragmas cannot be bound as parameters)
+_PRAGMA_CHOICES = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+_PRAGMA_INTEGERS = {'busy_timeout', 'cache_size', 'mmap_size'}
+
+# Pragmas applied to every new connection, in order
+DB_PRAGMAS: Dict[str, object] = dict(DB_PROFILES[DEFAULT_DB_PROFILE])
+
+def configure_database(profile: Optional[str] = None, **overrides) -> Dict[str, object]:
+    """
+    Select the pragma profile used for new connections.
+
+    Args:
+        profile: name of a preset in DB_PROFILES ('durable', 'balanced', 'fast');
+                 defaults to LIBRARY_DB_PROFILE from the environment, then 'balanced'
+        overrides: individual pragma values layered on top of the preset
+
+    Returns:
+        dict: the pragmas now in effect
+
+    Raises:
+        ValueError: unknown profile, pragma name or pragma value
+    """
+    global DB_PRAGMAS
+
+    name = (profile or os.environ.get('LIBRARY_DB_PROFILE') or DEFAULT_DB_PROFILE).strip().lower()
+    if name not in DB_PROFILES:
+        raise ValueError(f"Unknown database profile '{name}'. Choose one of: {', '.join(DB_PROFILES)}.")
+
+    pragmas = dict(DB_PROFILES[name])
+    for key, value in overrides.items():
+        if key in _PRAGMA_INTEGERS:
+            pragmas[key] = int(value)
+        elif key in _PRAGMA_CHOICES:
+            value = str(value).upper()
+            if value not in _PRAGMA_CHOICES[key]:
+                raise ValueError(f"Invalid value '{value}' for PRAGMA {key}.")
+            pragmas[key] = value
+        else:
+            raise ValueError(f"Unsupported PRAGMA '{key}'.")
+
+    DB_PRAGMAS = pragmas
+    # Connections opened under the old pragmas are reopened on next use
+    close_connections()
+    return dict(DB_PRAGMAS)
+
+def _apply_pragmas(conn: sqlite3.Connection, read_only: bool = False) -> None:
+    """Apply the configured pragmas to a freshly opened connection."""
+    for key, value in DB_PRAGMAS.items():
+        # The journal mode is stored in the file; a read-only connection cannot change it
+        if read_only and key == 'journal_mode':
+            continue
+        conn.execute(f'PRAGMA {key} = {value}')
+    if read_only:
+        conn.execute('PRAGMA query_only = ON')
+
+def get_db_connection(read_only: bool = False):
+    """
+    Get a database connection (traced by sql_trace unless tracing is off).
+
+    read_only connections are opened with mode=ro and PRAGMA query_only, so
+    any attempt to write through them fails. Connections may be handed from
+    one thread to another (the reader pool and the writer do this), but are
+    only ever used by one thread at a time.
+    """
+    if read_only:
+        target, uri = Path(DATABASE).absolute().as_uri() + '?mode=ro', True
+    else:
+        target, uri = DATABASE, False
+    conn = sqlite3.connect(target, uri=uri, factory=sql_trace.connection_factory(), check_same_thread=False)
     conn.row_factory = sqlite3.Row  # This enables column access by name
+    # SQLite's LOWER() and LIKE only fold ASCII; substring searches the trigram
+    # index cannot answer (terms under three characters) fold case through this
+    conn.create_function('casefold', 1, _casefold, deterministic=True)
+    _apply_pragmas(conn, read_only)
     return conn
 
-def init_database():
-    """Initialize the database with required tables."""
-    conn = get_db_connection()
+def _casefold(value):
+    """SQL casefold(): Unicode case folding of text values, others unchanged."""
+    return value.casefold() if isinstance(value, str) else value
+
+# Reader / writer split
+#
+# Reads run on read-only connections borrowed from READ_POOL, so under WAL
+# catalog browsing never waits on circulation writes. Writes go through the
+# process's single WRITER connection, handed out under a lock, so they queue
+# here instead of contending for SQLite's write lock.
+
+DEFAULT_READ_POOL_SIZE = 8
+
+class ReadPool:
+    """
+    Idle read-only connections to DATABASE, reused across requests and threads.
+
+    acquire() never blocks: when no idle connection is left a new one is
+    opened, and release() closes connections beyond maxsize. close() starts a
+    new generation: idle connections are closed at once, and ones checked out
+    at the time are closed when they come back, so none outlives a change of
+    pragmas or database file.
+    """
 
-    # Create books table
+    def __init__(self, maxsize: int = DEFAULT_READ_POOL_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._idle: List[sqlite3.Connection] = []
+        self._path: Optional[str] = None
+        self._generation = 0
+        # Checked-out connection -> generation it was opened in
+        self._out: Dict[sqlite3.Connection, int] = {}
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._path != DATABASE:
+                # DATABASE was repointed (tests, scripts); drop connections to the old file
+                self._new_generation()
+                self._path = DATABASE
+            if self._idle:
+                conn = self._idle.pop()
+                self._out[conn] = self._generation
+                return conn
+            generation = self._generation
+        conn = get_db_connection(read_only=True)
+        with self._lock:
+            self._out[conn] = generation
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            generation = self._out.pop(conn, None)
+            if (generation == self._generation and self._path == DATABASE
+                    and len(self._idle) < self.maxsize):
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def idle(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def close(self) -> None:
+        with self._lock:
+            self._new_generation()
+
+    def _new_generation(self) -> None:
+        for conn in self._idle:
+            conn.close()
+        self._idle.clear()
+        self._generation += 1
+
+class Writer:
+    """
+    The one read-write connection of this process.
+
+    connection() holds a re-entrant lock for the whole block, so nested
+    helpers share the connection and transaction of their caller. When the
+    outermost block ends any transaction it left open is rolled back, as
+    closing a short-lived connection used to do.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._path: Optional[str] = None
+        self._depth = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            if self._depth == 0 and (self._conn is None or self._path != DATABASE):
+                self._close()
+                self._conn, self._path = get_db_connection(), DATABASE
+            conn = self._conn
+            self._depth += 1
+            try:
+                yield conn
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and conn.in_transaction:
+                    conn.rollback()
+
+    def close(self) -> None:
+        """Close the connection; refused inside a connection() block, whose caller still uses it."""
+        with self._lock:
+            if self._depth > 0:
+                raise RuntimeError("the writer connection is in use by this thread and cannot be closed")
+            self._close()
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+READ_POOL = ReadPool()
+WRITER = Writer()
+
+def configure_read_pool(maxsize: int) -> None:
+    """Set how many idle read-only connections are kept for reuse."""
+    READ_POOL.maxsize = int(maxsize)
+
+def close_connections() -> None:
+    """Close pooled readers and the writer; they are reopened on next use."""
+    READ_POOL.close()
+    WRITER.close()
+
+def get_request_connection() -> Optional[sqlite3.Connection]:
+    """
+    Return the read-only connection shared by the current app context,
+    borrowing it from READ_POOL on first use. Returns None outside of an app
+    context (scripts, unit tests calling helpers directly).
+    """
+    if not has_app_context():
+        return None
+    conn = g.get('_db_conn')
+    if conn is None:
+        conn = READ_POOL.acquire()
+        g._db_conn = conn
+    return conn
+
+@contextmanager
+def read_connection() -> Iterator[sqlite3.Connection]:
+    """
+    Yield a read-only connection for a helper's queries.
+
+    Inside a request every read helper shares one pooled connection, which
+    goes back to the pool in close_db() on app-context teardown. Outside a
+    request one is borrowed from the pool around the block.
+    """
+    conn = get_request_connection()
+    if conn is not None:
+        yield conn
+        return
+    conn = READ_POOL.acquire()
+    try:
+        yield conn
+    finally:
+        READ_POOL.release(conn)
+
+def db_connection():
+    """
+    Yield the writer connection for a helper that writes (or must read and
+    write in one transaction). Blocks in other threads wait for it to end.
+    """
+    return WRITER.connection()
+
+def close_db(exc: Optional[BaseException] = None) -> None:
+    """Return the request's read connection to the pool, if one was borrowed."""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        READ_POOL.release(conn)
+
+def init_app(app) -> None:
+    """Register the request-scoped connection teardown on a Flask app."""
+    app.teardown_appcontext(close_db)
+
+@contextmanager
+def immediate_transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    Run a block inside BEGIN IMMEDIATE ... COMMIT.
+
+    The write lock is taken up front, so the reads inside the block cannot be
+    invalidated by a concurrent writer before the block commits. Any exception
+    rolls the whole block back. A block opened while the connection is
+    already in a transaction joins it, so helpers can be composed into one
+    atomic unit on the writer.
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+# Schema migrations
+#
+# Each migration is (version, description, steps), where steps is a list of SQL
+# statements or a callable taking the connection. They are applied in order,
+# each in its own transaction, and the last applied version is stored in
+# PRAGMA user_version so existing databases upgrade in place.
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    """Return True if this SQLite build ships the FTS5 extension."""
+    return bool(conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+
+def _migrate_books_fts(conn: sqlite3.Connection) -> None:
+    """
+    Mirror books.title/author into an external-content FTS5 index kept in sync
+    by triggers. Builds without FTS5 skip this step and full-text search falls
+    back to substring matching.
+    """
+    if not fts5_available(conn):
+        return
     conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    _sync_books_index(conn, 'books_fts')
+
+def _sync_books_index(conn: sqlite3.Connection, index: str) -> None:
+    """Keep an external-content FTS5 index over books.title/author in sync by triggers, and fill it."""
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_ai AFTER INSERT ON books BEGIN
+            INSERT INTO {index} (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_ad AFTER DELETE ON books BEGIN
+            INSERT INTO {index} ({index}, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+        END
+    ''')
+    # Only title/author edits touch the index; availability updates do not
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {index}_au AFTER UPDATE OF title, author ON books BEGIN
+            INSERT INTO {index} ({index}, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+            INSERT INTO {index} (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''')
+    conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+
+def _migrate_books_trigram(conn: sqlite3.Connection) -> None:
+    """
+    Index books.title/author by trigrams for title and author substring
+    search. The trigram tokenizer folds case across Unicode ("élan" finds
+    "Élan"), which LIKE does not. Builds without FTS5, or with SQLite older
+    than 3.34 (no trigram tokenizer), skip this step and substring search
+    scans books instead.
+    """
+    if not fts5_available(conn):
+        return
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS books_trigram USING fts5(
+                title, author,
+                content='books', content_rowid='id',
+                tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        return
+    _sync_books_index(conn, 'books_trigram')
+
+def _migrate_catalog_version(conn: sqlite3.Connection) -> None:
+    """
+    Keep a single-row counter that every insert, update or delete on books or
+    borrows bumps, whichever code path performs the write. (Migration 12
+    replaces these per-row triggers with one bump per write transaction.)
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)')
+    for table in ('books', 'borrows'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS catalog_version_{table}_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+MigrationSteps = Union[List[str], Callable[[sqlite3.Connection], None]]
+
+MIGRATIONS: List[Tuple[int, str, MigrationSteps]] = [
+    (1, 'create books and borrows tables', [
+        '''
         CREATE TABLE IF NOT EXISTS books (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
@@ -30,10 +444,8 @@ def init_database():
             total_copies INTEGER NOT NULL,
             available_copies INTEGER NOT NULL
         )
-    ''')
-
-    # Create borrows table
-    conn.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS borrows (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             patron_id TEXT NOT NULL,
@@ -43,17 +455,212 @@ def init_database():
             return_date TEXT,
             FOREIGN KEY (book_id) REFERENCES books (id)
         )
-    ''')
+        ''',
+    ]),
+    (2, 'index borrows for active-loan and history lookups', [
+        # Loan counts, late-fee lookups and returns only touch active loans
+        '''
+        CREATE INDEX IF NOT EXISTS idx_borrows_active_patron_book
+            ON borrows (patron_id, book_id) WHERE return_date IS NULL
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_borrows_book_patron
+            ON borrows (book_id, patron_id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_borrows_patron_borrow_date
+            ON borrows (patron_id, borrow_date)
+        ''',
+    ]),
+    (3, 'full-text index over book titles and authors', _migrate_books_fts),
+    (4, 'index books for keyset pagination by title', [
+        'CREATE INDEX IF NOT EXISTS idx_books_title_id ON books (title, id)',
+    ]),
+    (5, 'late-fee ledger table', [
+        '''
+        CREATE TABLE IF NOT EXISTS fees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            as_of TEXT NOT NULL,
+            borrow_id INTEGER NOT NULL,
+            patron_id TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            due_date TEXT NOT NULL,
+            days_overdue INTEGER NOT NULL,
+            fee_amount REAL NOT NULL,
+            UNIQUE (as_of, borrow_id),
+            FOREIGN KEY (borrow_id) REFERENCES borrows (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fees_as_of_patron ON fees (as_of, patron_id)',
+        # Lets the ledger job range-scan only overdue active loans
+        '''
+        CREATE INDEX IF NOT EXISTS idx_borrows_active_due_date
+            ON borrows (due_date) WHERE return_date IS NULL
+        ''',
+    ]),
+    (6, 'catalog version counter for conditional responses', _migrate_catalog_version),
+    (7, 'per-loan allocations of late fee payments', [
+        '''
+        CREATE TABLE IF NOT EXISTS fee_payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT NOT NULL,
+            patron_id TEXT NOT NULL,
+            borrow_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            paid_at TEXT NOT NULL,
+            FOREIGN KEY (borrow_id) REFERENCES borrows (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fee_payments_borrow ON fee_payments (borrow_id)',
+        'CREATE INDEX IF NOT EXISTS idx_fee_payments_transaction ON fee_payments (transaction_id)',
+    ]),
+    (8, 'payment outbox drained by a background worker', [
+        '''
+        CREATE TABLE IF NOT EXISTS payment_outbox (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            patron_id TEXT,
+            book_id INTEGER,
+            transaction_id TEXT,
+            amount REAL NOT NULL,
+            description TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            locked_until TEXT,
+            message TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_payment_outbox_due ON payment_outbox (status, next_attempt_at)',
+    ]),
+    (9, 'payment reconciliation checkpoints and findings', [
+        '''
+        CREATE TABLE IF NOT EXISTS reconciliation_checkpoints (
+            name TEXT PRIMARY KEY,
+            recorded_at TEXT NOT NULL,
+            transaction_id TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reconciliation_issues (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            checked_at TEXT NOT NULL,
+            transaction_id TEXT NOT NULL,
+            recorded_at TEXT NOT NULL,
+            ledger_amount REAL NOT NULL,
+            gateway_status TEXT,
+            gateway_amount REAL,
+            issue TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fee_payments_paid_at ON fee_payments (paid_at, transaction_id)',
+    ]),
+    (10, 'pending fee payment reservations', [
+        # 'pending' rows reserve a loan's fee while its charge is in flight;
+        # their transaction_id holds the reservation reference until it completes
+        "ALTER TABLE fee_payments ADD COLUMN status TEXT NOT NULL DEFAULT 'completed'",
+        "CREATE INDEX IF NOT EXISTS idx_fee_payments_pending ON fee_payments (paid_at) WHERE status = 'pending'",
+    ]),
+    (11, 'payment transactions in commit order for reconciliation', [
+        # One row per recorded charge. seq is assigned under the write lock, so it
+        # follows commit order even when recorded_at (the charge time) does not
+        '''
+        CREATE TABLE IF NOT EXISTS payment_transactions (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT NOT NULL,
+            patron_id TEXT NOT NULL,
+            amount REAL NOT NULL,
+            recorded_at TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_payment_transactions_recorded_at ON payment_transactions (recorded_at)',
+        '''
+        INSERT INTO payment_transactions (transaction_id, patron_id, amount, recorded_at)
+        SELECT transaction_id, patron_id, amount, recorded_at FROM (
+            SELECT transaction_id, MIN(patron_id) AS patron_id,
+                   ROUND(SUM(amount), 2) AS amount, MIN(paid_at) AS recorded_at
+              FROM fee_payments
+             WHERE status = 'completed'
+             GROUP BY transaction_id
+            UNION ALL
+            SELECT o.transaction_id, o.patron_id, o.amount, o.updated_at
+              FROM payment_outbox o
+             WHERE o.kind = 'payment' AND o.status = 'completed' AND o.transaction_id IS NOT NULL
+               AND NOT EXISTS (SELECT 1 FROM fee_payments f WHERE f.transaction_id = o.transaction_id)
+        )
+         ORDER BY recorded_at, transaction_id
+        ''',
+        'ALTER TABLE reconciliation_checkpoints ADD COLUMN seq INTEGER NOT NULL DEFAULT 0',
+        '''
+        UPDATE reconciliation_checkpoints
+           SET seq = (SELECT COALESCE(MAX(t.seq), 0) FROM payment_transactions t
+                       WHERE (t.recorded_at, t.transaction_id)
+                             <= (reconciliation_checkpoints.recorded_at, reconciliation_checkpoints.transaction_id))
+        ''',
+        # The sweep walks seq now; nothing reads fee_payments by paid_at
+        'DROP INDEX IF EXISTS idx_fee_payments_paid_at',
+    ]),
+    (12, 'bump the catalog version once per write transaction', [
+        # Per-row triggers rewrote the counter row for every book or borrow
+        # written; the write helpers now call _bump_catalog_version() instead
+        *(f'DROP TRIGGER IF EXISTS catalog_version_{table}_{event}'
+          for table in ('books', 'borrows') for event in ('insert', 'update', 'delete')),
+        'UPDATE catalog_version SET version = version + 1 WHERE id = 1',
+    ]),
+    (13, 'trigram index for title and author substring search', _migrate_books_trigram),
+]
 
-    conn.commit()
-    conn.close()
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Return the schema version recorded in the database file."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Apply every migration newer than the stored schema version.
+    Returns the schema version after migrating.
+    """
+    for version, description, steps in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+        with immediate_transaction(conn):
+            # Another process may have migrated while we waited for the lock
+            if version <= get_schema_version(conn):
+                continue
+            if callable(steps):
+                steps(conn)
+            else:
+                for statement in steps:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+    return get_schema_version(conn)
+
+def init_database() -> bool:
+    """
+    Initialize the database with required tables.
+    A database already at SCHEMA_VERSION costs one PRAGMA read and is left alone.
+    Returns True if migrations were applied.
+    """
+    with db_connection() as conn:
+        migrated = get_schema_version(conn) < SCHEMA_VERSION
+        if migrated:
+            apply_migrations(conn)
+    BOOK_CACHE.clear()
+    return migrated
 
 def add_sample_data():
     """Add sample data to the database if it's empty."""
-    conn = get_db_connection()
-    book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
-    
-    if book_count == 0:
+    with db_connection() as conn, immediate_transaction(conn):
+        book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
+        if book_count:
+            return
+
         # Add sample books
         sample_books = [
             ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
@@ -77,45 +684,237 @@ def add_sample_data():
         
         # Update available copies for 1984
         conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
-        
-        conn.commit()
-    
-    conn.close()
+        _bump_catalog_version(conn)
+
+# Book lookup cache
+
+def _book_key(book_id) -> Optional[int]:
+    """A book id as the int the cache is keyed by; None if it is not one."""
+    try:
+        return int(book_id)
+    except (TypeError, ValueError):
+        return None
+
+class BookCache:
+    """
+    Bounded, thread-safe LRU cache of book rows with a time-to-live.
+
+    Entries are keyed by (database path, book id) with a secondary ISBN index,
+    so a book fetched by either key serves later lookups by both. Ids are
+    normalized to int, so "7" and 7 share an entry. Only found books are
+    cached; write paths call invalidate() for the rows they touch.
+
+    A reader takes generation() before querying and passes it to put(); if
+    any invalidation happened in between, the row it read may predate that
+    write and is not cached.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[float, Dict]]" = OrderedDict()
+        self._ids_by_isbn: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self) -> int:
+        """Token for put(); it changes on every invalidate() and clear()."""
+        with self._lock:
+            return self._generation
+
+    def _lookup(self, key: Tuple[str, int]) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, book = entry
+        if expires < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return book
+
+    def _drop(self, key: Tuple[str, int]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._ids_by_isbn.pop((key[0], entry[1]['isbn']), None)
+
+    def get_by_id(self, book_id: int) -> Optional[Dict]:
+        """Return a copy of the cached book, or None on a miss."""
+        with self._lock:
+            book = self._lookup((DATABASE, _book_key(book_id)))
+            if book is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(book)
+
+    def get_by_isbn(self, isbn: str) -> Optional[Dict]:
+        """Return a copy of the cached book with this ISBN, or None on a miss."""
+        with self._lock:
+            book_id = self._ids_by_isbn.get((DATABASE, isbn))
+            book = self._lookup((DATABASE, book_id)) if book_id is not None else None
+            if book is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(book)
+
+    def put(self, book: Dict, generation: Optional[int] = None) -> None:
+        """Cache a book row under its id and ISBN, unless invalidated since `generation`."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            key = (DATABASE, _book_key(book['id']))
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, dict(book))
+            self._ids_by_isbn[(DATABASE, book['isbn'])] = key[1]
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, book_id: Optional[int] = None, isbn: Optional[str] = None) -> None:
+        """Forget a book by id and/or ISBN."""
+        with self._lock:
+            self._generation += 1
+            if isbn is not None:
+                indexed_id = self._ids_by_isbn.pop((DATABASE, isbn), None)
+                if indexed_id is not None:
+                    self._drop((DATABASE, indexed_id))
+            if book_id is not None:
+                self._drop((DATABASE, _book_key(book_id)))
+
+    def clear(self) -> None:
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._ids_by_isbn.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, object]:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+BOOK_CACHE = BookCache()
+
+def configure_book_cache(maxsize: int, ttl: float) -> None:
+    """Resize the book cache and change its TTL; existing entries are dropped."""
+    BOOK_CACHE.clear()
+    BOOK_CACHE.maxsize = int(maxsize)
+    BOOK_CACHE.ttl = float(ttl)
 
 # Helper Functions for Database Operations
 
+def _bump_catalog_version(conn: sqlite3.Connection) -> None:
+    """Bump the catalog version inside the caller's write transaction; call once per transaction."""
+    conn.execute('UPDATE catalog_version SET version = version + 1 WHERE id = 1')
+
+def bump_catalog_version() -> None:
+    """Bump the catalog version after writing books or borrows without these helpers (scripts, tools)."""
+    with db_connection() as conn:
+        _bump_catalog_version(conn)
+        conn.commit()
+
+def get_catalog_version() -> int:
+    """
+    Current catalog version. Every helper that writes book, borrow or
+    fee_payments rows bumps it once per transaction, so it can key HTTP
+    validators for catalog, search and fee pages.
+    """
+    with read_connection() as conn:
+        row = conn.execute('SELECT version FROM catalog_version WHERE id = 1').fetchone()
+    return row['version'] if row else 0
+
 def get_all_books() -> List[Dict]:
     """Get all books from the database."""
-    conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
-    conn.close()
+    with read_connection() as conn:
+        books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
     return [dict(book) for book in books]
 
+def get_books_page(limit: int, after: Optional[Tuple[str, int]] = None,
+                   before: Optional[Tuple[str, int]] = None) -> Tuple[List[Dict], bool]:
+    """
+    Get one page of books ordered by (title, id) using keyset pagination.
+
+    Args:
+        limit: page size
+        after: (title, id) of the last row of the previous page, to page forward
+        before: (title, id) of the first row of the next page, to page backward
+
+    Returns:
+        tuple: (books in title order, whether more rows exist past this page
+                in the direction of travel)
+    """
+    if before is not None:
+        where, order, params = 'WHERE (title, id) < (?, ?)', 'title DESC, id DESC', list(before)
+    elif after is not None:
+        where, order, params = 'WHERE (title, id) > (?, ?)', 'title, id', list(after)
+    else:
+        where, order, params = '', 'title, id', []
+
+    # Fetch one extra row to learn whether another page follows
+    with read_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT * FROM books {where} ORDER BY {order} LIMIT ?
+        ''', (*params, limit + 1)).fetchall()
+
+    books = [dict(row) for row in rows[:limit]]
+    if before is not None:
+        books.reverse()
+    return books, len(rows) > limit
+
 def get_book_by_id(book_id: int) -> Optional[Dict]:
-    """Get a specific book by ID."""
-    conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    """Get a specific book by ID (served from BOOK_CACHE when possible)."""
+    cached = BOOK_CACHE.get_by_id(book_id)
+    if cached is not None:
+        return cached
+    generation = BOOK_CACHE.generation()
+    with read_connection() as conn:
+        book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+    if not book:
+        return None
+    BOOK_CACHE.put(dict(book), generation)
+    return dict(book)
 
 def get_book_by_isbn(isbn: str) -> Optional[Dict]:
-    """Get a specific book by ISBN."""
-    conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    """Get a specific book by ISBN (served from BOOK_CACHE when possible)."""
+    cached = BOOK_CACHE.get_by_isbn(isbn)
+    if cached is not None:
+        return cached
+    generation = BOOK_CACHE.generation()
+    with read_connection() as conn:
+        book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
+    if not book:
+        return None
+    BOOK_CACHE.put(dict(book), generation)
+    return dict(book)
 
 def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     """Get currently borrowed books for a patron."""
-    conn = get_db_connection()
-    records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrows br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ? AND br.return_date IS NULL
-        ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
-    conn.close()
+    with read_connection() as conn:
+        records = conn.execute('''
+            SELECT br.*, b.title, b.author 
+            FROM borrows br 
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = ? AND br.return_date IS NULL
+            ORDER BY br.borrow_date
+        ''', (patron_id,)).fetchall()
 
     borrowed_books = []
     for record in records:
@@ -135,18 +934,17 @@ def get_borrow_history_for_patron(patron_id: str) -> List[Dict]:
     Full borrowing history (returned and active) for a patron.
     Returns newest first. Dates are returned as Python datetime objects.
     """
-    conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT br.*, b.title, b.author
-          FROM borrows br
-          JOIN books b ON b.id = br.book_id
-         WHERE br.patron_id = ?
-         ORDER BY br.borrow_date DESC
-        """,
-        (patron_id,),
-    ).fetchall()
-    conn.close()
+    with read_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT br.*, b.title, b.author
+              FROM borrows br
+              JOIN books b ON b.id = br.book_id
+             WHERE br.patron_id = ?
+             ORDER BY br.borrow_date DESC
+            """,
+            (patron_id,),
+        ).fetchall()
 
     history: List[Dict] = []
     for r in rows:
@@ -160,75 +958,575 @@ def get_borrow_history_for_patron(patron_id: str) -> List[Dict]:
         })
     return history
 
+def get_patron_loans(patron_id: str) -> List[Dict]:
+    """
+    Every loan (returned and active) for a patron with its book's title and
+    author and the late fees paid (or reserved) against it, in one query.
+    Returns newest first; dates are datetime objects and return_date is None
+    for active loans.
+    """
+    with read_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT br.id, br.book_id, br.borrow_date, br.due_date, br.return_date,
+                   b.title, b.author,
+                   (SELECT COALESCE(SUM(amount), 0) FROM fee_payments WHERE borrow_id = br.id) AS paid
+              FROM borrows br
+              JOIN books b ON b.id = br.book_id
+             WHERE br.patron_id = ?
+             ORDER BY br.borrow_date DESC
+            """,
+            (patron_id,),
+        ).fetchall()
+
+    return [{
+        "borrow_id": r["id"],
+        "book_id": r["book_id"],
+        "title": r["title"],
+        "author": r["author"],
+        "borrow_date": datetime.fromisoformat(r["borrow_date"]),
+        "due_date": datetime.fromisoformat(r["due_date"]),
+        "return_date": datetime.fromisoformat(r["return_date"]) if r["return_date"] else None,
+        "paid": r["paid"],
+    } for r in rows]
+
+def get_patron_unpaid_loans(patron_id: str) -> List[Dict]:
+    """
+    Active loans for a patron with the late fees already paid (or reserved
+    by a charge in flight) against each, in one query. Oldest loans first;
+    due_date is a datetime.
+    """
+    with read_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT br.id AS borrow_id, br.book_id, br.due_date, b.title,
+                   COALESCE(p.paid, 0) AS paid
+              FROM borrows br
+              JOIN books b ON b.id = br.book_id
+              LEFT JOIN (SELECT borrow_id, SUM(amount) AS paid
+                           FROM fee_payments
+                          GROUP BY borrow_id) p ON p.borrow_id = br.id
+             WHERE br.patron_id = ? AND br.return_date IS NULL
+             ORDER BY br.borrow_date, br.id
+            """,
+            (patron_id,),
+        ).fetchall()
+
+    return [{
+        "borrow_id": r["borrow_id"],
+        "book_id": r["book_id"],
+        "title": r["title"],
+        "due_date": datetime.fromisoformat(r["due_date"]),
+        "paid": r["paid"],
+    } for r in rows]
+
+def _record_payment_transaction(conn: sqlite3.Connection, transaction_id: str, patron_id: str,
+                                amount: float, recorded_at: datetime) -> None:
+    """Append a completed charge to payment_transactions, which reconciliation walks by seq."""
+    conn.execute('''
+        INSERT INTO payment_transactions (transaction_id, patron_id, amount, recorded_at)
+        VALUES (?, ?, ROUND(?, 2), ?)
+    ''', (transaction_id, patron_id, amount, recorded_at.isoformat()))
+
+def insert_fee_payment_allocations(transaction_id: str, patron_id: str,
+                                   allocations: List[Tuple[int, int, float]], paid_at: datetime) -> bool:
+    """Record how one gateway transaction is split across (borrow_id, book_id, amount) loans."""
+    with db_connection() as conn:
+        try:
+            with immediate_transaction(conn):
+                conn.executemany('''
+                    INSERT INTO fee_payments (transaction_id, patron_id, borrow_id, book_id, amount, paid_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [(transaction_id, patron_id, borrow_id, book_id, amount, paid_at.isoformat())
+                      for borrow_id, book_id, amount in allocations])
+                _record_payment_transaction(conn, transaction_id, patron_id,
+                                            sum(amount for _, _, amount in allocations), paid_at)
+                _bump_catalog_version(conn)
+            return True
+        except sqlite3.Error:
+            return False
+
+def reserve_fee_payments(reference: str, patron_id: str,
+                         allocations: List[Tuple[int, int, float, float]], reserved_at: datetime) -> bool:
+    """
+    Reserve late fees before charging them.
+
+    allocations are (borrow_id, book_id, amount, paid) where paid is what the
+    caller saw already paid or reserved against the loan. Under the write lock
+    every loan must still be active with that same paid total; then one
+    'pending' fee_payments row per loan is written under `reference`, so
+    concurrent payers cannot reserve the same fee twice.
+
+    Returns:
+        bool: False if a loan changed (returned, paid or reserved meanwhile)
+    """
+    if not allocations:
+        return False
+    with db_connection() as conn:
+        with immediate_transaction(conn):
+            for borrow_id, _, _, paid in allocations:
+                row = conn.execute('''
+                    SELECT (SELECT COALESCE(SUM(amount), 0) FROM fee_payments WHERE borrow_id = br.id) AS paid
+                      FROM borrows br
+                     WHERE br.id = ? AND br.patron_id = ? AND br.return_date IS NULL
+                ''', (borrow_id, patron_id)).fetchone()
+                if row is None or abs(row['paid'] - paid) > 0.005:
+                    return False
+            conn.executemany('''
+                INSERT INTO fee_payments (transaction_id, patron_id, borrow_id, book_id, amount, paid_at, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'pending')
+            ''', [(reference, patron_id, borrow_id, book_id, amount, reserved_at.isoformat())
+                  for borrow_id, book_id, amount, _ in allocations])
+            _bump_catalog_version(conn)
+    return True
+
+def complete_fee_payments(reference: str, transaction_id: str, paid_at: datetime) -> bool:
+    """
+    Turn the pending rows of a reservation into payments of transaction_id,
+    and record the charge in payment_transactions. Completing a reservation
+    that is no longer pending does nothing.
+    Returns False on a database error; the rows then stay reserved.
+    """
+    with db_connection() as conn:
+        try:
+            with immediate_transaction(conn):
+                reserved = conn.execute('''
+                    SELECT MIN(patron_id) AS patron_id, SUM(amount) AS amount FROM fee_payments
+                     WHERE transaction_id = ? AND status = 'pending'
+                ''', (reference,)).fetchone()
+                if reserved['patron_id'] is not None:
+                    conn.execute('''
+                        UPDATE fee_payments SET transaction_id = ?, status = 'completed', paid_at = ?
+                         WHERE transaction_id = ? AND status = 'pending'
+                    ''', (transaction_id, paid_at.isoformat(), reference))
+                    _record_payment_transaction(conn, transaction_id, reserved['patron_id'],
+                                                reserved['amount'], paid_at)
+                    _bump_catalog_version(conn)
+            return True
+        except sqlite3.Error:
+            return False
+
+def release_fee_payments(reference: str) -> None:
+    """Drop a reservation whose charge was declined, so the fees are owed again."""
+    with db_connection() as conn:
+        with immediate_transaction(conn):
+            deleted = conn.execute("DELETE FROM fee_payments WHERE transaction_id = ? AND status = 'pending'",
+                                   (reference,)).rowcount
+            if deleted:
+                _bump_catalog_version(conn)
+
+def get_stale_fee_reservations(reserved_before: datetime) -> List[Dict]:
+    """
+    Reservations pending since before `reserved_before`, one row per reference:
+    {'reference', 'patron_id', 'amount', 'reserved_at'}.
+    """
+    with read_connection() as conn:
+        rows = conn.execute('''
+            SELECT transaction_id AS reference, patron_id, ROUND(SUM(amount), 2) AS amount,
+                   MIN(paid_at) AS reserved_at
+              FROM fee_payments
+             WHERE status = 'pending' AND paid_at < ?
+             GROUP BY transaction_id, patron_id
+             ORDER BY reserved_at
+        ''', (reserved_before.isoformat(),)).fetchall()
+    return [dict(row) for row in rows]
+
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
-    conn = get_db_connection()
-    count = conn.execute('''
-        SELECT COUNT(*) as count FROM borrows 
-        WHERE patron_id = ? AND return_date IS NULL
-    ''', (patron_id,)).fetchone()['count']
-    conn.close()
+    with read_connection() as conn:
+        count = conn.execute('''
+            SELECT COUNT(*) as count FROM borrows 
+            WHERE patron_id = ? AND return_date IS NULL
+        ''', (patron_id,)).fetchone()['count']
     return count
 
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
     """Insert a new book into the database."""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO books (title, author, isbn, total_copies, available_copies)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (title, author, isbn, total_copies, available_copies))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
-        return False
+    with db_connection() as conn:
+        try:
+            conn.execute('''
+                INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (title, author, isbn, total_copies, available_copies))
+            _bump_catalog_version(conn)
+            conn.commit()
+            BOOK_CACHE.invalidate(isbn=isbn)
+            return True
+        except Exception as e:
+            conn.rollback()
+            return False
+
+# SQLite's default limit on bound parameters per statement is 999
+_MAX_SQL_VARIABLES = 900
+
+def insert_books_bulk(books: List[Tuple[str, str, str, int]]) -> List[str]:
+    """
+    Insert many (title, author, isbn, total_copies) rows in one transaction.
+
+    ISBNs that already exist are skipped; the existence check and the insert
+    run under the same write lock, so a concurrent add cannot slip in between.
+
+    Returns:
+        list: the ISBNs that were skipped because they already exist
+    """
+    if not books:
+        return []
+
+    with db_connection() as conn:
+        with immediate_transaction(conn):
+            existing = set()
+            isbns = [b[2] for b in books]
+            for start in range(0, len(isbns), _MAX_SQL_VARIABLES):
+                chunk = isbns[start:start + _MAX_SQL_VARIABLES]
+                placeholders = ', '.join('?' * len(chunk))
+                rows = conn.execute(f'SELECT isbn FROM books WHERE isbn IN ({placeholders})', chunk).fetchall()
+                existing.update(row['isbn'] for row in rows)
+
+            cur = conn.executemany('''
+                INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                VALUES (?, ?, ?, ?, ?)
+            ''', ((title, author, isbn, copies, copies)
+                  for title, author, isbn, copies in books if isbn not in existing))
+            if cur.rowcount:
+                _bump_catalog_version(conn)
+
+    return [isbn for isbn in isbns if isbn in existing]
 
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO borrows (patron_id, book_id, borrow_date, due_date, return_date)
-            VALUES (?, ?, ?, ?, NULL)
-        ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
-        return False
+    with db_connection() as conn:
+        try:
+            conn.execute('''
+                INSERT INTO borrows (patron_id, book_id, borrow_date, due_date, return_date)
+                VALUES (?, ?, ?, ?, NULL)
+            ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+            _bump_catalog_version(conn)
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            return False
 
 def update_book_availability(book_id: int, change: int) -> bool:
     """Update the available copies of a book by a given amount (+1 for return, -1 for borrow)."""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            UPDATE books SET available_copies = available_copies + ? WHERE id = ?
-        ''', (change, book_id))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
-        return False
+    with db_connection() as conn:
+        try:
+            conn.execute('''
+                UPDATE books SET available_copies = available_copies + ? WHERE id = ?
+            ''', (change, book_id))
+            _bump_catalog_version(conn)
+            conn.commit()
+            BOOK_CACHE.invalidate(book_id=book_id)
+            return True
+        except Exception as e:
+            conn.rollback()
+            return False
 
 def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
     """Update the return date for a borrow record."""
-    conn = get_db_connection()
+    with db_connection() as conn:
+        try:
+            cur = conn.execute('''
+                UPDATE borrows
+                   SET return_date = ?
+                 WHERE patron_id = ?
+                   AND book_id = ?
+                   AND return_date IS NULL
+            ''', (return_date.isoformat(), patron_id, book_id))
+            if cur.rowcount:
+                _bump_catalog_version(conn)
+            conn.commit()
+            return cur.rowcount > 0   # success only if we actually updated a row
+        except Exception as e:
+            conn.rollback()
+            return False
+
+# Transactional circulation paths
+
+def _fetch_books(conn: sqlite3.Connection, book_ids: List[int]) -> Dict[int, Dict]:
+    """Read the given books in as few statements as possible, keyed by id."""
+    unique_ids = list(dict.fromkeys(book_ids))
+    books: Dict[int, Dict] = {}
+    for start in range(0, len(unique_ids), _MAX_SQL_VARIABLES):
+        chunk = unique_ids[start:start + _MAX_SQL_VARIABLES]
+        placeholders = ', '.join('?' * len(chunk))
+        for row in conn.execute(f'SELECT * FROM books WHERE id IN ({placeholders})', chunk):
+            books[row['id']] = dict(row)
+    return books
+
+def borrow_books_transaction(patron_id: str, book_ids: List[int], borrow_date: datetime,
+                             due_date: datetime, max_borrowed: int = 5) -> Tuple[str, List[Dict]]:
+    """
+    Check out several books for one patron in a single transaction.
+
+    Every item is reported as {'book_id', 'status', 'book'} where status is
+    'ok', 'not_found', 'unavailable' or 'limit_reached', and book is the row as
+    read before the checkout. The borrowing limit applies to the batch as a
+    whole: if the patron's active loans plus every available item would exceed
+    max_borrowed, nothing is written and the available items are marked
+    'limit_reached'.
+
+    Returns:
+        tuple: (status, items) where status is 'ok', 'limit_reached' or
+               'error' (items is empty on error)
+    """
+    with db_connection() as conn:
+        try:
+            with immediate_transaction(conn):
+                books = _fetch_books(conn, book_ids)
+                remaining = {book_id: book['available_copies'] for book_id, book in books.items()}
+
+                items: List[Dict] = []
+                for book_id in book_ids:
+                    book = books.get(book_id)
+                    if book is None:
+                        status = 'not_found'
+                    elif remaining[book_id] <= 0:
+                        status = 'unavailable'
+                    else:
+                        remaining[book_id] -= 1
+                        status = 'ok'
+                    items.append({'book_id': book_id, 'status': status, 'book': book})
+
+                eligible = [item for item in items if item['status'] == 'ok']
+                if not eligible:
+                    return 'ok', items
+
+                count = conn.execute('''
+                    SELECT COUNT(*) AS count FROM borrows
+                    WHERE patron_id = ? AND return_date IS NULL
+                ''', (patron_id,)).fetchone()['count']
+                if count + len(eligible) > max_borrowed:
+                    for item in eligible:
+                        item['status'] = 'limit_reached'
+                    return 'limit_reached', items
+
+                for item in eligible:
+                    # Conditional decrement: never oversell the last copy
+                    cur = conn.execute('''
+                        UPDATE books SET available_copies = available_copies - 1
+                        WHERE id = ? AND available_copies > 0
+                    ''', (item['book_id'],))
+                    if cur.rowcount == 0:
+                        item['status'] = 'unavailable'
+
+                conn.executemany('''
+                    INSERT INTO borrows (patron_id, book_id, borrow_date, due_date, return_date)
+                    VALUES (?, ?, ?, ?, NULL)
+                ''', [(patron_id, item['book_id'], borrow_date.isoformat(), due_date.isoformat())
+                      for item in eligible if item['status'] == 'ok'])
+                if any(item['status'] == 'ok' for item in eligible):
+                    _bump_catalog_version(conn)
+            for item in eligible:
+                BOOK_CACHE.invalidate(book_id=item['book_id'])
+            return 'ok', items
+        except sqlite3.Error:
+            return 'error', []
+
+def borrow_book_transaction(patron_id: str, book_id: int, borrow_date: datetime,
+                            due_date: datetime, max_borrowed: int = 5) -> Tuple[str, Optional[Dict]]:
+    """
+    Check out one copy of a book in a single transaction.
+
+    Returns (status, book) where status is one of 'ok', 'not_found',
+    'unavailable', 'limit_reached' or 'error'. The book dict reflects the row
+    as read before the checkout.
+    """
+    status, items = borrow_books_transaction(patron_id, [book_id], borrow_date, due_date, max_borrowed)
+    if status == 'error':
+        return 'error', None
+    return items[0]['status'], items[0]['book']
+
+def return_books_transaction(patron_id: str, book_ids: List[int], return_date: datetime) -> Tuple[str, List[Dict]]:
+    """
+    Check in several books for one patron in a single transaction.
+
+    Each listed book closes the patron's oldest active loan of it and
+    restocks one copy. Every item is reported as {'book_id', 'status', 'book'}
+    where status is 'ok', 'not_found' or 'no_active_borrow'.
+
+    Returns:
+        tuple: (status, items) where status is 'ok' or 'error' (items is
+               empty on error)
+    """
+    with db_connection() as conn:
+        try:
+            with immediate_transaction(conn):
+                books = _fetch_books(conn, book_ids)
+                items: List[Dict] = []
+                for book_id in book_ids:
+                    book = books.get(book_id)
+                    if book is None:
+                        items.append({'book_id': book_id, 'status': 'not_found', 'book': None})
+                        continue
+
+                    cur = conn.execute('''
+                        UPDATE borrows
+                           SET return_date = ?
+                         WHERE id = (SELECT id FROM borrows
+                                      WHERE patron_id = ?
+                                        AND book_id = ?
+                                        AND return_date IS NULL
+                                      ORDER BY id
+                                      LIMIT 1)
+                    ''', (return_date.isoformat(), patron_id, book_id))
+                    if cur.rowcount == 0:
+                        items.append({'book_id': book_id, 'status': 'no_active_borrow', 'book': book})
+                        continue
+
+                    conn.execute('''
+                        UPDATE books SET available_copies = available_copies + 1 WHERE id = ?
+                    ''', (book_id,))
+                    items.append({'book_id': book_id, 'status': 'ok', 'book': book})
+                if any(item['status'] == 'ok' for item in items):
+                    _bump_catalog_version(conn)
+            for item in items:
+                if item['status'] == 'ok':
+                    BOOK_CACHE.invalidate(book_id=item['book_id'])
+            return 'ok', items
+        except sqlite3.Error:
+            return 'error', []
+
+def return_book_transaction(patron_id: str, book_id: int, return_date: datetime) -> Tuple[str, Optional[Dict]]:
+    """
+    Close the active loan for (patron_id, book_id) and restock the copy in a
+    single transaction.
+
+    Returns (status, book) where status is one of 'ok', 'not_found',
+    'no_active_borrow' or 'error'.
+    """
+    status, items = return_books_transaction(patron_id, [book_id], return_date)
+    if status == 'error':
+        return 'error', None
+    return items[0]['status'], items[0]['book']
+
+# Catalog search
+
+def _fts_query(term: str, prefix: bool) -> str:
+    """
+    Turn free text into an FTS5 MATCH expression: every word must match, each
+    word is quoted so user input cannot inject FTS syntax, and with prefix=True
+    the last-typed fragments also match longer words ("gats" -> "gatsby").
+    """
+    words = re.findall(r'\w+', term)
+    return ' '.join(f'"{w}"*' if prefix else f'"{w}"' for w in words)
+
+def _has_books_fts(conn: sqlite3.Connection, index: str = 'books_fts') -> bool:
+    """Return True if the books_fts index from migration 3 (or another one, e.g. books_trigram) exists."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (index,)
+    ).fetchone() is not None
+
+# The trigram tokenizer cannot match substrings shorter than this
+TRIGRAM_MIN_LENGTH = 3
+
+def _search_sql(conn: sqlite3.Connection, term: str, search_type: str,
+                prefix: bool = True) -> Optional[Tuple[str, List]]:
+    """
+    Build the ordered, unbounded SELECT for a search, or None when the search
+    cannot match anything.
+
+    - title/author: case-insensitive substring match, folding non-ASCII
+      letters too ("élan" finds "Élan"), through the books_trigram index;
+      terms under TRIGRAM_MIN_LENGTH characters, or builds without the
+      index, scan books instead
+    - isbn: exact match through the UNIQUE isbn index
+    - fulltext: FTS5 match ranked by BM25 (title weighs twice as much as
+      author); substring match on either column if FTS5 is unavailable
+    """
+    if search_type == 'isbn':
+        return 'SELECT * FROM books WHERE isbn = ? ORDER BY title, id', [term]
+
+    if search_type in ('title', 'author'):
+        if len(term) >= TRIGRAM_MIN_LENGTH and _has_books_fts(conn, 'books_trigram'):
+            phrase = term.replace('"', '""')
+            return ('''
+                SELECT b.* FROM books_trigram
+                  JOIN books b ON b.id = books_trigram.rowid
+                 WHERE books_trigram MATCH ?
+                 ORDER BY b.title, b.id
+            ''', [f'{search_type} : "{phrase}"'])
+        return (f'SELECT * FROM books WHERE instr(casefold({search_type}), ?) > 0 ORDER BY title, id',
+                [term.casefold()])
+
+    if search_type == 'fulltext':
+        query = _fts_query(term, prefix)
+        if not query:
+            return None
+        if _has_books_fts(conn):
+            return ('''
+                SELECT b.* FROM books_fts
+                  JOIN books b ON b.id = books_fts.rowid
+                 WHERE books_fts MATCH ?
+                 ORDER BY bm25(books_fts, 2.0, 1.0), b.id
+            ''', [query])
+        folded = term.casefold()
+        return ('''
+            SELECT * FROM books
+             WHERE instr(casefold(title), ?) > 0 OR instr(casefold(author), ?) > 0
+             ORDER BY title, id
+        ''', [folded, folded])
+
+    return None
+
+def search_books(term: str, search_type: str, limit: int, offset: int = 0,
+                 prefix: bool = True) -> List[Dict]:
+    """
+    Search books in SQL and return one bounded page of matches.
+    See _search_sql() for how each search type matches and orders rows.
+    """
+    with read_connection() as conn:
+        built = _search_sql(conn, term, search_type, prefix)
+        if built is None:
+            return []
+        sql, params = built
+        rows = conn.execute(f'{sql} LIMIT ? OFFSET ?', (*params, limit, offset)).fetchall()
+    return [dict(row) for row in rows]
+
+def search_books_fulltext(term: str, limit: int, offset: int = 0, prefix: bool = True) -> List[Dict]:
+    """Full-text search over title and author, ranked by relevance."""
+    return search_books(term, 'fulltext', limit, offset, prefix=prefix)
+
+# Streaming reads
+
+STREAM_BATCH_SIZE = 500
+
+def _iter_rows(sql: str, params: List, batch_size: int) -> Iterator[Dict]:
+    """Yield rows of a query as dicts, holding at most batch_size rows at once."""
+    conn = READ_POOL.acquire()
+    cur = conn.cursor()
     try:
-        cur = conn.execute('''
-            UPDATE borrows
-               SET return_date = ?
-             WHERE patron_id = ?
-               AND book_id = ?
-               AND return_date IS NULL
-        ''', (return_date.isoformat(), patron_id, book_id))
-        conn.commit()
-        rowcount = cur.rowcount
-        conn.close()
-        return rowcount > 0   # success only if we actually updated a row
-    except Exception as e:
-        conn.close()
-        return False
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        # Close the cursor first so a stream abandoned midway ends its read snapshot
+        cur.close()
+        READ_POOL.release(conn)
+
+def iter_search_books(term: str, search_type: str, offset: int = 0, limit: Optional[int] = None,
+                      prefix: bool = True, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict]:
+    """
+    Stream every match of a search, optionally windowed by offset/limit.
+
+    Borrows its own reader rather than the request-scoped one, because a
+    streamed response is still being consumed after the view function returns.
+    """
+    conn = READ_POOL.acquire()
+    try:
+        built = _search_sql(conn, term, search_type, prefix)
+    finally:
+        READ_POOL.release(conn)
+    if built is None:
+        return
+    sql, params = built
+    yield from _iter_rows(f'{sql} LIMIT ? OFFSET ?', [*params, -1 if limit is None else limit, offset],
+                          batch_size)
+
+def iter_all_books(batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict]:
+    """Stream the whole books table in id order."""
+    yield from _iter_rows('SELECT * FROM books ORDER BY id', [], batch_size)
@@ -0,0 +1,143 @@
+"""
+Request metrics - per-endpoint latency histograms, in-flight gauges and
+status code counters, served at /metrics in the Prometheus text format.
+
+Figures are kept in memory per process; with several worker processes each
+one reports its own, so scrape them individually or aggregate downstream.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+from flask import Response, g, request
+
+# Upper bounds in seconds; an implicit +Inf bucket follows the last one
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Label for requests that matched no route (404s, bad methods)
+UNMATCHED_ENDPOINT = 'unmatched'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class RequestMetrics:
+    """
+    Thread-safe request statistics keyed by Flask endpoint.
+
+    Recording a request is a bisect and a few dict updates under one lock;
+    the text rendering is only done when /metrics is scraped.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # endpoint -> per-bucket (non-cumulative) counts, last slot is +Inf
+        self._bucket_counts: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = defaultdict(float)
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._responses: Dict[Tuple[str, int], int] = defaultdict(int)
+
+    def request_started(self, endpoint: str) -> None:
+        with self._lock:
+            self._in_flight[endpoint] += 1
+
+    def request_finished(self, endpoint: str, status: int, seconds: float) -> None:
+        slot = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._in_flight[endpoint] -= 1
+            counts = self._bucket_counts.get(endpoint)
+            if counts is None:
+                counts = self._bucket_counts[endpoint] = [0] * (len(self.buckets) + 1)
+            counts[slot] += 1
+            self._sums[endpoint] += seconds
+            self._responses[(endpoint, status)] += 1
+
+    def in_flight(self, endpoint: str) -> int:
+        with self._lock:
+            return self._in_flight.get(endpoint, 0)
+
+    def snapshot(self) -> Dict:
+        """Copy of the raw figures: {'buckets', 'sums', 'in_flight', 'responses'}."""
+        with self._lock:
+            return {
+                'buckets': {e: list(c) for e, c in self._bucket_counts.items()},
+                'sums': dict(self._sums),
+                'in_flight': dict(self._in_flight),
+                'responses': dict(self._responses),
+            }
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        data = self.snapshot()
+        lines = [
+            '# HELP library_http_request_duration_seconds Request latency by Flask endpoint.',
+            '# TYPE library_http_request_duration_seconds histogram',
+        ]
+        bounds = [_format_number(b) for b in self.buckets] + ['+Inf']
+        for endpoint in sorted(data['buckets']):
+            label = f'endpoint="{_escape(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(bounds, data['buckets'][endpoint]):
+                cumulative += count
+                lines.append(f'library_http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'library_http_request_duration_seconds_sum{{{label}}} {data["sums"][endpoint]!r}')
+            lines.append(f'library_http_request_duration_seconds_count{{{label}}} {cumulative}')
+
+        lines += [
+            '# HELP library_http_requests_in_flight Requests currently being handled by Flask endpoint.',
+            '# TYPE library_http_requests_in_flight gauge',
+        ]
+        for endpoint in sorted(data['in_flight']):
+            lines.append(f'library_http_requests_in_flight{{endpoint="{_escape(endpoint)}"}} '
+                         f'{data["in_flight"][endpoint]}')
+
+        lines += [
+            '# HELP library_http_responses_total Responses by Flask endpoint and status code.',
+            '# TYPE library_http_responses_total counter',
+        ]
+        for (endpoint, status), count in sorted(data['responses'].items()):
+            lines.append(f'library_http_responses_total{{endpoint="{_escape(endpoint)}",status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def init_app(app) -> RequestMetrics:
+    """Record every request of the app and serve the figures at /metrics."""
+    metrics = RequestMetrics(app.config.get('METRICS_BUCKETS', DEFAULT_BUCKETS))
+    app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_endpoint = request.endpoint or UNMATCHED_ENDPOINT
+        g._metrics_started = time.perf_counter()
+        metrics.request_started(g._metrics_endpoint)
+
+    @app.after_request
+    def _remember_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _stop_timer(exc):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        # No status means the request failed before a response was made
+        metrics.request_finished(g._metrics_endpoint, g.pop('_metrics_status', 500),
+                                 time.perf_counter() - started)
+
+    def metrics_view():
+        return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    return metrics
@@ -2,8 +2,22 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from services.library_service import calculate_late_fee_for_book, search_books_in_catalog
+import io
+from datetime import date
+
+from flask import Blueprint, current_app, jsonify, request
+from database import iter_all_books, MAX_SQLITE_INTEGER
+from services.fee_ledger import run_fee_ledger, get_fee_ledger
+from services.catalog_import import import_books, detect_format, IMPORT_BATCH_SIZE
+from services.payment_outbox import get_outbox_entry, IdempotencyKeyConflict
+from services.library_service import (
+    calculate_late_fee_for_book, pay_late_fees, refund_late_fee_payment, search_books_in_catalog, iter_search_results,
+    borrow_books_by_patron, return_books_by_patron, get_patron_status_report,
+    SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE
+)
+from routes.helpers import (
+    int_arg, ndjson_response, wants_ndjson, catalog_etag, not_modified, with_etag
+)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -12,28 +26,233 @@ def get_late_fee(patron_id, book_id):
     """
     Calculate late fee for a specific book borrowed by a patron.
     API endpoint for R4: Late Fee Calculation
+    
+    Fees change with the loan rows and with the calendar day, so the ETag
+    covers both.
     """
+    etag = catalog_etag(date.today().isoformat())
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
     result = calculate_late_fee_for_book(patron_id, book_id)
-    return jsonify(result), 501 if 'not implemented' in result.get('status', '') else 200
+    response = jsonify(result)
+    response.status_code = 501 if 'not implemented' in result.get('status', '') else 200
+    return with_etag(response, etag)
+
+@api_bp.route('/late_fee/<patron_id>/<int:book_id>/pay', methods=['POST'])
+def pay_late_fee(patron_id, book_id):
+    """
+    Queue a late fee payment on the payment worker pool.
+    Returns 202 with a payment id to poll at /api/payments/<payment_id>.
+
+    With an Idempotency-Key header the payment goes to the durable outbox
+    instead: it survives restarts, and repeating the request with the same
+    key returns the payment queued the first time. Keys are scoped to the
+    patron and book.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if key:
+        try:
+            success, outbox_id, message = pay_late_fees(patron_id, book_id, None, defer=True,
+                                                        idempotency_key=f'late_fee:{patron_id}:{book_id}:{key}')
+        except IdempotencyKeyConflict as exc:
+            return jsonify({'error': str(exc)}), 409
+        if not success:
+            return jsonify({'error': message}), 400
+        return jsonify({'payment_id': outbox_id, 'status': 'pending'}), 202
+
+    executor = current_app.extensions['payment_executor']
+    job_id, _ = executor.submit_late_fee_payment(patron_id, book_id)
+    return jsonify({'payment_id': job_id, 'status': 'pending'}), 202
+
+@api_bp.route('/patron/<patron_id>/late_fees/pay', methods=['POST'])
+def pay_all_late_fees_api(patron_id):
+    """
+    Queue one aggregated payment covering all of a patron's outstanding late fees.
+    Returns 202 with a payment id to poll at /api/payments/<payment_id>.
+    """
+    executor = current_app.extensions['payment_executor']
+    job_id, _ = executor.submit_pay_all_late_fees(patron_id)
+    return jsonify({'payment_id': job_id, 'status': 'pending'}), 202
+
+@api_bp.route('/payments/<transaction_id>/refund', methods=['POST'])
+def refund_payment_api(transaction_id):
+    """
+    Queue a refund in the payment outbox. Body: {"amount": 5.0}.
+    An Idempotency-Key header (scoped to the transaction) makes repeated
+    requests return the same refund; reusing it for another amount is a 409.
+    """
+    data = request.get_json(silent=True) or {}
+    key = request.headers.get('Idempotency-Key')
+    try:
+        success, result = refund_late_fee_payment(
+            transaction_id, data.get('amount'), None, defer=True,
+            idempotency_key=f'refund:{transaction_id}:{key}' if key else None)
+    except IdempotencyKeyConflict as exc:
+        return jsonify({'error': str(exc)}), 409
+    if not success:
+        return jsonify({'error': result}), 400
+    return jsonify({'payment_id': result, 'status': 'pending'}), 202
+
+@api_bp.route('/payments/<payment_id>')
+def get_payment_status(payment_id):
+    """Report whether a queued payment is pending, completed or failed."""
+    if payment_id.startswith('out_'):
+        status = get_outbox_entry(payment_id)
+    else:
+        status = current_app.extensions['payment_executor'].job_status(payment_id)
+    if status is None:
+        return jsonify({'error': 'Payment not found'}), 404
+    return jsonify(status)
+
+@api_bp.route('/patron/<patron_id>/status')
+def patron_status_api(patron_id):
+    """
+    Patron status report as JSON.
+    API endpoint for R7: Patron Status Report
+    """
+    report = get_patron_status_report(patron_id)
+    return jsonify(report), 400 if 'error' in report else 200
 
 @api_bp.route('/search')
 def search_books_api():
     """
     Search for books via API endpoint.
     Alternative API interface for R5: Book Search Functionality
+    
+    With stream=1 or "Accept: application/x-ndjson" every match is streamed,
+    one book per line, instead of one JSON page.
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    limit = int_arg('limit', SEARCH_PAGE_SIZE, minimum=1, maximum=MAX_SEARCH_PAGE_SIZE)
+    offset = int_arg('offset', 0, maximum=MAX_SQLITE_INTEGER)
+    prefix = request.args.get('prefix', '1') != '0'
     
     if not search_term:
         return jsonify({'error': 'Search term is required'}), 400
     
-    # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    stream = wants_ndjson()
+    etag = catalog_etag('ndjson' if stream else 'json')
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    if stream:
+        # Only bounded when the client passes an explicit limit
+        stream_limit = int_arg('limit', 0, minimum=0, maximum=MAX_SQLITE_INTEGER) or None
+        response = ndjson_response(iter_search_results(search_term, search_type, offset=offset,
+                                                       limit=stream_limit, prefix=prefix))
+    else:
+        # Use business logic function
+        books = search_books_in_catalog(search_term, search_type, limit=limit, offset=offset, prefix=prefix)
+        
+        response = jsonify({
+            'search_term': search_term,
+            'search_type': search_type,
+            'results': books,
+            'count': len(books),
+            'limit': limit,
+            'offset': offset
+        })
     
+    response.vary.add('Accept')
+    return with_etag(response, etag)
+
+@api_bp.route('/books')
+def export_books():
+    """
+    Export the full catalog as NDJSON, one book per line in id order.
+    Streamed from a database cursor, so memory use does not grow with the catalog.
+    """
+    return ndjson_response(iter_all_books())
+
+@api_bp.route('/fees/ledger', methods=['GET', 'POST'])
+def fee_ledger():
+    """
+    Library-wide late fee ledger.
+    POST recomputes the ledger for ?as_of=YYYY-MM-DD (default today);
+    GET lists that day's rows, optionally filtered by ?patron_id=.
+    """
+    as_of_arg = request.args.get('as_of', '').strip()
+    try:
+        as_of = date.fromisoformat(as_of_arg) if as_of_arg else None
+    except ValueError:
+        return jsonify({'error': 'as_of must be a date in YYYY-MM-DD format'}), 400
+
+    if request.method == 'POST':
+        return jsonify(run_fee_ledger(as_of))
+
+    rows = get_fee_ledger(as_of, patron_id=request.args.get('patron_id', '').strip() or None)
     return jsonify({
-        'search_term': search_term,
-        'search_type': search_type,
-        'results': books,
-        'count': len(books)
+        'as_of': (as_of or date.today()).isoformat(),
+        'results': rows,
+        'count': len(rows)
     })
+
+@api_bp.route('/books/import', methods=['POST'])
+def import_books_api():
+    """
+    Bulk-import books from CSV (with a title,author,isbn,total_copies header)
+    or JSON Lines.
+    
+    Accepts a multipart upload in the `file` field or a raw request body. The
+    format comes from ?format=, else the file name, else the Content-Type.
+    """
+    upload = request.files.get('file')
+    fmt = request.args.get('format', '').strip().lower()
+    if upload is not None:
+        fmt = fmt or detect_format(upload.filename)
+        raw = upload.stream
+    else:
+        if not fmt:
+            fmt = 'jsonl' if request.mimetype in ('application/x-ndjson', 'application/jsonl') else 'csv'
+        raw = request.stream
+    
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'error': 'Import format must be csv or jsonl'}), 400
+    
+    batch_size = int_arg('batch_size', IMPORT_BATCH_SIZE, minimum=1)
+    text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    report = import_books(text, fmt, batch_size=batch_size)
+    # Rows before an undecodable part are already committed; the report says how many
+    return jsonify(report), 400 if report['aborted'] else 200
+
+# HTTP status for each batch report status; per-item failures still answer 200
+_BATCH_HTTP_STATUS = {'invalid': 400, 'limit_reached': 409, 'error': 500}
+
+def _batch_request():
+    """Read {"patron_id": str, "book_ids": [int, ...]} from a JSON body; None if it is not an object."""
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return None
+    return str(payload.get('patron_id', '')).strip(), payload.get('book_ids')
+
+_BAD_BATCH_BODY = {'success': False, 'status': 'invalid',
+                   'message': 'Request body must be a JSON object with patron_id and book_ids.',
+                   'results': []}
+
+@api_bp.route('/borrow', methods=['POST'])
+def borrow_books_api():
+    """
+    Borrow a stack of books for one patron in a single transaction.
+    Batch interface for R3: Book Borrowing
+    """
+    batch = _batch_request()
+    if batch is None:
+        return jsonify(_BAD_BATCH_BODY), 400
+    report = borrow_books_by_patron(*batch)
+    return jsonify(report), _BATCH_HTTP_STATUS.get(report['status'], 200)
+
+@api_bp.route('/return', methods=['POST'])
+def return_books_api():
+    """
+    Return a stack of books for one patron in a single transaction.
+    Batch interface for R4: Book Return Processing
+    """
+    batch = _batch_request()
+    if batch is None:
+        return jsonify(_BAD_BATCH_BODY), 400
+    report = return_books_by_patron(*batch)
+    return jsonify(report), _BATCH_HTTP_STATUS.get(report['status'], 200)
@@ -2,9 +2,11 @@
 Catalog Routes - Book catalog related endpoints
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
-from services.library_service import add_book_to_catalog
+from flask import Blueprint, make_response, render_template, request, redirect, url_for, flash
+from services.library_service import (
+    add_book_to_catalog, get_catalog_page, CATALOG_PAGE_SIZE, MAX_CATALOG_PAGE_SIZE
+)
+from routes.helpers import int_arg, catalog_etag, not_modified, with_etag
 
 catalog_bp = Blueprint('catalog', __name__)
 
@@ -16,11 +18,21 @@ def index():
 @catalog_bp.route('/catalog')
 def catalog():
     """
-    Display all books in the catalog.
+    Display the catalog one page at a time.
     Implements R2: Book Catalog Display
+    
+    Answers If-None-Match with 304 while the catalog version is unchanged.
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    etag = catalog_etag()
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    page_size = int_arg('page_size', CATALOG_PAGE_SIZE, minimum=1, maximum=MAX_CATALOG_PAGE_SIZE)
+    page = get_catalog_page(page_size, after=request.args.get('after'), before=request.args.get('before'))
+    html = render_template('catalog.html', books=page['books'], page_size=page_size,
+                           next_cursor=page['next_cursor'], prev_cursor=page['prev_cursor'])
+    return with_etag(make_response(html), etag)
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
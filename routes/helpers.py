@@ -0,0 +1,75 @@
+"""
+Route Helpers - Small request-parsing utilities shared by the blueprints
+"""
+
+import hashlib
+import json
+from typing import Dict, Iterable, Optional
+
+from flask import Response, request, session, stream_with_context
+
+from database import get_catalog_version
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def int_arg(name: str, default: int, minimum: int = 0, maximum: Optional[int] = None) -> int:
+    """
+    Read an integer query-string argument, falling back to `default` when it
+    is missing or malformed and clamping it to [minimum, maximum].
+    """
+    try:
+        value = int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+
+def wants_ndjson() -> bool:
+    """True if the client asked for a streamed NDJSON body (stream=1 or Accept header)."""
+    if request.args.get('stream') == '1':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(rows: Iterable[Dict]) -> Response:
+    """Stream rows as newline-delimited JSON, one object per line."""
+    def generate():
+        for row in rows:
+            yield json.dumps(row) + '\n'
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def catalog_etag(*parts) -> str:
+    """
+    Build an ETag from the current catalog version, the request's path and
+    query string, and any extra parts the response depends on.
+    """
+    key = '|'.join(str(p) for p in (get_catalog_version(), request.full_path, *parts))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    """
+    Return a 304 response if the client's If-None-Match already holds `etag`.
+
+    Pages with pending flash messages are always rendered, because the
+    messages are consumed by rendering and would otherwise be lost.
+    """
+    if session.get('_flashes'):
+        return None
+    if request.if_none_match and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    """Attach `etag` and ask clients to revalidate on every use."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -3,7 +3,9 @@ Search Routes - Book search functionality
 """
 
 from flask import Blueprint, render_template, request, flash
-from services.library_service import search_books_in_catalog
+from services.library_service import search_books_in_catalog, SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE
+from database import MAX_SQLITE_INTEGER
+from routes.helpers import int_arg
 
 search_bp = Blueprint('search', __name__)
 
@@ -15,14 +17,18 @@ def search_books():
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    limit = int_arg('limit', SEARCH_PAGE_SIZE, minimum=1, maximum=MAX_SEARCH_PAGE_SIZE)
+    offset = int_arg('offset', 0, maximum=MAX_SQLITE_INTEGER)
+    prefix = request.args.get('prefix', '1') != '0'
     
     if not search_term:
         return render_template('search.html', books=[], search_term='', search_type=search_type)
     
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    books = search_books_in_catalog(search_term, search_type, limit=limit, offset=offset, prefix=prefix)
     
     if not books:
         flash('Search functionality is not yet implemented.', 'error')
     
-    return render_template('search.html', books=books, search_term=search_term, search_type=search_type)
+    return render_template('search.html', books=books, search_term=search_term, search_type=search_type,
+                           limit=limit, offset=offset)
@@ -0,0 +1,164 @@
+"""
+Catalog Import Module - Bulk book import from CSV or JSON Lines
+Streams the input, validates every row with the R1 rules, drops duplicate
+ISBNs and inserts valid rows in large batched transactions.
+"""
+
+import csv
+import json
+import time
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+from database import insert_books_bulk
+from services.library_service import validate_book_fields
+
+IMPORT_BATCH_SIZE = 5000
+
+# Keep memory bounded on very large files; the counts stay exact
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_FORMATS = ("csv", "jsonl")
+
+
+def detect_format(filename: str) -> Optional[str]:
+    """Guess the import format from a file name ('csv' or 'jsonl'), else None."""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return None
+
+
+def _read_rows(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """
+    Yield (line_number, fields, parse_error) for each record in the input.
+    CSV input needs a header row naming title, author, isbn and total_copies.
+    A malformed CSV record is reported and reading goes on with the next one.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as exc:
+                yield reader.line_num, None, f"Malformed CSV record: {exc}."
+                continue
+            yield reader.line_num, row, None
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, None, "Invalid JSON."
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Each line must be a JSON object."
+            continue
+        yield line_number, record, None
+
+
+def _normalize(fields: Dict) -> Tuple[Tuple[str, str, str, int], Optional[str]]:
+    """Trim a record's fields and apply the R1 rules."""
+    title = str(fields.get("title") or "").strip()
+    author = str(fields.get("author") or "").strip()
+    isbn = str(fields.get("isbn") or "").strip()
+    if any("\x00" in value for value in (title, author, isbn)):
+        return (title, author, isbn, None), "Fields must not contain NUL characters."
+
+    try:
+        total_copies = int(str(fields.get("total_copies")).strip())
+    except ValueError:
+        total_copies = None  # rejected by the R1 positive-integer rule
+
+    return (title, author, isbn, total_copies), validate_book_fields(title, author, isbn, total_copies)
+
+
+def import_books(stream: TextIO, fmt: str, batch_size: int = IMPORT_BATCH_SIZE) -> Dict:
+    """
+    Import books from a text stream.
+
+    Args:
+        stream: CSV (with header) or JSON Lines text
+        fmt: 'csv' or 'jsonl'
+        batch_size: rows per insert transaction
+
+    Returns:
+        {
+            'rows_read': int,
+            'imported': int,
+            'failed': int,
+            'errors': list of {'line': int, 'isbn': str | None, 'error': str},
+            'errors_truncated': bool,
+            'aborted': str | None,   # why reading stopped early (undecodable input)
+            'elapsed_seconds': float,
+            'rows_per_second': float,
+        }
+
+    Raises:
+        ValueError: unknown format
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format '{fmt}'. Use one of: {', '.join(IMPORT_FORMATS)}.")
+
+    started = time.perf_counter()
+    report = {"rows_read": 0, "imported": 0, "failed": 0, "errors": [], "errors_truncated": False,
+              "aborted": None}
+
+    def record_error(line: int, isbn: Optional[str], message: str) -> None:
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line, "isbn": isbn, "error": message})
+        else:
+            report["errors_truncated"] = True
+
+    seen_isbns = set()
+    batch: List[Tuple[str, str, str, int]] = []
+    batch_lines: Dict[str, int] = {}
+
+    def flush() -> None:
+        skipped = insert_books_bulk(batch)
+        for isbn in skipped:
+            record_error(batch_lines[isbn], isbn, "A book with this ISBN already exists.")
+        report["imported"] += len(batch) - len(skipped)
+        batch.clear()
+        batch_lines.clear()
+
+    line = 0
+    try:
+        for line, fields, parse_error in _read_rows(stream, fmt):
+            report["rows_read"] += 1
+            if parse_error:
+                record_error(line, None, parse_error)
+                continue
+
+            book, error = _normalize(fields)
+            isbn = book[2]
+            if error:
+                record_error(line, isbn or None, error)
+                continue
+            if isbn in seen_isbns:
+                record_error(line, isbn, "Duplicate ISBN in import file.")
+                continue
+
+            seen_isbns.add(isbn)
+            batch.append(book)
+            batch_lines[isbn] = line
+            if len(batch) >= batch_size:
+                flush()
+    except UnicodeDecodeError:
+        # Nothing past the bad bytes can be trusted; keep the rows read before them
+        report["aborted"] = f"Input is not valid UTF-8 text after line {line}; the rest was not read."
+        record_error(line + 1, None, "Input is not valid UTF-8 text.")
+
+    if batch:
+        flush()
+
+    elapsed = time.perf_counter() - started
+    report["elapsed_seconds"] = round(elapsed, 3)
+    report["rows_per_second"] = round(report["rows_read"] / elapsed, 1) if elapsed > 0 else 0.0
+    return report
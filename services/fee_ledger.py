@@ -0,0 +1,106 @@
+"""
+Fee Ledger Module - Library-wide late fee computation
+Computes current R5 late fees for every active loan at once and records them
+in the `fees` ledger table, e.g. for nightly statements and collections lists.
+"""
+
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+from database import db_connection, immediate_transaction, read_connection
+from services.library_service import (
+    LATE_FEE_TIER1_DAYS, LATE_FEE_TIER1_RATE, LATE_FEE_TIER2_RATE, LATE_FEE_CAP
+)
+
+# The R5 tiering from late_fee_for_due_date(), applied to every overdue active
+# loan in one set-based statement. days_overdue is the calendar-day difference
+# between the as-of date and the date part of due_date, as in R5. Completed
+# fee_payments are subtracted, and loans with nothing left to pay are skipped.
+_LEDGER_INSERT_SQL = """
+    INSERT INTO fees (as_of, borrow_id, patron_id, book_id, due_date, days_overdue, fee_amount)
+    SELECT :as_of, id, patron_id, book_id, due_date, days_overdue, fee_amount
+      FROM (
+            SELECT id, patron_id, book_id, due_date, days_overdue,
+                   ROUND(MIN(:cap,
+                             MIN(days_overdue, :tier1_days) * :tier1_rate
+                             + MAX(days_overdue - :tier1_days, 0) * :tier2_rate)
+                         - paid, 2) AS fee_amount
+              FROM (
+                    SELECT br.id, br.patron_id, br.book_id, br.due_date,
+                           CAST(julianday(:as_of) - julianday(substr(br.due_date, 1, 10)) AS INTEGER)
+                               AS days_overdue,
+                           COALESCE(p.paid, 0) AS paid
+                      FROM borrows br
+                      LEFT JOIN (SELECT borrow_id, SUM(amount) AS paid
+                                   FROM fee_payments
+                                  WHERE status = 'completed'
+                                  GROUP BY borrow_id) p ON p.borrow_id = br.id
+                     WHERE br.return_date IS NULL
+                       AND br.due_date < :as_of
+                   )
+             WHERE days_overdue > 0
+           )
+     WHERE fee_amount > 0
+"""
+
+
+def run_fee_ledger(as_of: Optional[date] = None) -> Dict:
+    """
+    Recompute the fee ledger for one day.
+
+    Re-running for the same day replaces that day's rows, so the job is safe
+    to retry.
+
+    Args:
+        as_of: the day fees are computed for (defaults to today)
+
+    Returns:
+        {
+            'as_of': 'YYYY-MM-DD',
+            'loans_charged': int,     # overdue active loans with fees still owed
+            'total_fees': float,
+            'elapsed_seconds': float,
+        }
+    """
+    day = (as_of or date.today()).isoformat()
+    started = time.perf_counter()
+
+    with db_connection() as conn:
+        with immediate_transaction(conn):
+            conn.execute('DELETE FROM fees WHERE as_of = ?', (day,))
+            conn.execute(_LEDGER_INSERT_SQL, {
+                'as_of': day,
+                'cap': LATE_FEE_CAP,
+                'tier1_days': LATE_FEE_TIER1_DAYS,
+                'tier1_rate': LATE_FEE_TIER1_RATE,
+                'tier2_rate': LATE_FEE_TIER2_RATE,
+            })
+            summary = conn.execute('''
+                SELECT COUNT(*) AS loans, COALESCE(SUM(fee_amount), 0) AS total
+                  FROM fees WHERE as_of = ?
+            ''', (day,)).fetchone()
+
+    return {
+        'as_of': day,
+        'loans_charged': summary['loans'],
+        'total_fees': round(summary['total'], 2),
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def get_fee_ledger(as_of: Optional[date] = None, patron_id: Optional[str] = None) -> List[Dict]:
+    """
+    Ledger rows for one day, optionally for a single patron, ordered by patron
+    and due date.
+    """
+    day = (as_of or date.today()).isoformat()
+    sql = 'SELECT * FROM fees WHERE as_of = ?'
+    params: List = [day]
+    if patron_id:
+        sql += ' AND patron_id = ?'
+        params.append(patron_id)
+
+    with read_connection() as conn:
+        rows = conn.execute(sql + ' ORDER BY patron_id, due_date', params).fetchall()
+    return [dict(row) for row in rows]
@@ -3,46 +3,98 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
+import base64
+import json
+import sqlite3
+import uuid
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 from database import (
-    get_db_connection,
+    read_connection, db_connection, immediate_transaction,
     get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
     insert_book, insert_borrow_record, update_book_availability,
     update_borrow_record_return_date, get_all_books,
-    get_patron_borrowed_books, get_borrow_history_for_patron
+    get_patron_borrowed_books, get_borrow_history_for_patron,
+    borrow_book_transaction, return_book_transaction, search_books,
+    borrow_books_transaction, return_books_transaction,
+    search_books_fulltext, get_books_page, iter_search_books, get_patron_loans,
+    get_patron_unpaid_loans, reserve_fee_payments, complete_fee_payments, release_fee_payments,
+    MAX_SQLITE_INTEGER
 )
 from services.payment_service import PaymentGateway
-
-def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+from services.payment_outbox import enqueue_payment, enqueue_refund, get_outbox_entry_by_key, check_same_request
+
+# Search result paging (R6)
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_PAGE_SIZE = 200
+
+# Circulation (R3/R4)
+MAX_BORROWED_BOOKS = 5
+LOAN_PERIOD_DAYS = 14
+MAX_BATCH_BOOKS = 20
+
+_BORROW_FAILURES = {
+    'not_found': "Book not found.",
+    'unavailable': "This book is currently not available.",
+    'limit_reached': f"You have reached the maximum borrowing limit of {MAX_BORROWED_BOOKS} books.",
+}
+
+_RETURN_FAILURES = {
+    'not_found': "Book not found.",
+    'no_active_borrow': "No active borrow for this patron and book.",
+}
+
+# Late fee rules (R5)
+LATE_FEE_TIER1_DAYS = 7
+LATE_FEE_TIER1_RATE = 0.50
+LATE_FEE_TIER2_RATE = 1.00
+LATE_FEE_CAP = 15.00
+
+# Catalog paging (R2)
+CATALOG_PAGE_SIZE = 50
+MAX_CATALOG_PAGE_SIZE = 200
+
+def validate_book_fields(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
     """
-    Add a new book to the catalog.
-    Implements R1: Book Catalog Management
+    R1 field rules shared by single adds and bulk imports.
+    Expects already-trimmed strings. Returns the error message for the first
+    rule that fails, or None if the book is valid.
     """
-    # Normalize/trim
-    title = (title or "").strip()
-    author = (author or "").strip()
-    isbn = (isbn or "").strip()
-
     # Title
     if not title:
-        return False, "Title is required."
+        return "Title is required."
     if len(title) > 200:
-        return False, "Title must be less than 200 characters."
+        return "Title must be less than 200 characters."
 
     # Author
     if not author:
-        return False, "Author is required."
+        return "Author is required."
     if len(author) > 100:
-        return False, "Author must be less than 100 characters."
+        return "Author must be less than 100 characters."
 
     # ISBN: exactly 13 digits (not just length)
     if len(isbn) != 13 or not isbn.isdigit():
-        return False, "ISBN must be exactly 13 digits."
+        return "ISBN must be exactly 13 digits."
 
     # total_copies: positive integer
     if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+        return "Total copies must be a positive integer."
+
+    return None
+
+def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+    """
+    Add a new book to the catalog.
+    Implements R1: Book Catalog Management
+    """
+    # Normalize/trim
+    title = (title or "").strip()
+    author = (author or "").strip()
+    isbn = (isbn or "").strip()
+
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return False, error
 
     # Duplicate ISBN
     existing = get_book_by_isbn(isbn)
@@ -56,6 +108,53 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
     else:
         return False, "Database error occurred while adding the book."
 
+def _encode_cursor(book: Dict) -> str:
+    """Encode a book's (title, id) sort key as an opaque URL-safe cursor."""
+    raw = json.dumps([book["title"], book["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Decode a cursor from _encode_cursor(); malformed cursors (or ids SQLite cannot bind) yield None."""
+    if not cursor:
+        return None
+    try:
+        title, book_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(title), _coerce_book_id(book_id)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+def get_catalog_page(page_size: int = CATALOG_PAGE_SIZE, after: Optional[str] = None,
+                     before: Optional[str] = None) -> Dict:
+    """
+    R2 — One page of the catalog, ordered by title.
+
+    Uses keyset (seek) pagination on (title, id), so every page costs the same
+    index range scan no matter how deep into the catalog it is.
+
+    Returns:
+        {
+            'books': list of book dicts (same shape as get_all_books()),
+            'next_cursor': str | None,   # pass as `after` for the next page
+            'prev_cursor': str | None,   # pass as `before` for the previous page
+        }
+    """
+    page_size = max(1, min(int(page_size), MAX_CATALOG_PAGE_SIZE))
+    after_key = _decode_cursor(after)
+    before_key = _decode_cursor(before)
+
+    books, more = get_books_page(page_size, after=after_key, before=None if after_key else before_key)
+
+    if before_key and not after_key:
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, after_key is not None
+
+    return {
+        "books": books,
+        "next_cursor": _encode_cursor(books[-1]) if books and has_next else None,
+        "prev_cursor": _encode_cursor(books[0]) if books and has_prev else None,
+    }
+
 def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Allow a patron to borrow a book.
@@ -72,32 +171,25 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits."
 
-    # Check if book exists and is available
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found."
-
-    if book['available_copies'] <= 0:
-        return False, "This book is currently not available."
-
-    # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
-
-    if current_borrowed >= 5:
-        return False, "You have reached the maximum borrowing limit of 5 books."
+    # Form and JSON callers pass the id as a string; the database keys are ints
+    try:
+        book_id = _coerce_book_id(book_id)
+    except (TypeError, ValueError):
+        return False, "Invalid book id."
 
     # Create borrow record
     borrow_date = datetime.now()
-    due_date = borrow_date + timedelta(days=14)
+    due_date = borrow_date + timedelta(days=LOAN_PERIOD_DAYS)
 
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
-        return False, "Database error occurred while creating borrow record."
+    # Availability check, limit check, decrement and insert commit together
+    status, book = borrow_book_transaction(patron_id, book_id, borrow_date, due_date,
+                                           max_borrowed=MAX_BORROWED_BOOKS)
 
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
+    if status in _BORROW_FAILURES:
+        return False, _BORROW_FAILURES[status]
+
+    if status != 'ok':
+        return False, "Database error occurred while creating borrow record."
 
     return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
 
@@ -116,26 +208,131 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
 
     # Validate book and existence
     try:
-        book_id = int(book_id)
-    except Exception:
+        book_id = _coerce_book_id(book_id)
+    except (TypeError, ValueError):
         return False, "Invalid book id."
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found."
 
-    # Try to set return_date on an active borrow for this patron/book
-    now = datetime.now()
-    updated = update_borrow_record_return_date(patron_id, book_id, now)
-    if not updated:
-        # No active borrow row for this patron & book
-        return False, "No active borrow for this patron and book."
+    # Close the active borrow and restock the copy in one transaction
+    status, book = return_book_transaction(patron_id, book_id, datetime.now())
+
+    if status in _RETURN_FAILURES:
+        return False, _RETURN_FAILURES[status]
 
-    # Increment availability
-    if not update_book_availability(book_id, +1):
+    if status != 'ok':
         return False, "Database error occurred while updating availability."
 
     return True, f'Returned "{book["title"]}".'
 
+def _coerce_book_id(book_id) -> int:
+    """Turn a book id given as an int or a string of digits into an int in 1..MAX_SQLITE_INTEGER."""
+    if isinstance(book_id, bool) or (isinstance(book_id, float) and not book_id.is_integer()):
+        raise ValueError(f"invalid book id: {book_id!r}")
+    value = int(str(book_id).strip()) if isinstance(book_id, str) else int(book_id)
+    if not 1 <= value <= MAX_SQLITE_INTEGER:
+        raise ValueError(f"book id out of range: {book_id!r}")
+    return value
+
+def _validate_batch(patron_id: str, book_ids) -> Tuple[Optional[List[int]], Optional[str]]:
+    """Check a batch request; returns (normalized book ids, error message)."""
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return None, "Invalid patron ID. Must be exactly 6 digits."
+    if not isinstance(book_ids, (list, tuple)) or not book_ids:
+        return None, "At least one book id is required."
+    if len(book_ids) > MAX_BATCH_BOOKS:
+        return None, f"A batch may contain at most {MAX_BATCH_BOOKS} books."
+    try:
+        return [_coerce_book_id(b) for b in book_ids], None
+    except (TypeError, ValueError):
+        return None, "Invalid book id."
+
+def _batch_report(verb: str, items: List[Dict]) -> Dict:
+    """Shape per-item outcomes as {'success', 'status', 'message', 'results'}."""
+    done = sum(1 for item in items if item["success"])
+    return {
+        "success": done == len(items),
+        "status": "ok" if done == len(items) else "partial",
+        "message": f"{verb} {done} of {len(items)} books.",
+        "results": items,
+    }
+
+def _batch_failure(status: str, message: str) -> Dict:
+    """A batch report for a request that was rejected before any item ran."""
+    return {"success": False, "status": status, "message": message, "results": []}
+
+def borrow_books_by_patron(patron_id: str, book_ids: List[int]) -> Dict:
+    """
+    R3 for a stack of books (self-checkout): borrow them all in one transaction.
+
+    The 5-book limit is checked against the whole batch; if it would be
+    exceeded nothing is borrowed. Unknown or unavailable books fail on their
+    own without blocking the rest.
+
+    Returns:
+        {
+            'success': bool,          # True only if every book was borrowed
+            'status': 'ok' | 'partial' | 'limit_reached' | 'invalid' | 'error',
+            'message': str,
+            'due_date': 'YYYY-MM-DD' | None,
+            'results': [{'book_id': int, 'success': bool, 'message': str}, ...]
+        }
+    """
+    ids, error = _validate_batch(patron_id, book_ids)
+    if error:
+        return dict(_batch_failure("invalid", error), due_date=None)
+
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=LOAN_PERIOD_DAYS)
+    status, outcomes = borrow_books_transaction(patron_id, ids, borrow_date, due_date,
+                                                max_borrowed=MAX_BORROWED_BOOKS)
+    if status == 'error':
+        return dict(_batch_failure("error", "Database error occurred while creating borrow records."),
+                    due_date=None)
+
+    items = []
+    for outcome in outcomes:
+        if outcome["status"] == 'ok':
+            message = f'Successfully borrowed "{outcome["book"]["title"]}".'
+        else:
+            message = _BORROW_FAILURES[outcome["status"]]
+        items.append({"book_id": outcome["book_id"], "success": outcome["status"] == 'ok', "message": message})
+
+    report = _batch_report("Borrowed", items)
+    if status == 'limit_reached':
+        report["status"] = "limit_reached"
+        report["message"] = _BORROW_FAILURES['limit_reached']
+    report["due_date"] = due_date.strftime("%Y-%m-%d") if any(i["success"] for i in items) else None
+    return report
+
+def return_books_by_patron(patron_id: str, book_ids: List[int]) -> Dict:
+    """
+    R4 for a stack of books: check them all in within one transaction.
+
+    Returns:
+        {
+            'success': bool,          # True only if every book was returned
+            'status': 'ok' | 'partial' | 'invalid' | 'error',
+            'message': str,
+            'results': [{'book_id': int, 'success': bool, 'message': str}, ...]
+        }
+    """
+    ids, error = _validate_batch(patron_id, book_ids)
+    if error:
+        return _batch_failure("invalid", error)
+
+    status, outcomes = return_books_transaction(patron_id, ids, datetime.now())
+    if status == 'error':
+        return _batch_failure("error", "Database error occurred while updating availability.")
+
+    items = []
+    for outcome in outcomes:
+        if outcome["status"] == 'ok':
+            message = f'Returned "{outcome["book"]["title"]}".'
+        else:
+            message = _RETURN_FAILURES[outcome["status"]]
+        items.append({"book_id": outcome["book_id"], "success": outcome["status"] == 'ok', "message": message})
+
+    return _batch_report("Returned", items)
+
 def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     """
     R5 — Calculate late fees for a specific active loan of (patron_id, book_id).
@@ -146,11 +343,15 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         * Days 1–7 overdue: $0.50/day
         * Day 8+ overdue: $1.00/day
         * Total fee capped at $15.00
+    Fees already paid (or reserved by a payment in flight) are subtracted,
+    and a loan whose fee is fully paid reports status 'paid'.
     Return:
         {
-            'fee_amount': float,   # dollars
+            'fee_amount': float,   # dollars still owed
             'days_overdue': int,
-            'status': 'on_time' | 'late' | 'no_active_loan'
+            'status': 'on_time' | 'late' | 'paid' | 'no_active_loan',
+            'borrow_id': int,      # with an active loan
+            'amount_paid': float,  # with an active loan
         }
     """
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
@@ -162,18 +363,18 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         return {'fee_amount': 0.0, 'days_overdue': 0, 'status': 'no_active_loan'}
 
     # Find the active (unreturned) borrow for this patron/book
-    conn = get_db_connection()
-    row = conn.execute(
-        """
-        SELECT id, due_date
-          FROM borrows
-         WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
-         ORDER BY id DESC
-         LIMIT 1
-        """,
-        (patron_id, book_id),
-    ).fetchone()
-    conn.close()
+    with read_connection() as conn:
+        row = conn.execute(
+            """
+            SELECT br.id, br.due_date,
+                   (SELECT COALESCE(SUM(amount), 0) FROM fee_payments WHERE borrow_id = br.id) AS paid
+              FROM borrows br
+             WHERE br.patron_id = ? AND br.book_id = ? AND br.return_date IS NULL
+             ORDER BY br.id DESC
+             LIMIT 1
+            """,
+            (patron_id, book_id),
+        ).fetchone()
 
     if not row:
         return {'fee_amount': 0.0, 'days_overdue': 0, 'status': 'no_active_loan'}
@@ -185,48 +386,79 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         # If stored format is unexpected, no fee
         return {'fee_amount': 0.0, 'days_overdue': 0, 'status': 'no_active_loan'}
 
-    today = datetime.now()
-    days_overdue = max(0, (today.date() - due_dt.date()).days)
+    days_overdue, fee = late_fee_for_due_date(due_dt)
+    loan = {'borrow_id': row['id'], 'amount_paid': round(row['paid'], 2)}
 
     if days_overdue == 0:
-        return {'fee_amount': 0.0, 'days_overdue': 0, 'status': 'on_time'}
+        return {'fee_amount': 0.0, 'days_overdue': 0, 'status': 'on_time', **loan}
+
+    outstanding = round(fee - row['paid'], 2)
+    if outstanding <= 0:
+        return {'fee_amount': 0.0, 'days_overdue': days_overdue, 'status': 'paid', **loan}
+    return {'fee_amount': outstanding, 'days_overdue': days_overdue, 'status': 'late', **loan}
+
+def late_fee_for_due_date(due_date: datetime, today: Optional[datetime] = None) -> Tuple[int, float]:
+    """
+    R5 tiering for one due date, without touching the database.
+
+    Returns:
+        (days_overdue, fee_amount) where fee_amount is $0.50/day for days 1–7,
+        $1.00/day from day 8, capped at $15.00 and rounded to cents.
+    """
+    today = today or datetime.now()
+    days_overdue = max(0, (today.date() - due_date.date()).days)
 
     # Tiered fee with cap
-    tier1_days = min(days_overdue, 7)
-    tier2_days = max(days_overdue - 7, 0)
-    fee = tier1_days * 0.50 + tier2_days * 1.00
-    fee_capped = min(15.00, fee)
+    tier1_days = min(days_overdue, LATE_FEE_TIER1_DAYS)
+    tier2_days = max(days_overdue - LATE_FEE_TIER1_DAYS, 0)
+    fee = tier1_days * LATE_FEE_TIER1_RATE + tier2_days * LATE_FEE_TIER2_RATE
+    fee_capped = min(LATE_FEE_CAP, fee)
 
     # Round to 2 decimals for presentation
-    fee_capped = round(fee_capped + 1e-9, 2)
-
-    return {'fee_amount': fee_capped, 'days_overdue': days_overdue, 'status': 'late'}
+    return days_overdue, round(fee_capped + 1e-9, 2)
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+def search_books_in_catalog(search_term: str, search_type: str,
+                            limit: int = SEARCH_PAGE_SIZE, offset: int = 0,
+                            prefix: bool = True) -> List[Dict]:
     """
     R6 — Search for books.
     - title/author: partial, case-insensitive
     - isbn: exact match (13-digit)
-    Returns list of book dicts in the same shape as get_all_books().
+    - fulltext: every word must appear in the title or author, ranked by
+      relevance; with prefix=True partial words match ("gats" -> "Gatsby")
+    Returns list of book dicts in the same shape as get_all_books(), at most
+    `limit` rows (capped at MAX_SEARCH_PAGE_SIZE) starting at `offset`.
     """
     term = (search_term or "").strip()
     stype = (search_type or "").strip().lower()
 
-    if not term or stype not in {"title", "author", "isbn"}:
+    if not term or stype not in {"title", "author", "isbn", "fulltext"}:
         return []
 
-    books = get_all_books()
+    limit = max(1, min(int(limit), MAX_SEARCH_PAGE_SIZE))
+    offset = max(0, int(offset))
+
+    if stype == "fulltext":
+        return search_books_fulltext(term, limit, offset, prefix=prefix)
+
+    # Filtering, ordering and paging all happen in SQLite
+    return search_books(term, stype, limit, offset)
+
+def iter_search_results(search_term: str, search_type: str, offset: int = 0,
+                        limit: Optional[int] = None, prefix: bool = True) -> Iterator[Dict]:
+    """
+    R6 — Stream every search match instead of one capped page.
+    Same matching rules and row shape as search_books_in_catalog(); rows are
+    read from a server-side cursor in batches, so memory stays constant.
+    """
+    term = (search_term or "").strip()
+    stype = (search_type or "").strip().lower()
 
-    if stype == "isbn":
-        # exact match
-        return [b for b in books if b.get("isbn") == term]
+    if not term or stype not in {"title", "author", "isbn", "fulltext"}:
+        return iter(())
 
-    # partial, case-insensitive for title/author
-    term_l = term.lower()
-    if stype == "title":
-        return [b for b in books if term_l in (b.get("title") or "").lower()]
-    else:  # author
-        return [b for b in books if term_l in (b.get("author") or "").lower()]
+    return iter_search_books(term, stype, offset=max(0, int(offset)),
+                             limit=None if limit is None else max(0, int(limit)), prefix=prefix)
 
 def get_patron_status_report(patron_id: str) -> Dict:
     """
@@ -234,13 +466,17 @@ def get_patron_status_report(patron_id: str) -> Dict:
 
     Returns a dict with:
       - patron_id
-      - current_loans: list of {book_id, title, author, borrow_date, due_date, days_overdue, late_fee}
+      - current_loans: list of {book_id, title, author, borrow_date, due_date, days_overdue,
+        late_fee, amount_paid}
       - counts: {"currently_borrowed": int, "history_total": int}
-      - total_late_fees: float (sum for active loans)
+      - total_late_fees: float (sum still owed for active loans)
       - history: list of {book_id, title, author, borrow_date, due_date, return_date}
 
     Notes:
-      * Reuses R5 fee calculation per active loan.
+      * Loans are read in a single query; R5 fees are computed in memory
+        for every active loan, so cost does not grow with round trips.
+      * late_fee is what is still owed: fees already paid (or reserved by a
+        payment in flight) are subtracted, as in calculate_late_fee_for_book().
       * Patron ID must be exactly 6 digits.
     """
     pid = (patron_id or "").strip()
@@ -254,17 +490,18 @@ def get_patron_status_report(patron_id: str) -> Dict:
             "error": "Invalid patron ID. Must be exactly 6 digits.",
         }
 
-    # Active borrows (no return_date)
-    active = get_patron_borrowed_books(pid)  # returns borrow_date, due_date, title/author, is_overdue
+    # One query returns every loan; active loans and fees are derived from it
+    loans = get_patron_loans(pid)
+    today = datetime.now()
+    active = sorted((l for l in loans if l["return_date"] is None), key=lambda l: l["borrow_date"])
+
     current_loans: List[Dict] = []
     total_fees = 0.0
 
     for rec in active:
-        fee_info = calculate_late_fee_for_book(pid, rec["book_id"])
-        fee_amt = float(fee_info.get("fee_amount", 0.0))
-        total_fees += fee_amt
-
-        days_overdue = max(0, (datetime.now().date() - rec["due_date"].date()).days)
+        days_overdue, fee_amt = late_fee_for_due_date(rec["due_date"], today)
+        outstanding = max(0.0, round(fee_amt - rec["paid"], 2))
+        total_fees += outstanding
 
         current_loans.append({
             "book_id": rec["book_id"],
@@ -273,11 +510,20 @@ def get_patron_status_report(patron_id: str) -> Dict:
             "borrow_date": rec["borrow_date"],
             "due_date": rec["due_date"],
             "days_overdue": days_overdue,
-            "late_fee": round(fee_amt, 2),
+            "late_fee": outstanding,
+            "amount_paid": round(rec["paid"], 2),
         })
 
-    # Full history (returned + active)
-    history = get_borrow_history_for_patron(pid)
+    # Full history (returned + active), newest first
+    history = [{
+        "book_id": l["book_id"],
+        "title": l["title"],
+        "author": l["author"],
+        "borrow_date": l["borrow_date"],
+        "due_date": l["due_date"],
+        "return_date": l["return_date"],
+    } for l in loans]
+
     counts = {
         "currently_borrowed": len(current_loans),
         "history_total": len(history),
@@ -299,6 +545,8 @@ def pay_late_fees(
     patron_id: str,
     book_id: int,
     payment_gateway: PaymentGateway,
+    defer: bool = False,
+    idempotency_key: str | None = None,
 ) -> Tuple[bool, str | None, str]:
     """
     Process late fee payment for a specific book borrowed by a patron.
@@ -306,8 +554,20 @@ def pay_late_fees(
     Uses:
       - calculate_late_fee_for_book()         -> determine amount owed
       - get_book_by_id()                      -> validate the book exists
+      - reserve_fee_payments()                -> claim the fee before charging
       - payment_gateway.process_payment()     -> external payment API (mocked in tests)
 
+    The fee is reserved in fee_payments before the gateway is called and
+    recorded there once charged, so it is not owed (or charged) again. The
+    reservation is sent as the gateway idempotency key (idempotency_key when
+    given).
+
+    With defer=True the charge is written to the payment outbox instead and
+    the gateway is not called; the returned id is the pending outbox id to
+    poll, and a repeated idempotency_key returns the id queued the first time.
+    Raises IdempotencyKeyConflict if the key queued a payment for another
+    patron or book.
+
     Returns:
         (success: bool, transaction_id: str | None, message: str)
     """
@@ -326,6 +586,13 @@ def pay_late_fees(
     if not book:
         return False, None, "Book not found."
 
+    # A repeated request returns the payment queued the first time
+    if defer and idempotency_key:
+        queued = get_outbox_entry_by_key(idempotency_key)
+        if queued is not None:
+            check_same_request(queued, "payment", patron_id=patron_id, book_id=book_id)
+            return True, queued["payment_id"], "Late fee payment queued."
+
     # Calculate late fee
     fee_info = calculate_late_fee_for_book(patron_id, book_id)
     amount = float(fee_info.get("fee_amount", 0.0))
@@ -335,32 +602,159 @@ def pay_late_fees(
     if amount <= 0 or status != "late":
         return False, None, "No late fees due for this book."
 
+    description = f"Late fee for book {book_id}"
+    reservation = [(fee_info.get("borrow_id"), book_id, amount, fee_info.get("amount_paid", 0.0))]
+    changed = "Late fees changed while paying (another payment may be in progress); try again."
+
+    if defer:
+        reference = idempotency_key or f"res_{uuid.uuid4().hex}"
+        # Reserve and queue in one transaction, so neither exists without the other
+        with db_connection() as conn, immediate_transaction(conn):
+            if reserve_fee_payments(reference, patron_id, reservation, datetime.now()):
+                outbox_id = enqueue_payment(patron_id, amount, description, book_id=book_id,
+                                            idempotency_key=reference)
+                return True, outbox_id, "Late fee payment queued."
+        # Lost a race with the same key, or the fee was paid meanwhile
+        queued = get_outbox_entry_by_key(reference)
+        if queued is not None:
+            check_same_request(queued, "payment", patron_id=patron_id, book_id=book_id)
+            return True, queued["payment_id"], "Late fee payment queued."
+        return False, None, changed
+
     if payment_gateway is None:
         return False, None, "Payment gateway is required."
 
-    description = f"Late fee for book {book_id}"
+    reference = idempotency_key or f"res_{uuid.uuid4().hex}"
+    if not reserve_fee_payments(reference, patron_id, reservation, datetime.now()):
+        return False, None, changed
+
+    # Attempt payment via external gateway and record it against the loan
+    return _charge_reserved_fees(payment_gateway, reference, patron_id, amount, description, book_id)
+
+
+def pay_all_late_fees(patron_id: str, payment_gateway: PaymentGateway,
+                      idempotency_key: str | None = None) -> Dict:
+    """
+    Pay every outstanding late fee of a patron with one gateway charge.
+
+    Uses:
+      - get_patron_unpaid_loans()             -> active loans + amounts already paid, one query
+      - late_fee_for_due_date()               -> R5 fee for each loan
+      - reserve_fee_payments()                -> claim the per-book split before charging
+      - payment_gateway.process_payment()     -> one aggregated charge
+
+    The fees are reserved under the write lock before the gateway is called,
+    so concurrent calls for the same patron cannot both charge them. The
+    reservation is sent as the gateway idempotency key (idempotency_key when
+    given, e.g. the executor's job id).
 
-    # Attempt payment via external gateway
+    Returns:
+        {
+            'success': bool,
+            'transaction_id': str | None,
+            'amount': float,
+            'message': str,
+            'allocations': [{'book_id', 'borrow_id', 'title', 'amount'}, ...]
+        }
+    """
+    def failure(message: str, amount: float = 0.0) -> Dict:
+        return {"success": False, "transaction_id": None, "amount": amount,
+                "message": message, "allocations": []}
+
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return failure("Invalid patron ID. Must be exactly 6 digits.")
+
+    today = datetime.now()
+    allocations: List[Dict] = []
+    paid: Dict[int, float] = {}
+    for loan in get_patron_unpaid_loans(patron_id):
+        paid[loan["borrow_id"]] = loan["paid"]
+        _, fee = late_fee_for_due_date(loan["due_date"], today)
+        outstanding = round(fee - loan["paid"], 2)
+        if outstanding > 0:
+            allocations.append({
+                "book_id": loan["book_id"],
+                "borrow_id": loan["borrow_id"],
+                "title": loan["title"],
+                "amount": outstanding,
+            })
+
+    amount = round(sum(a["amount"] for a in allocations), 2)
+    if amount <= 0:
+        return failure("No late fees due for this patron.")
+
+    if payment_gateway is None:
+        return failure("Payment gateway is required.", amount)
+
+    description = f"Late fees for {len(allocations)} book(s)"
+    reference = idempotency_key or f"res_{uuid.uuid4().hex}"
+    if not reserve_fee_payments(reference, patron_id,
+                                [(a["borrow_id"], a["book_id"], a["amount"], paid[a["borrow_id"]])
+                                 for a in allocations], today):
+        return failure("Late fees changed while paying (another payment may be in progress); try again.",
+                       amount)
+
+    result = _charge_reserved_fees(payment_gateway, reference, patron_id, amount, description)
+    if not result[0]:
+        return dict(failure(result[2], amount), transaction_id=result[1])
+    return {
+        "success": True,
+        "transaction_id": result[1],
+        "amount": amount,
+        "message": result[2],
+        "allocations": allocations,
+    }
+
+
+def _charge_reserved_fees(payment_gateway: PaymentGateway, reference: str, patron_id: str,
+                          amount: float, description: str,
+                          book_id: int | None = None) -> Tuple[bool, str | None, str]:
+    """
+    Charge fees already reserved under `reference` and settle the reservation.
+
+    The reference doubles as the gateway idempotency key. A declined charge
+    releases the fees; when the outcome is unknown (exception) or the charge
+    cannot be recorded, the reservation is handed to the payment outbox,
+    which re-sends it under the same key, so the patron is charged once.
+
+    Returns:
+        (success, transaction_id, message)
+    """
     try:
         success, transaction_id, message = payment_gateway.process_payment(
-            patron_id, amount, description
-        )
+            patron_id, amount, description, idempotency_key=reference)
     except Exception as exc:
-        # Network / API failure
-        return False, None, f"Payment failed due to an exception: {exc}"
+        outbox_id = _hand_to_outbox(reference, patron_id, amount, description, book_id)
+        return False, None, (f"Payment failed due to an exception: {exc}. The fees stay reserved and "
+                             f"the charge will be confirmed by the payment outbox ({outbox_id}).")
 
     if not success:
-        # Payment declined or failed
+        release_fee_payments(reference)
         return False, None, f"Payment failed: {message}"
 
-    # Success
+    if not complete_fee_payments(reference, transaction_id, datetime.now()):
+        outbox_id = _hand_to_outbox(reference, patron_id, amount, description, book_id)
+        return False, transaction_id, (f"Payment {transaction_id} went through but could not be recorded; "
+                                       f"it will be confirmed by the payment outbox ({outbox_id}).")
+
     return True, transaction_id, f"Late fee payment successful: {message}"
 
 
+def _hand_to_outbox(reference: str, patron_id: str, amount: float, description: str,
+                    book_id: int | None) -> str | None:
+    """Queue a reserved charge for the outbox; None if even that fails (reconciliation retries)."""
+    try:
+        return enqueue_payment(patron_id, amount, description, book_id=book_id, idempotency_key=reference)
+    except sqlite3.Error:
+        return None
+
+
 def refund_late_fee_payment(
     transaction_id: str,
     amount: float,
     payment_gateway: PaymentGateway,
+    defer: bool = False,
+    idempotency_key: str | None = None,
 ) -> Tuple[bool, str]:
     """
     Process a refund for a previously charged late fee.
@@ -368,6 +762,10 @@ def refund_late_fee_payment(
     Uses:
       - payment_gateway.refund_payment()
 
+    With defer=True the refund is written to the payment outbox instead and
+    the second element of the result is the pending outbox id. Raises
+    IdempotencyKeyConflict if the key queued a different refund.
+
     Validation rules:
       - transaction_id must be a non-empty string and look like a valid ID
         (for this assignment we require it to start with 'txn_')
@@ -395,12 +793,16 @@ def refund_late_fee_payment(
     if amount > 15.00:
         return False, "Refund amount cannot exceed $15.00."
 
+    if defer:
+        return True, enqueue_refund(transaction_id, amount, idempotency_key=idempotency_key)
+
     if payment_gateway is None:
         return False, "Payment gateway is required."
 
-    # Call external gateway (mocked in tests)
+    # Call external gateway (mocked in tests); a key makes retries of this refund safe
+    keyed = {"idempotency_key": idempotency_key} if idempotency_key else {}
     try:
-        success, message = payment_gateway.refund_payment(transaction_id, amount)
+        success, message = payment_gateway.refund_payment(transaction_id, amount, **keyed)
     except Exception as exc:
         return False, f"Refund failed due to an exception: {exc}"
 
@@ -0,0 +1,184 @@
+"""
+Payment Executor Module - Concurrent payment gateway calls
+Runs PaymentGateway work on a bounded thread pool so that slow gateway round
+trips (0.3–0.5 s each) overlap with each other instead of blocking the caller.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from services.library_service import pay_late_fees, pay_all_late_fees, refund_late_fee_payment
+from services.payment_service import PaymentGateway, create_gateway
+
+DEFAULT_PAYMENT_WORKERS = 8
+DEFAULT_PAYMENT_TIMEOUT = 10.0
+
+# Finished jobs are forgotten oldest-first beyond this many
+MAX_TRACKED_JOBS = 10000
+
+
+class PaymentExecutor:
+    """
+    Bounded worker pool for gateway calls.
+
+    Every submit_* method returns (job_id, future) immediately. Futures can
+    be waited on, given callbacks, or looked up later by job id through
+    job_status().
+
+    Timeouts only stop the caller from waiting: a gateway call that is
+    already running cannot be interrupted and may still complete, so a timed
+    out payment should be checked with verify_payment_status() before it is
+    retried. Calls still queued when their timeout expires are cancelled.
+    """
+
+    def __init__(self, gateway: Optional[PaymentGateway] = None,
+                 max_workers: int = DEFAULT_PAYMENT_WORKERS,
+                 timeout: float = DEFAULT_PAYMENT_TIMEOUT):
+        self.gateway = gateway or PaymentGateway()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='payment')
+        self._jobs: "OrderedDict[str, Tuple[str, Future]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -- submission -------------------------------------------------------
+
+    def _submit(self, kind: str, fn: Callable, *args, keyed: bool = False,
+                callback: Optional[Callable[[Future], None]] = None) -> Tuple[str, Future]:
+        job_id = f"pay_{uuid.uuid4().hex}"
+        # Gateway calls of a job share its id as idempotency key, so retries charge once
+        kwargs = {'idempotency_key': job_id} if keyed else {}
+        future = self._pool.submit(fn, *args, **kwargs)
+        if callback is not None:
+            future.add_done_callback(callback)
+        with self._lock:
+            self._jobs[job_id] = (kind, future)
+            while len(self._jobs) > MAX_TRACKED_JOBS:
+                oldest_id, (_, oldest) = next(iter(self._jobs.items()))
+                if not oldest.done():
+                    break
+                del self._jobs[oldest_id]
+        return job_id, future
+
+    def submit_late_fee_payment(self, patron_id: str, book_id: int,
+                                callback: Optional[Callable[[Future], None]] = None) -> Tuple[str, Future]:
+        """Run pay_late_fees() in the pool; the future yields its (success, txn_id, message)."""
+        return self._submit('payment', pay_late_fees, patron_id, book_id, self.gateway, keyed=True,
+                            callback=callback)
+
+    def submit_pay_all_late_fees(self, patron_id: str,
+                                 callback: Optional[Callable[[Future], None]] = None) -> Tuple[str, Future]:
+        """Run pay_all_late_fees() in the pool; the future yields its result dict."""
+        return self._submit('payment_all', pay_all_late_fees, patron_id, self.gateway, keyed=True,
+                            callback=callback)
+
+    def submit_refund(self, transaction_id: str, amount: float,
+                      callback: Optional[Callable[[Future], None]] = None) -> Tuple[str, Future]:
+        """Run refund_late_fee_payment() in the pool; the future yields (success, message)."""
+        return self._submit('refund', refund_late_fee_payment, transaction_id, amount, self.gateway,
+                            keyed=True, callback=callback)
+
+    def submit_verification(self, transaction_id: str,
+                            callback: Optional[Callable[[Future], None]] = None) -> Tuple[str, Future]:
+        """Run gateway.verify_payment_status() in the pool; the future yields its status dict."""
+        return self._submit('verification', self.gateway.verify_payment_status, transaction_id,
+                            callback=callback)
+
+    # -- results ----------------------------------------------------------
+
+    def job_status(self, job_id: str) -> Optional[Dict]:
+        """
+        Describe a submitted job, or None if the id is unknown.
+
+        Returns:
+            {'job_id', 'kind', 'status': 'pending' | 'completed' | 'failed', ...}
+            plus 'transaction_id' / 'message' for payments and refunds, the
+            pay_all_late_fees() fields for consolidated payments, or 'result'
+            for verifications.
+        """
+        with self._lock:
+            entry = self._jobs.get(job_id)
+        if entry is None:
+            return None
+        kind, future = entry
+        status: Dict = {'job_id': job_id, 'kind': kind}
+
+        if not future.done():
+            status['status'] = 'pending'
+            return status
+        if future.cancelled():
+            status.update(status='failed', message='Cancelled before it started.')
+            return status
+        exc = future.exception()
+        if exc is not None:
+            status.update(status='failed', message=f'{kind.capitalize()} failed due to an exception: {exc}')
+            return status
+
+        result = future.result()
+        if kind == 'payment':
+            success, transaction_id, message = result
+            status.update(status='completed' if success else 'failed',
+                          transaction_id=transaction_id, message=message)
+        elif kind == 'payment_all':
+            status.update(result)
+            status['status'] = 'completed' if result['success'] else 'failed'
+        elif kind == 'refund':
+            success, message = result
+            status.update(status='completed' if success else 'failed', message=message)
+        else:
+            status.update(status='completed', result=result)
+        return status
+
+    def pay_late_fees_many(self, loans: Iterable[Tuple[str, int]],
+                           timeout: Optional[float] = None) -> List[Tuple[bool, Optional[str], str]]:
+        """
+        Pay late fees for many (patron_id, book_id) pairs concurrently.
+
+        Results come back in input order, in the same (success, txn_id,
+        message) shape as pay_late_fees(). Every call must finish within
+        `timeout` seconds (default: the executor's timeout) of submission,
+        so the whole batch waits at most that long.
+        """
+        limit = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + limit
+        futures = [self.submit_late_fee_payment(patron_id, book_id)[1] for patron_id, book_id in loans]
+
+        results: List[Tuple[bool, Optional[str], str]] = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except TimeoutError:
+                if future.cancel():
+                    results.append((False, None, f"Payment not started within {limit:g}s."))
+                else:
+                    results.append((False, None, f"Payment timed out after {limit:g}s; "
+                                                 "verify its status before retrying."))
+            except Exception as exc:
+                results.append((False, None, f"Payment failed due to an exception: {exc}"))
+        return results
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting work; with wait=True, block until running calls finish."""
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def payment_timeout(config, gateway: PaymentGateway) -> float:
+    """PAYMENT_TIMEOUT, raised to the live gateway's retry budget so callers never give up on a call mid-retry."""
+    timeout = config.get('PAYMENT_TIMEOUT', DEFAULT_PAYMENT_TIMEOUT)
+    return max(timeout, gateway.retry_budget) if gateway.live else timeout
+
+
+def init_app(app) -> PaymentExecutor:
+    """Create the app's payment executor from PAYMENT_WORKERS / PAYMENT_TIMEOUT and the gateway settings."""
+    gateway = create_gateway(app.config)
+    executor = PaymentExecutor(
+        gateway=gateway,
+        max_workers=app.config.get('PAYMENT_WORKERS', DEFAULT_PAYMENT_WORKERS),
+        timeout=payment_timeout(app.config, gateway),
+    )
+    app.extensions['payment_executor'] = executor
+    return executor
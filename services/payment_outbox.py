@@ -0,0 +1,353 @@
+"""
+Payment Outbox Module - Durable queue of payment intents
+pay_late_fees(defer=True) and refund_late_fee_payment(defer=True) record the
+intent in the `payment_outbox` table and return at once. A background worker
+drains the table through PaymentGateway, retrying failures with exponential
+backoff. Every entry carries an idempotency key that is sent on each attempt,
+so an entry that is retried after a crash is not charged twice.
+
+Late fee charges reserve their fees in fee_payments under the entry's
+idempotency key first; a completed charge turns the reservation into paid
+rows and a declined one releases it.
+
+Entry lifecycle:
+    pending -> processing -> completed
+                          -> pending (retry after backoff) -> ... -> failed
+                          -> failed (declined by the gateway)
+"""
+
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from database import (
+    db_connection, immediate_transaction, read_connection,
+    complete_fee_payments, release_fee_payments, get_stale_fee_reservations,
+)
+from services.payment_service import PaymentGateway, create_gateway
+
+MAX_OUTBOX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE = 2.0     # seconds before the first retry, doubled per attempt
+OUTBOX_BACKOFF_MAX = 300.0
+OUTBOX_LEASE_SECONDS = 60.0   # minimum lease; a 'processing' entry past its lease is presumed abandoned
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_POLL_INTERVAL = 1.0
+
+
+class IdempotencyKeyConflict(Exception):
+    """Raised when an idempotency key already queued a different payment or refund."""
+
+
+def outbox_lease_seconds(gateway: PaymentGateway, batch_size: int = OUTBOX_BATCH_SIZE) -> float:
+    """
+    How long a worker may hold a claimed batch: long enough to send every
+    entry in it, each taking up to the live gateway's retry budget, so an
+    entry is never re-claimed while its first send is still running.
+    """
+    if not gateway.live:
+        return OUTBOX_LEASE_SECONDS
+    return max(OUTBOX_LEASE_SECONDS, batch_size * gateway.retry_budget)
+
+
+def _timestamp(moment: datetime) -> str:
+    # Fixed-width so that timestamps compare correctly as strings in SQL
+    return moment.isoformat(timespec='microseconds')
+
+
+def _entry_dict(row: sqlite3.Row) -> Dict:
+    return {
+        'payment_id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'patron_id': row['patron_id'],
+        'book_id': row['book_id'],
+        'transaction_id': row['transaction_id'],
+        'amount': row['amount'],
+        'attempts': row['attempts'],
+        'message': row['message'],
+        'idempotency_key': row['idempotency_key'],
+    }
+
+
+def check_same_request(entry: Dict, kind: str, patron_id: Optional[str] = None, book_id: Optional[int] = None,
+                       transaction_id: Optional[str] = None, amount: Optional[float] = None) -> Dict:
+    """
+    Return an entry found under a repeated idempotency key, or raise
+    IdempotencyKeyConflict if it was queued for a different request. amount
+    is only compared when given: a late fee is worked out by the server and
+    may have grown since the first request.
+    """
+    same = (entry['kind'] == kind and entry['patron_id'] == patron_id and entry['book_id'] == book_id
+            and entry['transaction_id'] == transaction_id
+            and (amount is None or abs(entry['amount'] - amount) < 0.005))
+    if not same:
+        raise IdempotencyKeyConflict('Idempotency key was already used for a different request.')
+    return entry
+
+
+def _enqueue(kind: str, amount: float, idempotency_key: Optional[str], patron_id: Optional[str] = None,
+             book_id: Optional[int] = None, transaction_id: Optional[str] = None,
+             description: str = '') -> str:
+    """
+    Insert an entry, or return the existing one's id if the idempotency key
+    was seen before for the same request (see check_same_request()).
+    """
+    entry_id = f"out_{uuid.uuid4().hex}"
+    key = idempotency_key or entry_id
+    now = _timestamp(datetime.now())
+    with db_connection() as conn:
+        with immediate_transaction(conn):
+            conn.execute('''
+                INSERT OR IGNORE INTO payment_outbox
+                    (id, kind, idempotency_key, patron_id, book_id, transaction_id, amount,
+                     description, next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (entry_id, kind, key, patron_id, book_id, transaction_id, amount,
+                  description, now, now, now))
+            row = conn.execute('SELECT * FROM payment_outbox WHERE idempotency_key = ?', (key,)).fetchone()
+    # A refund's amount comes from the client, so a changed amount is a different refund
+    return check_same_request(_entry_dict(row), kind, patron_id, book_id, transaction_id,
+                              amount if kind == 'refund' else None)['payment_id']
+
+
+def enqueue_payment(patron_id: str, amount: float, description: str = '', book_id: Optional[int] = None,
+                    idempotency_key: Optional[str] = None) -> str:
+    """
+    Queue a charge; returns the outbox id (the existing one for a repeated
+    idempotency key). Raises IdempotencyKeyConflict if the key queued another request.
+    """
+    return _enqueue('payment', amount, idempotency_key, patron_id=patron_id, book_id=book_id,
+                    description=description)
+
+
+def enqueue_refund(transaction_id: str, amount: float, idempotency_key: Optional[str] = None) -> str:
+    """
+    Queue a refund of `amount` against an earlier charge; returns the outbox
+    id. Raises IdempotencyKeyConflict if the key queued another request.
+    """
+    return _enqueue('refund', amount, idempotency_key, transaction_id=transaction_id)
+
+
+def get_outbox_entry(entry_id: str) -> Optional[Dict]:
+    """Return one outbox entry as a dict, or None if the id is unknown."""
+    with read_connection() as conn:
+        row = conn.execute('SELECT * FROM payment_outbox WHERE id = ?', (entry_id,)).fetchone()
+    return _entry_dict(row) if row else None
+
+
+def get_outbox_entry_by_key(idempotency_key: str) -> Optional[Dict]:
+    """Return the entry queued under an idempotency key, or None."""
+    with read_connection() as conn:
+        row = conn.execute('SELECT * FROM payment_outbox WHERE idempotency_key = ?',
+                           (idempotency_key,)).fetchone()
+    return _entry_dict(row) if row else None
+
+
+def claim_due_entries(limit: int = OUTBOX_BATCH_SIZE, now: Optional[datetime] = None,
+                      lease_seconds: float = OUTBOX_LEASE_SECONDS) -> List[sqlite3.Row]:
+    """
+    Mark up to `limit` due entries as processing for `lease_seconds` and return them.
+
+    Due entries are pending ones whose backoff has elapsed, and processing
+    ones whose lease expired because the worker handling them died.
+    """
+    now = now or datetime.now()
+    stamp = _timestamp(now)
+    with db_connection() as conn:
+        with immediate_transaction(conn):
+            rows = conn.execute('''
+                SELECT * FROM payment_outbox
+                 WHERE (status = 'pending' AND next_attempt_at <= ?)
+                    OR (status = 'processing' AND locked_until <= ?)
+                 ORDER BY created_at
+                 LIMIT ?
+            ''', (stamp, stamp, limit)).fetchall()
+            conn.executemany('''
+                UPDATE payment_outbox
+                   SET status = 'processing', attempts = attempts + 1,
+                       locked_until = ?, updated_at = ?
+                 WHERE id = ?
+            ''', [(_timestamp(now + timedelta(seconds=lease_seconds)), stamp, row['id'])
+                  for row in rows])
+            ids = [row['id'] for row in rows]
+            if not ids:
+                return []
+            # Re-read so callers see the claimed state, including this attempt
+            return conn.execute(
+                f"SELECT * FROM payment_outbox WHERE id IN ({', '.join('?' * len(ids))}) ORDER BY created_at",
+                ids,
+            ).fetchall()
+
+
+def _finish(entry_id: str, status: str, message: str, transaction_id: Optional[str] = None,
+            next_attempt_at: Optional[datetime] = None) -> None:
+    now = datetime.now()
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE payment_outbox
+               SET status = ?, message = ?, transaction_id = COALESCE(?, transaction_id),
+                   next_attempt_at = ?, locked_until = NULL, updated_at = ?
+             WHERE id = ?
+        ''', (status, message, transaction_id, _timestamp(next_attempt_at or now), _timestamp(now), entry_id))
+        conn.commit()
+
+
+def backoff_delay(attempts: int) -> float:
+    """Seconds to wait before retrying an entry that has failed `attempts` times."""
+    return min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+def process_entry(entry: sqlite3.Row, gateway: PaymentGateway, now: Optional[datetime] = None) -> str:
+    """
+    Send one claimed entry to the gateway and record the outcome.
+
+    An exception (network error, timeout) is retried with exponential backoff
+    until MAX_OUTBOX_ATTEMPTS; a declined charge or refund fails at once. A
+    charge that fails either way releases its fee reservation.
+
+    Returns:
+        The entry's new status: 'completed', 'pending' (will retry) or 'failed'.
+    """
+    key = entry['idempotency_key']
+    try:
+        if entry['kind'] == 'payment':
+            success, transaction_id, message = gateway.process_payment(
+                entry['patron_id'], entry['amount'], entry['description'], idempotency_key=key)
+        else:
+            transaction_id = None
+            success, message = gateway.refund_payment(entry['transaction_id'], entry['amount'],
+                                                      idempotency_key=key)
+    except Exception as exc:
+        message = f"{entry['kind'].capitalize()} failed due to an exception: {exc}"
+        if entry['attempts'] >= MAX_OUTBOX_ATTEMPTS:
+            _finish(entry['id'], 'failed', f"{message} (gave up after {entry['attempts']} attempts)")
+            if entry['kind'] == 'payment':
+                # Otherwise recover_fee_reservations() would requeue it forever
+                release_fee_payments(key)
+            return 'failed'
+        retry_at = (now or datetime.now()) + timedelta(seconds=backoff_delay(entry['attempts']))
+        _finish(entry['id'], 'pending', message, next_attempt_at=retry_at)
+        return 'pending'
+
+    if not success:
+        _finish(entry['id'], 'failed', f"{entry['kind'].capitalize()} failed: {message}")
+        if entry['kind'] == 'payment':
+            release_fee_payments(key)
+        return 'failed'
+    _finish(entry['id'], 'completed', message, transaction_id=transaction_id)
+    if entry['kind'] == 'payment':
+        # On failure the rows stay reserved and recover_fee_reservations() retries
+        complete_fee_payments(key, transaction_id, now or datetime.now())
+    return 'completed'
+
+
+def drain_outbox(gateway: PaymentGateway, limit: int = OUTBOX_BATCH_SIZE,
+                 now: Optional[datetime] = None, lease_seconds: float = OUTBOX_LEASE_SECONDS) -> Dict[str, int]:
+    """
+    Claim and process one batch of due entries (see outbox_lease_seconds()).
+
+    Returns:
+        {'claimed': n, 'completed': n, 'pending': n, 'failed': n}
+    """
+    counts = {'claimed': 0, 'completed': 0, 'pending': 0, 'failed': 0}
+    for entry in claim_due_entries(limit, now, lease_seconds):
+        counts['claimed'] += 1
+        counts[process_entry(entry, gateway, now)] += 1
+    return counts
+
+
+def recover_fee_reservations(now: Optional[datetime] = None,
+                             grace_seconds: Optional[float] = None) -> int:
+    """
+    Settle late fee reservations that were left pending.
+
+    A charge whose process died mid-call, or whose result could not be
+    recorded, leaves its fees reserved. Each such reservation is queued here
+    under its reference as idempotency key, so the gateway either replays the
+    original charge or makes it once; an entry that already completed just
+    has its fee_payments rows finalized, and a failed one whose reservation
+    could not be released is retried.
+    Reservations younger than grace_seconds (default: the outbox lease) may
+    still be in flight and are left alone.
+
+    Returns:
+        int: how many reservations were requeued or finalized
+    """
+    now = now or datetime.now()
+    grace = OUTBOX_LEASE_SECONDS if grace_seconds is None else grace_seconds
+    settled = 0
+    for reservation in get_stale_fee_reservations(now - timedelta(seconds=grace)):
+        reference = reservation['reference']
+        entry = get_outbox_entry_by_key(reference)
+        if entry is None:
+            enqueue_payment(reservation['patron_id'], reservation['amount'], 'Late fees (recovered)',
+                            idempotency_key=reference)
+        elif entry['status'] == 'completed' and entry['transaction_id']:
+            if not complete_fee_payments(reference, entry['transaction_id'], now):
+                continue
+        elif entry['status'] == 'failed':
+            with db_connection() as conn:
+                conn.execute('''
+                    UPDATE payment_outbox
+                       SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ?
+                     WHERE id = ?
+                ''', (_timestamp(now), _timestamp(now), entry['payment_id']))
+                conn.commit()
+        else:
+            continue
+        settled += 1
+    return settled
+
+
+class OutboxWorker:
+    """
+    Background thread that keeps draining the outbox.
+
+    Full batches are drained back to back; when a batch comes back short the
+    worker sleeps for poll_interval before looking again.
+    """
+
+    def __init__(self, gateway: Optional[PaymentGateway] = None,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL, batch_size: int = OUTBOX_BATCH_SIZE,
+                 lease_seconds: Optional[float] = None):
+        self.gateway = gateway or PaymentGateway()
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease_seconds = OUTBOX_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self) -> None:
+        """Drain until stop() is called; database errors are retried on the next poll."""
+        while not self._stop.is_set():
+            try:
+                claimed = drain_outbox(self.gateway, self.batch_size, lease_seconds=self.lease_seconds)['claimed']
+            except sqlite3.Error:
+                claimed = 0
+            if claimed < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+    def start(self) -> 'OutboxWorker':
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='payment-outbox', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def init_app(app) -> Optional[OutboxWorker]:
+    """Start the outbox worker when PAYMENT_OUTBOX_WORKER is set."""
+    if not app.config.get('PAYMENT_OUTBOX_WORKER'):
+        return None
+    gateway = create_gateway(app.config)
+    worker = OutboxWorker(gateway=gateway,
+                          poll_interval=app.config.get('PAYMENT_OUTBOX_POLL', OUTBOX_POLL_INTERVAL),
+                          lease_seconds=outbox_lease_seconds(gateway)).start()
+    app.extensions['payment_outbox_worker'] = worker
+    return worker
@@ -1,14 +1,115 @@
 """
 Payment Service Module - External Payment Gateway Integration
-This module simulates integration with an external payment processing API.
+This module simulates integration with an external payment processing API,
+or talks to a real one over HTTP when given a base_url.
 
 For Assignment 3: You will learn to mock this service in their tests
 since we cannot make actual payment API calls during testing.
 """
 
-import requests
-from typing import Dict, Tuple
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+import threading
 import time
+import uuid
+from urllib.parse import quote
+
+if TYPE_CHECKING:
+    import requests
+
+DEFAULT_GATEWAY_URL = "https://api.payment-gateway.example.com"
+DEFAULT_GATEWAY_TIMEOUT = 10.0
+DEFAULT_GATEWAY_RETRIES = 2
+DEFAULT_GATEWAY_BACKOFF = 0.5
+DEFAULT_GATEWAY_BACKOFF_MAX = 4.0
+DEFAULT_GATEWAY_POOL_SIZE = 8
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 30.0
+
+# Keyed results the simulated gateway remembers for replay, oldest dropped first
+MAX_REPLAYED_KEYS = 10000
+
+# Gateway responses that are worth retrying; other statuses are final answers
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the gateway while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the gateway is degraded.
+
+    After `failure_threshold` consecutive failed calls the breaker opens and
+    every call is refused for `reset_timeout` seconds. Then one trial call is
+    let through (half-open): success closes the breaker, failure opens it
+    again for another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 reset_timeout: float = DEFAULT_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """'closed', 'open' or 'half_open'."""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go out now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                raise CircuitOpenError("Payment gateway unavailable (circuit open)")
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+def create_gateway(config: Optional[Dict] = None) -> "PaymentGateway":
+    """
+    Build a gateway from app settings (PAYMENT_GATEWAY_URL, _KEY, _TIMEOUT,
+    _RETRIES, _BACKOFF, _BACKOFF_MAX, PAYMENT_WORKERS for the pool size,
+    PAYMENT_BREAKER_*).
+    Without PAYMENT_GATEWAY_URL the gateway is simulated.
+    """
+    config = config or {}
+    return PaymentGateway(
+        api_key=config.get("PAYMENT_GATEWAY_KEY") or "test_key_12345",
+        base_url=config.get("PAYMENT_GATEWAY_URL"),
+        timeout=config.get("PAYMENT_GATEWAY_TIMEOUT", DEFAULT_GATEWAY_TIMEOUT),
+        max_retries=config.get("PAYMENT_GATEWAY_RETRIES", DEFAULT_GATEWAY_RETRIES),
+        backoff_factor=config.get("PAYMENT_GATEWAY_BACKOFF", DEFAULT_GATEWAY_BACKOFF),
+        backoff_max=config.get("PAYMENT_GATEWAY_BACKOFF_MAX", DEFAULT_GATEWAY_BACKOFF_MAX),
+        pool_size=config.get("PAYMENT_WORKERS", DEFAULT_GATEWAY_POOL_SIZE),
+        breaker=CircuitBreaker(
+            config.get("PAYMENT_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD),
+            config.get("PAYMENT_BREAKER_RESET", DEFAULT_BREAKER_RESET),
+        ),
+    )
 
 
 class PaymentGateway:
@@ -16,23 +117,156 @@ class PaymentGateway:
     Simulates an external payment gateway API.
     In production, this would connect to services like Stripe, PayPal, etc.
     
+    Pass base_url to talk to a real gateway over HTTP instead. Calls then
+    share one pooled keep-alive requests.Session, transient failures
+    (connection errors, 429/5xx) are retried with exponential backoff under
+    the same Idempotency-Key, and a CircuitBreaker refuses calls while the
+    gateway keeps failing. Transient failures raise, so callers treat them
+    like any other gateway exception; declines come back as results.
+    
     For testing purposes, you should MOCK this class to avoid:
     - Making actual API calls
     - Depending on external service availability
     - Incurring costs or rate limits
     """
     
-    def __init__(self, api_key: str = "test_key_12345"):
+    def __init__(self, api_key: str = "test_key_12345", base_url: Optional[str] = None,
+                 timeout: float = DEFAULT_GATEWAY_TIMEOUT, max_retries: int = DEFAULT_GATEWAY_RETRIES,
+                 backoff_factor: float = DEFAULT_GATEWAY_BACKOFF, pool_size: int = DEFAULT_GATEWAY_POOL_SIZE,
+                 breaker: Optional[CircuitBreaker] = None, backoff_max: float = DEFAULT_GATEWAY_BACKOFF_MAX):
         """
         Initialize payment gateway with API credentials.
         
         Args:
             api_key: API key for authentication (default is test key)
+            base_url: Gateway URL; None keeps the built-in simulation
+            timeout: Seconds to wait for each HTTP response
+            max_retries: Retries of a transient failure before giving up
+            backoff_factor: Retry n waits backoff_factor * 2 ** (n - 1) seconds
+            backoff_max: Longest single wait between retries, in seconds
+            pool_size: Keep-alive connections kept open to the gateway
+            breaker: Circuit breaker to use (default: a new CircuitBreaker)
         """
         self.api_key = api_key
-        self.base_url = "https://api.payment-gateway.example.com"
+        self.live = base_url is not None
+        self.base_url = (base_url or DEFAULT_GATEWAY_URL).rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self._session: Optional["requests.Session"] = None
+        self._session_lock = threading.Lock()
+        # Simulation only: results of keyed requests, replayed when the same key is sent again
+        self._idempotent_results: "OrderedDict[str, Tuple]" = OrderedDict()
+        self._key_locks: Dict[str, list] = {}
+        self._idempotency_lock = threading.Lock()
+
+    @property
+    def session(self) -> "requests.Session":
+        """The shared HTTP session, created on first use."""
+        with self._session_lock:
+            if self._session is None:
+                # requests is only needed in live mode; importing it here keeps app startup fast
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(
+                    total=self.max_retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=RETRY_STATUSES,
+                    backoff_max=self.backoff_max,
+                    # A Retry-After header could stretch a call past retry_budget
+                    respect_retry_after_header=False,
+                    # Charges and refunds carry an Idempotency-Key, so POST is safe to retry
+                    allowed_methods=frozenset({"GET", "POST"}),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Authorization": f"Bearer {self.api_key}"})
+                self._session = session
+            return self._session
+
+    @property
+    def retry_budget(self) -> float:
+        """
+        Longest a live call can take, in seconds: every attempt using its
+        connect and read timeouts plus the backoff waits between them.
+        Callers waiting on a call should wait at least this long.
+        """
+        waits = sum(min(self.backoff_max, self.backoff_factor * 2 ** n) for n in range(self.max_retries))
+        return (self.max_retries + 1) * 2 * self.timeout + waits
+
+    def close(self) -> None:
+        """Close pooled connections; the next call opens a new session."""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _request(self, method: str, path: str, idempotency_key: Optional[str] = None,
+                 payload: Optional[Dict] = None) -> Tuple[int, Dict]:
+        """
+        Send one request through the breaker and return (status_code, json body).
+
+        Raises CircuitOpenError while the breaker is open, and
+        requests.RequestException once retries are used up on a transient failure.
+        """
+        import requests
+
+        self.breaker.before_call()
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", json=payload,
+                                            headers=headers, timeout=self.timeout)
+            if response.status_code in RETRY_STATUSES:
+                raise requests.HTTPError(f"Gateway returned HTTP {response.status_code}", response=response)
+            body = response.json() if response.content else {}
+        except (requests.RequestException, ValueError):
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return response.status_code, body
+
+    def _replay(self, idempotency_key: Optional[str], call):
+        """
+        Run call() once per idempotency key; repeated keys get the first result back.
+
+        Concurrent calls with one key wait on a per-key lock, so only the first
+        runs. The simulation keeps the last MAX_REPLAYED_KEYS results in memory
+        only; a real gateway stores its keys durably.
+        """
+        if idempotency_key is None:
+            return call()
+        with self._idempotency_lock:
+            # [lock, callers holding or waiting for it]; dropped when the last one leaves
+            entry = self._key_locks.setdefault(idempotency_key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                with self._idempotency_lock:
+                    if idempotency_key in self._idempotent_results:
+                        self._idempotent_results.move_to_end(idempotency_key)
+                        return self._idempotent_results[idempotency_key]
+                result = call()
+                with self._idempotency_lock:
+                    self._idempotent_results[idempotency_key] = result
+                    while len(self._idempotent_results) > MAX_REPLAYED_KEYS:
+                        self._idempotent_results.popitem(last=False)
+                return result
+        finally:
+            with self._idempotency_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[idempotency_key]
     
-    def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+    def process_payment(self, patron_id: str, amount: float, description: str = "",
+                        idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
         """
         Process a payment through the external gateway.
         
@@ -43,6 +277,8 @@ class PaymentGateway:
             patron_id: 6-digit patron/customer ID
             amount: Payment amount in dollars
             description: Payment description
+            idempotency_key: Optional key; retrying with the same key returns the
+                             original result instead of charging again
             
         Returns:
             tuple: (success: bool, transaction_id: str, message: str)
@@ -51,6 +287,19 @@ class PaymentGateway:
             gateway = PaymentGateway()
             success, txn_id, msg = gateway.process_payment("123456", 10.50, "Late fees")
         """
+        if self.live:
+            status, body = self._request("POST", "/charges", idempotency_key or uuid.uuid4().hex, {
+                "customer_id": patron_id,
+                "amount": amount,
+                "currency": "usd",
+                "description": description,
+            })
+            if status >= 400 or not body.get("success", False):
+                return False, "", body.get("message", f"Payment declined (HTTP {status})")
+            return True, body["transaction_id"], body.get("message", "")
+        return self._replay(idempotency_key, lambda: self._charge(patron_id, amount, description))
+
+    def _charge(self, patron_id: str, amount: float, description: str) -> Tuple[bool, str, str]:
         # Simulate API call delay
         time.sleep(0.5)
         
@@ -82,7 +331,8 @@ class PaymentGateway:
         transaction_id = f"txn_{patron_id}_{int(time.time())}"
         return True, transaction_id, f"Payment of ${amount:.2f} processed successfully"
     
-    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+    def refund_payment(self, transaction_id: str, amount: float,
+                       idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
         """
         Refund a previous payment.
         
@@ -92,10 +342,23 @@ class PaymentGateway:
         Args:
             transaction_id: Original transaction ID to refund
             amount: Amount to refund
+            idempotency_key: Optional key; retrying with the same key returns the
+                             original result instead of refunding again
             
         Returns:
             tuple: (success: bool, message: str)
         """
+        if self.live:
+            status, body = self._request("POST", "/refunds", idempotency_key or uuid.uuid4().hex, {
+                "transaction_id": transaction_id,
+                "amount": amount,
+            })
+            if status >= 400 or not body.get("success", False):
+                return False, body.get("message", f"Refund declined (HTTP {status})")
+            return True, body.get("message", "")
+        return self._replay(idempotency_key, lambda: self._refund(transaction_id, amount))
+
+    def _refund(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
         time.sleep(0.5)
         
         if not transaction_id or not transaction_id.startswith("txn_"):
@@ -120,6 +383,12 @@ class PaymentGateway:
         Returns:
             dict: Payment status information
         """
+        if self.live:
+            status, body = self._request("GET", f"/charges/{quote(transaction_id, safe='')}")
+            if status == 404:
+                return {"status": "not_found", "message": body.get("message", "Transaction not found")}
+            return body
+
         time.sleep(0.3)
         
         if not transaction_id or not transaction_id.startswith("txn_"):
@@ -0,0 +1,220 @@
+"""
+Reconciliation Module - Compare recorded payments with the gateway
+Checks every charge the library has recorded (the `payment_transactions`
+table, written whenever late fee payments are recorded) against
+PaymentGateway.verify_payment_status(), many at a time on a PaymentExecutor,
+and stores each disagreement in the `reconciliation_issues` table.
+
+The sweep walks transactions by their `seq`, which follows commit order, and
+saves its position in `reconciliation_checkpoints` after every batch, so a run
+that stops part way resumes where it left off, and a later run checks every
+transaction committed since, including ones whose recorded_at is older than
+the last checkpoint.
+"""
+
+import math
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database import db_connection, immediate_transaction, read_connection
+from services.payment_executor import PaymentExecutor
+from services.payment_outbox import recover_fee_reservations, OUTBOX_LEASE_SECONDS
+
+RECONCILE_BATCH_SIZE = 500
+DEFAULT_CHECKPOINT = 'payments'
+AMOUNT_TOLERANCE = 0.005
+
+# Walks the primary key, so each batch is a range read with no sort
+_RECORDED_TRANSACTIONS_SQL = """
+    SELECT seq, transaction_id, recorded_at, amount
+      FROM payment_transactions
+     WHERE seq > :after
+     ORDER BY seq
+     LIMIT :limit
+"""
+
+
+def get_checkpoint(name: str = DEFAULT_CHECKPOINT) -> Optional[Dict]:
+    """Return {'seq', 'recorded_at', 'transaction_id'} of the last checked transaction, or None."""
+    with read_connection() as conn:
+        row = conn.execute(
+            'SELECT seq, recorded_at, transaction_id FROM reconciliation_checkpoints WHERE name = ?', (name,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def reset_checkpoint(name: str = DEFAULT_CHECKPOINT) -> None:
+    """Forget a checkpoint so the next sweep starts from the beginning of its window."""
+    with db_connection() as conn:
+        conn.execute('DELETE FROM reconciliation_checkpoints WHERE name = ?', (name,))
+        conn.commit()
+
+
+def _compare(recorded: Dict, status: Optional[Dict], error: Optional[str]) -> Optional[Dict]:
+    """Return the issue row for one transaction, or None if gateway and ledger agree."""
+    issue = {
+        'transaction_id': recorded['transaction_id'],
+        'recorded_at': recorded['recorded_at'],
+        'ledger_amount': recorded['amount'],
+        'gateway_status': None,
+        'gateway_amount': None,
+    }
+    if error is not None:
+        return dict(issue, issue=f'unverified: {error}')
+
+    issue['gateway_status'] = status.get('status')
+    amount = status.get('amount')
+    issue['gateway_amount'] = float(amount) if amount is not None else None
+    if issue['gateway_status'] == 'not_found':
+        return dict(issue, issue='missing at gateway')
+    if issue['gateway_status'] != 'completed':
+        return dict(issue, issue='status mismatch')
+    if issue['gateway_amount'] is not None and abs(issue['gateway_amount'] - recorded['amount']) > AMOUNT_TOLERANCE:
+        return dict(issue, issue='amount mismatch')
+    return None
+
+
+def _verify_batch(executor: PaymentExecutor, batch: List[Dict]) -> List[Dict]:
+    """
+    Verify a batch concurrently; return the issues found.
+
+    The whole batch shares one deadline: the executor's timeout for each
+    round of checks the pool has to run, so a batch larger than the pool is
+    not cut short, but slow checks cannot add up to len(batch) timeouts.
+    Checks still running or queued at the deadline are recorded as unverified.
+    """
+    rounds = math.ceil(len(batch) / max(1, executor.max_workers))
+    deadline = time.monotonic() + rounds * executor.timeout
+    futures = [executor.submit_verification(row['transaction_id'])[1] for row in batch]
+    issues = []
+    for recorded, future in zip(batch, futures):
+        status, error = None, None
+        try:
+            status = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as exc:
+            future.cancel()
+            error = str(exc) or type(exc).__name__
+        issue = _compare(recorded, status, error)
+        if issue is not None:
+            issues.append(issue)
+    return issues
+
+
+def _first_seq(since: Optional[datetime]) -> int:
+    """seq to start after so that transactions recorded before `since` are skipped."""
+    if since is None:
+        return 0
+    with read_connection() as conn:
+        row = conn.execute('SELECT MIN(seq) FROM payment_transactions WHERE recorded_at >= ?',
+                           (since.isoformat(),)).fetchone()
+    return row[0] - 1 if row[0] is not None else 0
+
+
+def reconcile_payments(executor: PaymentExecutor, since: Optional[datetime] = None,
+                       until: Optional[datetime] = None, checkpoint: str = DEFAULT_CHECKPOINT,
+                       batch_size: int = RECONCILE_BATCH_SIZE,
+                       max_transactions: Optional[int] = None) -> Dict:
+    """
+    Verify recorded transactions in [since, until) that are past the checkpoint.
+
+    The walk stops at the first transaction recorded at or after `until`
+    (default now), so the checkpoint never moves past a transaction that a
+    later sweep should check. Each batch is verified on the executor's pool, then its issues and the
+    new checkpoint are committed together. max_transactions stops the sweep
+    early; the next call with the same checkpoint carries on from there.
+    Late fee reservations left pending by an interrupted charge are first
+    handed to the payment outbox (see recover_fee_reservations()) once they
+    are older than the executor's timeout, so charges still running are left alone.
+
+    Returns:
+        {
+            'checked': int, 'issues': int, 'unverified': int,
+            'reservations_recovered': int,
+            'resumed_from': {'seq', 'recorded_at', 'transaction_id'} | None,
+            'checkpoint': {'seq', 'recorded_at', 'transaction_id'} | None,
+            'complete': bool,   # False if stopped by max_transactions
+            'elapsed_seconds': float, 'transactions_per_second': float,
+        }
+    """
+    started = time.perf_counter()
+    recovered = recover_fee_reservations(grace_seconds=max(OUTBOX_LEASE_SECONDS, executor.timeout))
+    resumed_from = get_checkpoint(checkpoint)
+    position = dict(resumed_from) if resumed_from else {'seq': 0, 'recorded_at': '', 'transaction_id': ''}
+    position['seq'] = max(position['seq'], _first_seq(since))
+    since_at = since.isoformat() if since else ''
+    until_at = (until or datetime.now()).isoformat()
+    checked = issues = unverified = 0
+    complete = True
+
+    while True:
+        limit = batch_size
+        if max_transactions is not None:
+            limit = min(limit, max_transactions - checked)
+            if limit <= 0:
+                complete = False
+                break
+
+        with read_connection() as conn:
+            rows = [dict(row) for row in conn.execute(_RECORDED_TRANSACTIONS_SQL, {
+                'after': position['seq'], 'limit': limit,
+            }).fetchall()]
+        walked = []
+        for row in rows:
+            if row['recorded_at'] >= until_at:
+                break
+            walked.append(row)
+        if not walked:
+            break
+
+        batch = [row for row in walked if row['recorded_at'] >= since_at]
+        found = _verify_batch(executor, batch)
+        last = walked[-1]
+        position = {'seq': last['seq'], 'recorded_at': last['recorded_at'], 'transaction_id': last['transaction_id']}
+        now = datetime.now().isoformat()
+        with db_connection() as conn:
+            with immediate_transaction(conn):
+                conn.executemany('''
+                    INSERT INTO reconciliation_issues
+                        (checked_at, transaction_id, recorded_at, ledger_amount,
+                         gateway_status, gateway_amount, issue)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(now, i['transaction_id'], i['recorded_at'], i['ledger_amount'],
+                       i['gateway_status'], i['gateway_amount'], i['issue']) for i in found])
+                conn.execute('''
+                    INSERT INTO reconciliation_checkpoints (name, seq, recorded_at, transaction_id, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        seq = excluded.seq,
+                        recorded_at = excluded.recorded_at,
+                        transaction_id = excluded.transaction_id,
+                        updated_at = excluded.updated_at
+                ''', (checkpoint, position['seq'], position['recorded_at'], position['transaction_id'], now))
+
+        checked += len(batch)
+        issues += len(found)
+        unverified += sum(1 for i in found if i['issue'].startswith('unverified'))
+        if len(walked) < len(rows):
+            break
+
+    elapsed = time.perf_counter() - started
+    return {
+        'checked': checked,
+        'issues': issues,
+        'unverified': unverified,
+        'reservations_recovered': recovered,
+        'resumed_from': resumed_from,
+        'checkpoint': get_checkpoint(checkpoint),
+        'complete': complete,
+        'elapsed_seconds': round(elapsed, 3),
+        'transactions_per_second': round(checked / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def get_reconciliation_issues(limit: int = 100) -> List[Dict]:
+    """Most recently recorded issues first."""
+    with read_connection() as conn:
+        rows = conn.execute(
+            'SELECT * FROM reconciliation_issues ORDER BY id DESC LIMIT ?', (limit,)
+        ).fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,198 @@
+"""
+SQL tracing - query counts, SQL time per request and a slow-query log
+
+get_db_connection() opens connections with TracingConnection, whose cursors
+time every statement from execute() until its rows have been fetched. Inside
+a request the totals accumulate in flask.g; with SQL_TRACE_HEADERS (on in
+debug mode) they are returned as X-SQL-Queries / X-SQL-Time-Ms headers.
+Statements slower than SQL_SLOW_QUERY_MS go to the 'library.sql.slow'
+logger, tagged with the request's method, path and endpoint.
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from flask import g, has_request_context, request
+
+DEFAULT_SLOW_QUERY_MS = 100.0
+
+# Settings for new connections; see configure()
+ENABLED = True
+SLOW_QUERY_MS = DEFAULT_SLOW_QUERY_MS
+
+slow_query_log = logging.getLogger('library.sql.slow')
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def configure(enabled: Optional[bool] = None, slow_query_ms: Optional[float] = None,
+              log_path: Optional[str] = None) -> None:
+    """Turn tracing on or off, set the slow-query threshold, and optionally log slow queries to a file."""
+    global ENABLED, SLOW_QUERY_MS
+    if enabled is not None:
+        ENABLED = bool(enabled)
+    if slow_query_ms is not None:
+        SLOW_QUERY_MS = float(slow_query_ms)
+    if log_path and not any(getattr(h, 'baseFilename', None) == log_path for h in slow_query_log.handlers):
+        handler = logging.FileHandler(log_path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_log.addHandler(handler)
+        slow_query_log.setLevel(logging.WARNING)
+
+
+def request_stats() -> Dict:
+    """{'queries': int, 'seconds': float} for the current request (zeros outside one)."""
+    if not has_request_context():
+        return {'queries': 0, 'seconds': 0.0}
+    return dict(g.get('_sql_stats') or {'queries': 0, 'seconds': 0.0})
+
+
+def _record(seconds: float, query: bool) -> None:
+    if not has_request_context():
+        return
+    stats = g.get('_sql_stats')
+    if stats is None:
+        stats = g._sql_stats = {'queries': 0, 'seconds': 0.0}
+    stats['seconds'] += seconds
+    if query:
+        stats['queries'] += 1
+
+
+def _route() -> str:
+    if has_request_context():
+        return f'{request.method} {request.path} ({request.endpoint or "unmatched"})'
+    return f'[{threading.current_thread().name}]'
+
+
+class TracingCursor(sqlite3.Cursor):
+    """Cursor that times each statement across execute() and its fetches."""
+
+    _sql: Optional[str] = None
+    _elapsed = 0.0
+
+    def _begin(self, sql: str, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self._sql, self._elapsed = sql, elapsed
+        _record(elapsed, query=True)
+
+    def _add(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self._elapsed += elapsed
+        _record(elapsed, query=False)
+
+    def _finish(self) -> None:
+        """Close the books on the current statement and log it if it was slow."""
+        sql, self._sql = self._sql, None
+        if sql is not None and self._elapsed * 1000 >= SLOW_QUERY_MS:
+            slow_query_log.warning('%.1f ms %s %s', self._elapsed * 1000, _route(),
+                                   _WHITESPACE.sub(' ', sql).strip())
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._begin(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._begin(sql, started)
+
+    def executescript(self, sql_script):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._begin(sql_script, started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._add(started)
+            self._finish()
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add(started)
+        if len(rows) < (self.arraysize if size is None else size):
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._add(started)
+            self._finish()
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add(started)
+            self._finish()
+            raise
+        self._add(started)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TracingConnection(sqlite3.Connection):
+    """Connection whose cursors, including those behind conn.execute(), are TracingCursors."""
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    # The C shortcuts bypass cursor(), so route them through it explicitly
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def connection_factory():
+    """The sqlite3.connect() factory to use for new connections."""
+    return TracingConnection if ENABLED else sqlite3.Connection
+
+
+def init_app(app) -> None:
+    """Apply SQL_TRACE / SQL_SLOW_QUERY_* settings and add the per-request headers."""
+    configure(app.config.get('SQL_TRACE', True), app.config.get('SQL_SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS),
+              app.config.get('SQL_SLOW_QUERY_LOG'))
+
+    @app.after_request
+    def _sql_headers(response):
+        headers = app.config.get('SQL_TRACE_HEADERS')
+        if headers or (headers is None and app.debug):
+            stats = request_stats()
+            response.headers['X-SQL-Queries'] = str(stats['queries'])
+            response.headers['X-SQL-Time-Ms'] = f"{stats['seconds'] * 1000:.2f}"
+        return response
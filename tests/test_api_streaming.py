@@ -0,0 +1,60 @@
+"""
+Streaming API responses
+Expectations:
+- /api/search streams NDJSON (one book per line) for stream=1 or
+  "Accept: application/x-ndjson", without the page-size cap.
+- /api/books exports the whole catalog as NDJSON in id order.
+- Plain JSON search responses are unchanged.
+- A limit beyond SQLite's integer range is clamped before streaming starts.
+"""
+import json
+
+
+def _lines(resp):
+    return [json.loads(line) for line in resp.get_data(as_text=True).splitlines() if line]
+
+
+def test_search_stream_param_returns_ndjson(client, add_and_get_book_id):
+    for i in range(4):
+        add_and_get_book_id(f"Stream Book {i}", "Streamer", f"606060606060{i}", 1)
+    r = client.get("/api/search?q=stream%20book&type=title&stream=1")
+    assert r.status_code == 200
+    assert r.mimetype == "application/x-ndjson"
+    assert [b["title"] for b in _lines(r)] == [f"Stream Book {i}" for i in range(4)]
+
+
+def test_search_accept_header_selects_ndjson(client):
+    r = client.get("/api/search?q=george&type=author", headers={"Accept": "application/x-ndjson"})
+    assert r.mimetype == "application/x-ndjson"
+    assert [b["isbn"] for b in _lines(r)] == ["9780451524935"]
+
+
+def test_search_stream_is_not_capped_by_page_size(client, svc, add_and_get_book_id):
+    total = svc.MAX_SEARCH_PAGE_SIZE + 5
+    for i in range(total):
+        add_and_get_book_id(f"Bulk {i:04d}", "Many", f"7{i:012d}", 1)
+    r = client.get("/api/search?q=bulk&type=title&stream=1")
+    assert len(_lines(r)) == total
+
+
+def test_search_stream_clamps_huge_limit(client):
+    r = client.get(f"/api/search?q=gatsby&type=title&stream=1&limit={2 ** 70}&offset={2 ** 70}")
+    assert r.status_code == 200
+    assert _lines(r) == []
+    r = client.get(f"/api/search?q=gatsby&type=title&stream=1&limit={2 ** 70}")
+    assert [b["title"] for b in _lines(r)] == ["The Great Gatsby"]
+
+
+def test_books_export_streams_whole_catalog(client, add_and_get_book_id):
+    add_and_get_book_id("Exported", "Author", "6161616161616", 1)
+    r = client.get("/api/books")
+    assert r.mimetype == "application/x-ndjson"
+    rows = _lines(r)
+    assert [b["id"] for b in rows] == sorted(b["id"] for b in rows)
+    assert {"Exported", "The Great Gatsby"} <= {b["title"] for b in rows}
+
+
+def test_json_search_unchanged_without_stream(client):
+    r = client.get("/api/search?q=gatsby&type=title")
+    assert r.mimetype == "application/json"
+    assert r.get_json()["count"] == 1
@@ -0,0 +1,73 @@
+"""
+Atomic borrow / return
+Expectations:
+- Concurrent checkouts of the last copy never oversell it.
+- A successful borrow leaves exactly one loan row and one decrement.
+- Return closes the loan and restocks the copy together.
+"""
+import sqlite3
+import threading
+
+
+def _book_row(db_path, book_id):
+    with sqlite3.connect(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        return conn.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+
+
+def _active_loans(db_path, book_id):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM borrows WHERE book_id = ? AND return_date IS NULL", (book_id,)
+        ).fetchone()[0]
+
+
+def test_concurrent_borrows_never_oversell_last_copy(svc, add_and_get_book_id, db_path):
+    book_id = add_and_get_book_id("Last Copy", "Author", "8100000000001", 1)
+    patrons = [f"81000{i}" for i in range(8)]
+    results = []
+    barrier = threading.Barrier(len(patrons))
+
+    def worker(pid):
+        barrier.wait()
+        results.append(svc.borrow_book_by_patron(pid, book_id))
+
+    threads = [threading.Thread(target=worker, args=(p,)) for p in patrons]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(1 for ok, _ in results if ok) == 1
+    assert _book_row(db_path, book_id)["available_copies"] == 0
+    assert _active_loans(db_path, book_id) == 1
+
+
+def test_limit_rejection_writes_nothing(svc, add_and_get_book_id, db_path):
+    patron = "820000"
+    for i in range(5):
+        bid = add_and_get_book_id(f"L{i}", "A", f"82000000000{i:02d}", 1)
+        assert svc.borrow_book_by_patron(patron, bid)[0] is True
+
+    extra = add_and_get_book_id("Extra", "A", "8200000000099", 2)
+    ok, msg = svc.borrow_book_by_patron(patron, extra)
+    assert ok is False
+    assert "limit" in msg.lower()
+    assert _book_row(db_path, extra)["available_copies"] == 2
+    assert _active_loans(db_path, extra) == 0
+
+
+def test_return_closes_loan_and_restocks(svc, add_and_get_book_id, db_path):
+    book_id = add_and_get_book_id("Round Trip", "Author", "8300000000001", 2)
+    assert svc.borrow_book_by_patron("830000", book_id)[0] is True
+    assert _book_row(db_path, book_id)["available_copies"] == 1
+
+    ok, msg = svc.return_book_by_patron("830000", book_id)
+    assert ok is True
+    assert _book_row(db_path, book_id)["available_copies"] == 2
+    assert _active_loans(db_path, book_id) == 0
+
+    ok2, msg2 = svc.return_book_by_patron("830000", book_id)
+    assert ok2 is False
+    assert "no active borrow" in msg2.lower()
+    assert _book_row(db_path, book_id)["available_copies"] == 2
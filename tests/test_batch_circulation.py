@@ -0,0 +1,105 @@
+"""
+Batch checkout / check-in
+Expectations:
+- A stack of books is borrowed in one transaction with per-item results.
+- The 5-book limit is checked against the whole batch: an over-limit batch
+  borrows nothing.
+- Unknown and unavailable books fail individually without blocking the rest.
+- Batch returns restock each returned copy.
+- Book ids given as strings of digits work like ints; booleans, fractional
+  ids and ids outside 1..2**63-1 are rejected.
+- /api/borrow and /api/return expose the same behavior over JSON and answer
+  400 when the body is not a JSON object.
+"""
+import sqlite3
+
+
+def _active_loans(db_path, patron_id):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM borrows WHERE patron_id = ? AND return_date IS NULL", (patron_id,)
+        ).fetchone()[0]
+
+
+def _make_books(add_and_get_book_id, n, prefix="91"):
+    return [add_and_get_book_id(f"Batch {i}", "A", f"{prefix}{i:011d}", 1) for i in range(n)]
+
+
+def test_batch_borrow_mixed_results(svc, add_and_get_book_id, get_book_id, db_path):
+    ids = _make_books(add_and_get_book_id, 2)
+    unavailable = get_book_id("9780451524935")  # sample "1984" has no copies left
+    report = svc.borrow_books_by_patron("910000", ids + [unavailable, 999999])
+
+    assert report["status"] == "partial"
+    assert [r["success"] for r in report["results"]] == [True, True, False, False]
+    assert "not available" in report["results"][2]["message"]
+    assert report["results"][3]["message"] == "Book not found."
+    assert report["due_date"] is not None
+    assert _active_loans(db_path, "910000") == 2
+
+
+def test_batch_over_limit_borrows_nothing(svc, add_and_get_book_id, db_path):
+    ids = _make_books(add_and_get_book_id, 6, prefix="92")
+    assert svc.borrow_book_by_patron("920000", ids[0])[0]
+
+    report = svc.borrow_books_by_patron("920000", ids[1:])  # 1 active + 5 more > 5
+    assert report["status"] == "limit_reached"
+    assert not any(r["success"] for r in report["results"])
+    assert _active_loans(db_path, "920000") == 1
+
+    report = svc.borrow_books_by_patron("920000", ids[1:5])  # exactly 5
+    assert report["success"] is True
+    assert _active_loans(db_path, "920000") == 5
+
+
+def test_batch_return_restocks(svc, add_and_get_book_id, db_path):
+    ids = _make_books(add_and_get_book_id, 3, prefix="93")
+    assert svc.borrow_books_by_patron("930000", ids)["success"]
+
+    report = svc.return_books_by_patron("930000", ids + [ids[0]])
+    assert [r["success"] for r in report["results"]] == [True, True, True, False]
+    assert report["results"][3]["message"] == "No active borrow for this patron and book."
+    assert all(svc.get_book_by_id(b)["available_copies"] == 1 for b in ids)
+    assert _active_loans(db_path, "930000") == 0
+
+
+def test_batch_validation(svc):
+    assert svc.borrow_books_by_patron("12", [1])["status"] == "invalid"
+    assert svc.borrow_books_by_patron("123456", [])["status"] == "invalid"
+    assert svc.return_books_by_patron("123456", ["x"])["status"] == "invalid"
+    assert svc.borrow_books_by_patron("123456", list(range(svc.MAX_BATCH_BOOKS + 1)))["status"] == "invalid"
+    assert svc.borrow_books_by_patron("123456", [True])["status"] == "invalid"
+    assert svc.borrow_books_by_patron("123456", [1.5])["status"] == "invalid"
+    for out_of_range in (0, -1, 2 ** 63, str(2 ** 64)):
+        assert svc.borrow_books_by_patron("123456", [out_of_range])["status"] == "invalid"
+    assert svc.borrow_book_by_patron("123456", 2 ** 63) == (False, "Invalid book id.")
+
+
+def test_string_book_ids(svc, add_and_get_book_id, db_path):
+    single, *stack = _make_books(add_and_get_book_id, 3, prefix="95")
+    assert svc.borrow_book_by_patron("950000", str(single))[0] is True
+    assert svc.borrow_books_by_patron("950000", [str(b) for b in stack])["status"] == "ok"
+    assert _active_loans(db_path, "950000") == 3
+    assert svc.return_book_by_patron("950000", f" {single} ")[0] is True
+    assert svc.borrow_book_by_patron("950000", "abc") == (False, "Invalid book id.")
+
+
+def test_batch_api_endpoints(client, add_and_get_book_id):
+    ids = _make_books(add_and_get_book_id, 6, prefix="94")
+    r = client.post("/api/borrow", json={"patron_id": "940000", "book_ids": ids})
+    assert r.status_code == 409
+
+    r = client.post("/api/borrow", json={"patron_id": "940000", "book_ids": ids[:3]})
+    assert r.status_code == 200 and r.get_json()["success"] is True
+
+    r = client.post("/api/return", json={"patron_id": "940000", "book_ids": ids[:3]})
+    assert r.status_code == 200 and r.get_json()["message"] == "Returned 3 of 3 books."
+
+    assert client.post("/api/return", json={"patron_id": "bad"}).status_code == 400
+    for body in ([1, 2], "940000", 7):
+        r = client.post("/api/borrow", json=body)
+        assert r.status_code == 400 and r.get_json()["status"] == "invalid"
+
+    for path in ("/api/borrow", "/api/return"):
+        r = client.post(path, json={"patron_id": "940000", "book_ids": [2 ** 63]})
+        assert r.status_code == 400 and r.get_json()["message"] == "Invalid book id."
@@ -0,0 +1,67 @@
+"""
+Benchmark suite (smoke test at tiny sizes)
+Expectations:
+- The generator creates the requested numbers of books and borrows, with
+  active loans on distinct books, at most five per patron, and matching
+  available_copies.
+- The runner times every service call and writes comparable JSON.
+- Percentiles use the nearest rank, ceil(p/100 * n).
+"""
+import json
+
+import database
+from benchmarks import service_bench
+from benchmarks.datagen import generate_dataset
+
+
+def test_generator_builds_consistent_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "gen.db"))
+    database.init_database()
+
+    summary = generate_dataset(books=300, borrows=2000, patrons=40, active_loans=120, seed=1)
+
+    assert (summary["books"], summary["borrows"], summary["active_loans"]) == (300, 2000, 120)
+    with database.db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 300
+        assert conn.execute("SELECT COUNT(*) FROM borrows").fetchone()[0] == 2000
+        per_book = conn.execute(
+            "SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM borrows WHERE return_date IS NULL GROUP BY book_id)"
+        ).fetchone()[0]
+        per_patron = conn.execute(
+            "SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM borrows WHERE return_date IS NULL GROUP BY patron_id)"
+        ).fetchone()[0]
+        lent = conn.execute("SELECT SUM(total_copies - available_copies) FROM books").fetchone()[0]
+    assert per_book == 1
+    assert per_patron <= 5
+    assert lent == 120
+
+
+def test_runner_emits_results_for_every_benchmark(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE", database.DATABASE)
+    out = tmp_path / "results.json"
+
+    report = service_bench.main([
+        "--db", str(tmp_path / "bench.db"), "--books", "200", "--borrows", "1000",
+        "--iterations", "10", "--output", str(out),
+    ])
+
+    saved = json.loads(out.read_text())
+    assert saved["dataset"]["books"] == 200
+    assert set(saved["results"]) == {
+        "search_title", "search_author", "search_isbn", "search_fulltext",
+        "borrow_book", "return_book", "late_fee", "patron_status",
+    }
+    for stats in saved["results"].values():
+        assert stats["iterations"] > 0
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+    assert service_bench.compare(report["results"], saved["results"])
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 11))
+    assert service_bench.percentile(values, 50) == 5
+    assert service_bench.percentile(values, 25) == 3
+    assert service_bench.percentile(values, 100) == 10
+    assert service_bench.percentile(values, 0) == 1
+    assert service_bench.percentile(list(range(1, 21)), 95) == 19
+    assert service_bench.percentile([], 50) == 0.0
@@ -0,0 +1,87 @@
+"""
+Book lookup cache
+Expectations:
+- Repeated lookups by id or ISBN are served from the cache.
+- Write paths (insert, availability change, borrow, return) invalidate the
+  affected book so callers never see stale availability.
+- The cache is bounded, expires entries after its TTL and reports stats.
+- String and int ids share one entry, so invalidating either drops it.
+- A row read before an invalidation is not cached after it.
+"""
+import time
+
+import pytest
+
+import database
+from database import BookCache
+
+
+@pytest.fixture
+def cache(app_and_db):
+    database.BOOK_CACHE.clear()
+    return database.BOOK_CACHE
+
+
+def test_repeated_lookups_hit_cache(cache, get_book_id):
+    book_id = get_book_id("9780743273565")
+    database.get_book_by_id(book_id)
+    database.get_book_by_id(book_id)
+    database.get_book_by_isbn("9780743273565")
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+
+
+def test_cached_copy_cannot_be_mutated_by_caller(cache, get_book_id):
+    book_id = get_book_id("9780743273565")
+    database.get_book_by_id(book_id)["title"] = "Changed"
+    assert database.get_book_by_id(book_id)["title"] == "The Great Gatsby"
+
+
+def test_borrow_and_return_invalidate(cache, svc, add_and_get_book_id):
+    book_id = add_and_get_book_id("Cached", "Author", "5151515151515", 2)
+    assert database.get_book_by_id(book_id)["available_copies"] == 2
+
+    assert svc.borrow_book_by_patron("515151", book_id)[0]
+    assert database.get_book_by_id(book_id)["available_copies"] == 1
+
+    assert svc.return_book_by_patron("515151", book_id)[0]
+    assert database.get_book_by_id(book_id)["available_copies"] == 2
+
+    assert database.update_book_availability(book_id, -1)
+    assert database.get_book_by_isbn("5151515151515")["available_copies"] == 1
+
+
+def test_lru_bound_and_ttl():
+    cache = BookCache(maxsize=2, ttl=0.05)
+    for i in range(3):
+        cache.put({"id": i, "isbn": f"{i:013d}", "title": f"T{i}"})
+    assert cache.get_by_id(0) is None          # evicted as least recently used
+    assert cache.get_by_isbn(f"{0:013d}") is None
+    assert cache.get_by_id(2)["title"] == "T2"
+    assert cache.stats()["evictions"] == 1
+
+    time.sleep(0.06)
+    assert cache.get_by_id(2) is None          # expired
+    assert cache.stats()["size"] == 1
+
+
+def test_string_ids_share_entry(cache, get_book_id):
+    book_id = get_book_id("9780743273565")
+    database.get_book_by_id(str(book_id))
+    assert database.get_book_by_id(book_id)["id"] == book_id
+    assert cache.stats()["hits"] == 1
+
+    cache.invalidate(book_id=str(book_id))
+    assert cache.get_by_id(book_id) is None
+
+
+def test_put_racing_invalidate_is_dropped():
+    cache = BookCache()
+    token = cache.generation()
+    cache.invalidate(book_id=1)               # a write lands while the reader queries
+    cache.put({"id": 1, "isbn": "1" * 13, "available_copies": 3}, token)
+    assert cache.get_by_id(1) is None
+
+    cache.put({"id": 1, "isbn": "1" * 13, "available_copies": 2}, cache.generation())
+    assert cache.get_by_id(1)["available_copies"] == 2
@@ -0,0 +1,101 @@
+"""
+Conditional responses (ETag / If-None-Match)
+Expectations:
+- /catalog, /api/search and /api/late_fee send an ETag.
+- Repeating the request with If-None-Match returns 304 with no body.
+- Any write to books or borrows changes the ETag, and so does paying a fee.
+- The version is bumped once per write transaction, not once per row.
+- Pages with pending flash messages are always rendered.
+"""
+import sqlite3
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import database
+from services.payment_service import PaymentGateway
+
+
+def _revalidate(client, url, **kwargs):
+    first = client.get(url, **kwargs)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    headers = dict(kwargs.pop("headers", {}), **{"If-None-Match": etag})
+    return etag, client.get(url, headers=headers, **kwargs)
+
+
+def test_catalog_answers_304_until_catalog_changes(client, svc, add_and_get_book_id):
+    etag, second = _revalidate(client, "/catalog")
+    assert second.status_code == 304
+    assert second.data == b""
+
+    add_and_get_book_id("New Arrival", "Author", "3131313131313", 1)
+    third = client.get("/catalog", headers={"If-None-Match": etag})
+    assert third.status_code == 200
+    assert b"New Arrival" in third.data
+
+
+def test_search_and_late_fee_revalidate(client, get_book_id):
+    _, second = _revalidate(client, "/api/search?q=gatsby&type=title")
+    assert second.status_code == 304
+
+    book_id = get_book_id("9780451524935")
+    _, fee = _revalidate(client, f"/api/late_fee/123456/{book_id}")
+    assert fee.status_code == 304
+
+
+def test_paying_a_fee_changes_late_fee_etag(client, svc, db_path, add_and_get_book_id):
+    book_id = add_and_get_book_id("Overdue", "Author", "3333333333331", 1)
+    due = datetime.now() - timedelta(days=10)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO borrows (patron_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?)",
+                     ("343434", book_id, (due - timedelta(days=14)).isoformat(), due.isoformat()))
+    url = f"/api/late_fee/343434/{book_id}"
+    first = client.get(url)
+    assert first.get_json()["fee_amount"] == 6.5
+
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_etag_1", "Approved")
+    assert svc.pay_late_fees("343434", book_id, gateway)[0]
+
+    after = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.get_json()["fee_amount"] == 0.0
+
+
+def test_search_etag_differs_between_json_and_ndjson(client):
+    a = client.get("/api/search?q=gatsby&type=title")
+    b = client.get("/api/search?q=gatsby&type=title", headers={"Accept": "application/x-ndjson"})
+    assert a.headers["ETag"] != b.headers["ETag"]
+
+
+def test_every_write_bumps_catalog_version(svc, add_and_get_book_id):
+    v0 = database.get_catalog_version()
+    book_id = add_and_get_book_id("Versioned", "Author", "3232323232323", 1)
+    v1 = database.get_catalog_version()
+    assert svc.borrow_book_by_patron("323232", book_id)[0]
+    v2 = database.get_catalog_version()
+    assert svc.return_book_by_patron("323232", book_id)[0]
+    v3 = database.get_catalog_version()
+    assert v0 < v1 < v2 < v3
+
+
+def test_bulk_writes_bump_version_once(svc, db_path):
+    v0 = database.get_catalog_version()
+    assert database.insert_books_bulk([(f"Bulk {n}", "A", f"40000000000{n:02d}", 1) for n in range(50)]) == []
+    assert database.get_catalog_version() == v0 + 1
+    assert database.insert_books_bulk([("Bulk 0", "A", "4000000000000", 1)]) == ["4000000000000"]
+    assert database.get_catalog_version() == v0 + 1
+
+    with sqlite3.connect(db_path) as conn:
+        triggers = conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                                "AND name LIKE 'catalog_version%'").fetchall()
+    assert triggers == []
+
+
+def test_pending_flash_bypasses_304(client, get_book_id):
+    etag = client.get("/catalog").headers["ETag"]
+    # Borrowing an unavailable book writes nothing but flashes an error
+    client.post("/borrow", data={"patron_id": "123456", "book_id": str(get_book_id("9780451524935"))})
+    r = client.get("/catalog", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert b"not available" in r.data
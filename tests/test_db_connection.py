@@ -0,0 +1,145 @@
+"""
+Reader / writer database connections
+Expectations:
+- Read helpers called inside one app context share a single read-only
+  connection, which goes back to the pool on teardown and is reused.
+- Read connections refuse writes.
+- Writes from every request and thread go through one writer connection.
+- Catalog reads do not wait for an open write transaction under WAL.
+- Outside an app context helpers still work.
+- A reader checked out when the pool is closed (e.g. new pragmas) is closed
+  on release instead of going back to the pool.
+- The writer cannot be closed from inside one of its own blocks.
+- Schema setup and sample data are written through the writer.
+"""
+import sqlite3
+import threading
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Record every connection opened from here on, as (read_only, conn)."""
+    database.close_connections()
+    seen = []
+    real_connect = database.get_db_connection
+
+    def counting_connect(read_only=False):
+        conn = real_connect(read_only=read_only)
+        seen.append((read_only, conn))
+        return conn
+
+    monkeypatch.setattr(database, "get_db_connection", counting_connect)
+    return seen
+
+
+def test_helpers_share_one_reader_per_request(app_and_db, opened):
+    app, _ = app_and_db
+    with app.app_context():
+        book = database.get_book_by_isbn("9780743273565")
+        database.get_book_by_id(book["id"])
+        database.get_patron_borrow_count("123456")
+        database.get_all_books()
+        reader = database.get_request_connection()
+
+    assert [ro for ro, _ in opened] == [True]
+    assert database.READ_POOL.idle() == 1
+
+    # The next request borrows the same connection instead of opening one
+    with app.app_context():
+        database.get_all_books()
+        assert database.get_request_connection() is reader
+    assert len(opened) == 1
+
+
+def test_reader_refuses_writes(app_and_db):
+    app, _ = app_and_db
+    with app.app_context():
+        conn = database.get_request_connection()
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("UPDATE books SET available_copies = 0")
+
+
+def test_writes_share_one_writer(client, opened, get_book_id):
+    book_id = get_book_id("9780743273565")
+    r = client.post("/borrow", data={"patron_id": "222333", "book_id": str(book_id)})
+    assert r.status_code == 302
+
+    def return_book():
+        with database.db_connection() as conn:
+            conn.execute("UPDATE borrows SET return_date = '2030-01-01' WHERE patron_id = '222333'")
+            conn.commit()
+
+    worker = threading.Thread(target=return_book)
+    worker.start()
+    worker.join()
+
+    assert [ro for ro, _ in opened].count(False) == 1
+    assert database.get_borrow_history_for_patron("222333")[0]["return_date"].year == 2030
+
+
+def test_reads_do_not_wait_for_writes(app_and_db):
+    app, _ = app_and_db
+    started, finish = threading.Event(), threading.Event()
+
+    def slow_write():
+        with database.db_connection() as conn:
+            with database.immediate_transaction(conn):
+                conn.execute("UPDATE books SET title = 'Uncommitted' WHERE id = 1")
+                started.set()
+                finish.wait(5)
+
+    writer = threading.Thread(target=slow_write)
+    writer.start()
+    try:
+        assert started.wait(5)
+        with app.app_context():
+            titles = [b["title"] for b in database.get_all_books()]
+        assert "Uncommitted" not in titles and len(titles) == 3
+    finally:
+        finish.set()
+        writer.join()
+
+
+def test_helpers_work_outside_app_context(svc):
+    assert database.get_request_connection() is None
+    assert database.get_book_by_isbn("9780743273565")["title"] == "The Great Gatsby"
+
+
+def test_readers_checked_out_across_close_are_dropped(svc):
+    stale = database.READ_POOL.acquire()
+    database.configure_database("durable")
+    try:
+        database.READ_POOL.release(stale)
+        assert database.READ_POOL.idle() == 0
+        with pytest.raises(sqlite3.ProgrammingError):
+            stale.execute("SELECT 1")
+
+        fresh = database.READ_POOL.acquire()
+        assert fresh.execute("PRAGMA synchronous").fetchone()[0] == 2  # FULL
+        database.READ_POOL.release(fresh)
+        assert database.READ_POOL.idle() == 1
+    finally:
+        database.configure_database()
+
+
+def test_writer_refuses_to_close_while_in_use(svc):
+    with database.db_connection() as conn:
+        with pytest.raises(RuntimeError):
+            database.close_connections()
+        conn.execute("SELECT 1")
+    database.close_connections()
+
+
+def test_bootstrap_writes_through_writer(tmp_path, monkeypatch, opened):
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "boot.db"))
+    assert database.init_database() is True
+    database.add_sample_data()
+
+    assert [ro for ro, _ in opened] == [False]
+    with database.db_connection() as conn:
+        assert conn is opened[0][1]
+        assert conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 3
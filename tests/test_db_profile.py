@@ -0,0 +1,60 @@
+"""
+SQLite performance profiles
+Expectations:
+- Connections run in WAL mode with the selected preset's pragmas.
+- create_app() accepts a profile name and per-pragma overrides.
+- Unknown profiles or pragma values are rejected.
+"""
+import importlib
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def restore_pragmas(monkeypatch):
+    monkeypatch.setattr(database, "DB_PRAGMAS", dict(database.DB_PRAGMAS))
+
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def test_default_profile_uses_wal(app_and_db):
+    conn = database.get_db_connection()
+    try:
+        assert _pragma(conn, "journal_mode") == "wal"
+        assert _pragma(conn, "synchronous") == 1  # NORMAL
+        assert _pragma(conn, "busy_timeout") == 5000
+    finally:
+        conn.close()
+
+
+def test_create_app_selects_profile_and_overrides(tmp_path, monkeypatch, restore_pragmas):
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "profile.db"))
+    app_module = importlib.import_module("app")
+    app_module.create_app({"DB_PROFILE": "durable", "DB_PRAGMAS": {"cache_size": -4000}})
+
+    conn = database.get_db_connection()
+    try:
+        assert _pragma(conn, "synchronous") == 2  # FULL
+        assert _pragma(conn, "cache_size") == -4000
+        assert _pragma(conn, "journal_mode") == "wal"
+    finally:
+        conn.close()
+
+
+def test_profile_from_environment(monkeypatch, restore_pragmas):
+    monkeypatch.setenv("LIBRARY_DB_PROFILE", "fast")
+    pragmas = database.configure_database()
+    assert pragmas["synchronous"] == "OFF"
+
+
+def test_unknown_profile_or_value_rejected(restore_pragmas):
+    with pytest.raises(ValueError):
+        database.configure_database("reckless")
+    with pytest.raises(ValueError):
+        database.configure_database("balanced", journal_mode="WAL; DROP TABLE books")
+    with pytest.raises(ValueError):
+        database.configure_database("balanced", page_size=4096)
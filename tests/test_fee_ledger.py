@@ -0,0 +1,101 @@
+"""
+Library-wide fee ledger
+Expectations:
+- Every overdue active loan gets a ledger row whose fee matches R5 exactly.
+- On-time and returned loans are not charged.
+- Re-running the same day replaces rather than duplicates rows.
+- Completed fee payments are subtracted; fully paid loans get no row, and
+  pending reservations are still charged.
+- The API and CLI both run the job.
+"""
+import sqlite3
+from datetime import date, datetime, timedelta
+
+from services.fee_ledger import run_fee_ledger, get_fee_ledger
+
+
+def _make_loans(db_path, overdue_days):
+    """Insert one active loan per entry in overdue_days against sample book 1."""
+    today = datetime.now()
+    with sqlite3.connect(db_path) as conn:
+        for i, days in enumerate(overdue_days):
+            due = today - timedelta(days=days)
+            conn.execute(
+                "INSERT INTO borrows (patron_id, book_id, borrow_date, due_date) VALUES (?, 1, ?, ?)",
+                (f"9{i:05d}", (due - timedelta(days=14)).isoformat(), due.isoformat()),
+            )
+        conn.commit()
+
+
+def test_ledger_matches_per_loan_rules(svc, db_path):
+    days = list(range(0, 30)) + [100]
+    _make_loans(db_path, days)
+
+    summary = run_fee_ledger()
+    rows = {r["patron_id"]: r for r in get_fee_ledger()}
+
+    today = datetime.now()
+    expected_total = 0.0
+    for i, d in enumerate(days):
+        exp_days, exp_fee = svc.late_fee_for_due_date(today - timedelta(days=d), today)
+        row = rows.get(f"9{i:05d}")
+        if exp_days == 0:
+            assert row is None
+        else:
+            assert row["days_overdue"] == exp_days
+            assert row["fee_amount"] == exp_fee
+            expected_total += exp_fee
+
+    assert summary["loans_charged"] == sum(1 for d in days if d > 0)
+    assert summary["total_fees"] == round(expected_total, 2)
+
+
+def test_ledger_skips_returned_loans_and_is_idempotent(svc, db_path):
+    _make_loans(db_path, [10, 10])
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE borrows SET return_date = ? WHERE patron_id = '900001'", (datetime.now().isoformat(),))
+        conn.commit()
+
+    run_fee_ledger()
+    second = run_fee_ledger()
+    assert second["loans_charged"] == 1
+    assert [r["patron_id"] for r in get_fee_ledger()] == ["900000"]
+
+
+def test_ledger_subtracts_completed_payments(svc, db_path):
+    _make_loans(db_path, [10, 10, 10])
+    paid_at = datetime.now().isoformat()
+    with sqlite3.connect(db_path) as conn:
+        loans = dict(conn.execute("SELECT patron_id, id FROM borrows WHERE patron_id LIKE '9%'"))
+        conn.executemany(
+            "INSERT INTO fee_payments (transaction_id, patron_id, borrow_id, book_id, amount, paid_at, status) "
+            "VALUES (?, ?, ?, 1, ?, ?, ?)",
+            [("txn_full", "900000", loans["900000"], 6.5, paid_at, "completed"),
+             ("txn_part", "900001", loans["900001"], 2.0, paid_at, "completed"),
+             ("res_pending", "900002", loans["900002"], 6.5, paid_at, "pending")],
+        )
+        conn.commit()
+
+    summary = run_fee_ledger()
+    rows = {r["patron_id"]: r["fee_amount"] for r in get_fee_ledger()}
+    assert rows == {"900001": 4.5, "900002": 6.5}
+    assert summary["loans_charged"] == 2
+    assert summary["total_fees"] == 11.0
+
+
+def test_ledger_api_and_cli(app_and_db, client, db_path):
+    app, _ = app_and_db
+    _make_loans(db_path, [3])
+    as_of = date.today().isoformat()
+
+    r = client.post(f"/api/fees/ledger?as_of={as_of}")
+    assert r.status_code == 200 and r.get_json()["loans_charged"] == 1
+
+    r = client.get("/api/fees/ledger?patron_id=900000")
+    assert r.get_json()["results"][0]["fee_amount"] == 1.50
+
+    assert client.get("/api/fees/ledger?as_of=yesterday").status_code == 400
+
+    result = app.test_cli_runner().invoke(args=["fee-ledger", "--as-of", as_of])
+    assert result.exit_code == 0
+    assert "1 overdue loans" in result.output
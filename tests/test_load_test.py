@@ -0,0 +1,42 @@
+"""
+Load test harness (smoke test at a low rate)
+Expectations:
+- The app is served by a real local WSGI server and every route in the mix
+  gets traffic.
+- The report has p50/p95/p99, throughput and error rate per route and in total.
+- Borrowed books are returned through the shared loan pool.
+"""
+import json
+
+import database
+from benchmarks import load_test
+
+
+def test_load_test_reports_every_route(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE", database.DATABASE)
+    out = tmp_path / "load.json"
+
+    report = load_test.main([
+        "--db", str(tmp_path / "load.db"), "--books", "200", "--borrows", "2000",
+        "--rate", "80", "--duration", "1.5", "--concurrency", "8", "--output", str(out),
+    ])
+
+    saved = json.loads(out.read_text())
+    assert set(saved["routes"]) == set(load_test.DEFAULT_MIX)
+    assert saved["total"]["requests"] == 120
+    assert saved["total"]["errors"] == 0
+    for stats in saved["routes"].values():
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+        assert stats["throughput_rps"] > 0
+    assert report["meta"]["rate"] == 80
+
+
+def test_patron_status_api(client):
+    r = client.get("/api/patron/123456/status")
+    assert r.status_code == 200
+    assert r.get_json()["counts"]["currently_borrowed"] == 1
+    assert client.get("/api/patron/12/status").status_code == 400
+
+
+def test_mix_parsing():
+    assert load_test._parse_mix("search=3,borrow=1") == {"search": 3, "borrow": 1}
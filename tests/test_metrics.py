@@ -0,0 +1,76 @@
+"""
+Request metrics and /metrics
+Expectations:
+- Each request is counted under its blueprint endpoint with its status code,
+  unmatched URLs under 'unmatched'.
+- Latency histograms are cumulative and end in +Inf == _count.
+- In-flight counts rise during a request and return to zero afterwards.
+- /metrics answers in the Prometheus text format.
+"""
+import re
+
+from metrics import PROMETHEUS_CONTENT_TYPE, RequestMetrics
+
+
+def _samples(text):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_requests_are_counted_by_endpoint_and_status(client):
+    client.get("/catalog")
+    client.get("/catalog")
+    client.get("/api/late_fee/123456/3")
+    client.get("/no/such/page")
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.content_type == PROMETHEUS_CONTENT_TYPE
+    samples = _samples(r.get_data(as_text=True))
+
+    assert samples['library_http_responses_total{endpoint="catalog.catalog",status="200"}'] == 2
+    assert samples['library_http_responses_total{endpoint="api.get_late_fee",status="200"}'] == 1
+    assert samples['library_http_responses_total{endpoint="unmatched",status="404"}'] == 1
+    assert samples['library_http_request_duration_seconds_count{endpoint="catalog.catalog"}'] == 2
+    assert samples['library_http_request_duration_seconds_bucket{endpoint="catalog.catalog",le="+Inf"}'] == 2
+    assert samples['library_http_requests_in_flight{endpoint="catalog.catalog"}'] == 0
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = RequestMetrics(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.5, 3.0):
+        metrics.request_started("api.search_books_api")
+        metrics.request_finished("api.search_books_api", 200, seconds)
+
+    samples = _samples(metrics.render())
+    label = 'endpoint="api.search_books_api"'
+    assert samples[f'library_http_request_duration_seconds_bucket{{{label},le="0.1"}}'] == 1
+    assert samples[f'library_http_request_duration_seconds_bucket{{{label},le="1.0"}}'] == 3
+    assert samples[f'library_http_request_duration_seconds_bucket{{{label},le="+Inf"}}'] == 4
+    assert samples[f'library_http_request_duration_seconds_sum{{{label}}}'] == 4.05
+
+
+def test_in_flight_counts_the_running_request(app_and_db):
+    app, _ = app_and_db
+    seen = {}
+
+    @app.route("/_probe")
+    def probe():
+        seen["in_flight"] = app.extensions["metrics"].in_flight("probe")
+        return "ok"
+
+    client = app.test_client()
+    client.get("/_probe")
+    assert seen["in_flight"] == 1
+    assert app.extensions["metrics"].in_flight("probe") == 0
+
+
+def test_label_values_are_escaped():
+    metrics = RequestMetrics()
+    metrics.request_started('odd"name')
+    metrics.request_finished('odd"name', 200, 0.01)
+    assert re.search(r'endpoint="odd\\"name"', metrics.render())
@@ -0,0 +1,92 @@
+"""
+Schema migrations
+Expectations:
+- A fresh database is migrated to the latest schema version with indexes.
+- A pre-migration database (tables only, user_version 0) upgrades in place
+  and keeps its rows.
+- Re-running migrations is a no-op.
+- Rows that predate the full-text and trigram indexes are searchable.
+- Recorded payments are copied into payment_transactions in time order and
+  reconciliation checkpoints are moved onto its sequence.
+- Active-loan lookups use the new indexes instead of scanning borrows.
+"""
+import sqlite3
+
+import database
+
+
+def _index_names(conn):
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+    return {r[0] for r in rows}
+
+
+def test_fresh_database_reaches_latest_version(db_path):
+    with sqlite3.connect(db_path) as conn:
+        assert database.get_schema_version(conn) == database.SCHEMA_VERSION
+        names = _index_names(conn)
+    assert {"idx_borrows_active_patron_book", "idx_borrows_book_patron"} <= names
+
+
+def test_legacy_database_upgrades_in_place(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+            CREATE TABLE books (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, author TEXT NOT NULL,
+                isbn TEXT UNIQUE NOT NULL, total_copies INTEGER NOT NULL, available_copies INTEGER NOT NULL)
+        """)
+        conn.execute("""
+            CREATE TABLE borrows (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, patron_id TEXT NOT NULL, book_id INTEGER NOT NULL,
+                borrow_date TEXT NOT NULL, due_date TEXT NOT NULL, return_date TEXT,
+                FOREIGN KEY (book_id) REFERENCES books (id))
+        """)
+        conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                     "VALUES ('Old', 'Author', '1000000000001', 1, 1)")
+        conn.commit()
+
+    monkeypatch.setattr(database, "DATABASE", db_path)
+    database.init_database()
+    database.init_database()  # second run must be harmless
+
+    with sqlite3.connect(db_path) as conn:
+        assert database.get_schema_version(conn) == database.SCHEMA_VERSION
+        assert conn.execute("SELECT title FROM books").fetchone()[0] == "Old"
+        assert "idx_borrows_active_patron_book" in _index_names(conn)
+
+    # Rows that predate the full-text index are searchable after upgrading
+    assert [b["title"] for b in database.search_books_fulltext("old", limit=10)] == ["Old"]
+    assert [b["title"] for b in database.search_books("OLD", "title", limit=10)] == ["Old"]
+
+
+def test_payment_transactions_backfill(db_path):
+    with sqlite3.connect(db_path) as conn:
+        # Roll the file back to schema version 10 with a few recorded payments
+        conn.executescript("""
+            DROP TABLE payment_transactions;
+            ALTER TABLE reconciliation_checkpoints DROP COLUMN seq;
+            PRAGMA user_version = 10;
+        """)
+        conn.executemany(
+            "INSERT INTO fee_payments (transaction_id, patron_id, borrow_id, book_id, amount, paid_at, status) "
+            "VALUES (?, '123456', 1, 3, ?, ?, ?)",
+            [("txn_2", 1.0, "2025-01-02", "completed"), ("txn_1", 0.5, "2025-01-01", "completed"),
+             ("txn_1", 0.25, "2025-01-01", "completed"), ("res_x", 2.0, "2025-01-03", "pending")])
+        conn.execute("INSERT INTO reconciliation_checkpoints (name, recorded_at, transaction_id, updated_at) "
+                     "VALUES ('payments', '2025-01-01', 'txn_1', '2025-01-05')")
+        assert database.apply_migrations(conn) == database.SCHEMA_VERSION
+        rows = conn.execute("SELECT seq, transaction_id, amount FROM payment_transactions ORDER BY seq").fetchall()
+        checkpoint = conn.execute("SELECT seq FROM reconciliation_checkpoints").fetchone()[0]
+    assert [(txn, amount) for _, txn, amount in rows] == [("txn_1", 0.75), ("txn_2", 1.0)]
+    assert checkpoint == rows[0][0]
+
+
+def test_active_loan_queries_use_index(db_path):
+    with sqlite3.connect(db_path) as conn:
+        plan = conn.execute("""
+            EXPLAIN QUERY PLAN
+            SELECT COUNT(*) FROM borrows WHERE patron_id = ? AND return_date IS NULL
+        """, ("123456",)).fetchall()
+    detail = " ".join(str(row[-1]) for row in plan)
+    assert "USING" in detail and "INDEX" in detail
+    assert "SCAN borrows" not in detail
@@ -0,0 +1,178 @@
+"""
+Consolidated late fee payment
+Expectations:
+- All outstanding fees are charged in a single gateway call for the total.
+- The transaction is split per book and recorded, so a second run owes nothing.
+- Nothing is charged when no fee is due or the patron ID is invalid.
+- A declined charge records no allocation.
+- Concurrent calls for the same patron charge the fees once.
+- A per-book payment is recorded too: the fee is then reported as paid and
+  neither payment path charges it again.
+- When the charge's outcome is unknown, or it cannot be recorded, the fees
+  stay reserved and the payment outbox confirms the charge under the same key.
+- The API queues the payment (202) and the job reports the allocations.
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+from services.payment_outbox import drain_outbox, get_outbox_entry_by_key
+from services.payment_service import PaymentGateway
+
+
+def _overdue_loan(svc, db_path, patron_id, isbn, days_overdue):
+    svc.add_book_to_catalog(f"Overdue {isbn}", "Author", isbn, 1)
+    book_id = svc.get_book_by_isbn(isbn)["id"]
+    due = datetime.now() - timedelta(days=days_overdue)
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO borrows (patron_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?)",
+        (patron_id, book_id, (due - timedelta(days=14)).isoformat(), due.isoformat()),
+    )
+    conn.commit()
+    conn.close()
+    return book_id
+
+
+def _gateway(success=True):
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (
+        (True, "txn_all_1", "Approved") if success else (False, None, "Declined")
+    )
+    return gateway
+
+
+def test_single_charge_with_per_book_allocation(app_and_db, svc, db_path):
+    first = _overdue_loan(svc, db_path, "222222", "9990000000001", 3)    # 1.50
+    second = _overdue_loan(svc, db_path, "222222", "9990000000002", 10)  # 3.50 + 3.00
+    gateway = _gateway()
+
+    result = svc.pay_all_late_fees("222222", gateway)
+
+    assert result["success"] is True
+    assert result["transaction_id"] == "txn_all_1"
+    assert result["amount"] == 8.0
+    gateway.process_payment.assert_called_once()
+    assert gateway.process_payment.call_args.args[:2] == ("222222", 8.0)
+    split = {a["book_id"]: a["amount"] for a in result["allocations"]}
+    assert split == {first: 1.5, second: 6.5}
+
+    again = svc.pay_all_late_fees("222222", gateway)
+    assert again["success"] is False
+    assert gateway.process_payment.call_count == 1
+
+
+def test_nothing_due_or_invalid_patron(app_and_db, svc):
+    gateway = _gateway()
+    assert svc.pay_all_late_fees("654321", gateway)["success"] is False
+    assert svc.pay_all_late_fees("12ab", gateway)["success"] is False
+    gateway.process_payment.assert_not_called()
+
+
+def test_declined_charge_records_nothing(app_and_db, svc, db_path):
+    _overdue_loan(svc, db_path, "333333", "9990000000003", 2)
+    declined = svc.pay_all_late_fees("333333", _gateway(success=False))
+    assert declined["success"] is False
+    assert declined["allocations"] == []
+
+    retry = svc.pay_all_late_fees("333333", _gateway())
+    assert retry["success"] is True
+    assert retry["amount"] == 1.0
+
+
+def _fee_rows(db_path, patron_id):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT transaction_id, status, amount FROM fee_payments WHERE patron_id = ?",
+                            (patron_id,)).fetchall()
+
+
+def test_concurrent_calls_charge_once(app_and_db, svc, db_path):
+    _overdue_loan(svc, db_path, "555555", "9990000000005", 3)
+    gateway = Mock(spec=PaymentGateway)
+    counter = iter(range(1, 100))
+
+    def slow_charge(patron_id, amount, description, idempotency_key=None):
+        time.sleep(0.1)
+        return True, f"txn_{next(counter)}", "Approved"
+
+    gateway.process_payment.side_effect = slow_charge
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(svc.pay_all_late_fees("555555", gateway)))
+               for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert gateway.process_payment.call_count == 1
+    assert sorted(r["success"] for r in results) == [False, True]
+    assert _fee_rows(db_path, "555555") == [("txn_1", "completed", 1.5)]
+
+
+def test_per_book_payment_is_recorded(app_and_db, svc, db_path):
+    paid_book = _overdue_loan(svc, db_path, "888888", "9990000000008", 3)    # 1.50
+    _overdue_loan(svc, db_path, "888888", "9990000000009", 2)                # 1.00
+    gateway = _gateway()
+
+    assert svc.pay_late_fees("888888", paid_book, gateway)[:2] == (True, "txn_all_1")
+    fee = svc.calculate_late_fee_for_book("888888", paid_book)
+    assert fee["status"] == "paid" and fee["fee_amount"] == 0.0 and fee["amount_paid"] == 1.5
+
+    assert svc.pay_late_fees("888888", paid_book, gateway)[0] is False
+    assert svc.pay_all_late_fees("888888", gateway)["amount"] == 1.0
+    assert gateway.process_payment.call_count == 2
+
+
+def test_unknown_outcome_is_confirmed_by_outbox(app_and_db, svc, db_path):
+    _overdue_loan(svc, db_path, "666666", "9990000000006", 2)
+    broken = Mock(spec=PaymentGateway)
+    broken.process_payment.side_effect = ConnectionError("reset by peer")
+
+    result = svc.pay_all_late_fees("666666", broken)
+    assert result["success"] is False and "outbox" in result["message"]
+    (reference, status, _), = _fee_rows(db_path, "666666")
+    assert status == "pending"
+    assert svc.pay_all_late_fees("666666", _gateway())["success"] is False   # still reserved
+
+    gateway = _gateway()
+    assert drain_outbox(gateway)["completed"] == 1
+    assert gateway.process_payment.call_args.kwargs["idempotency_key"] == reference
+    assert broken.process_payment.call_args.kwargs["idempotency_key"] == reference
+    assert _fee_rows(db_path, "666666") == [("txn_all_1", "completed", 1.0)]
+
+
+def test_unrecorded_charge_is_not_reported_as_success(app_and_db, svc, db_path, mocker):
+    _overdue_loan(svc, db_path, "777777", "9990000000007", 2)
+    mocker.patch("services.library_service.complete_fee_payments", return_value=False)
+
+    result = svc.pay_all_late_fees("777777", _gateway())
+    assert result["success"] is False
+    assert result["transaction_id"] == "txn_all_1"
+    (reference, status, _), = _fee_rows(db_path, "777777")
+    assert status == "pending"
+    assert get_outbox_entry_by_key(reference)["status"] == "pending"
+
+    drain_outbox(_gateway())
+    assert _fee_rows(db_path, "777777") == [("txn_all_1", "completed", 1.0)]
+
+
+def test_api_queues_consolidated_payment(app_and_db, client, svc, db_path):
+    app, _ = app_and_db
+    _overdue_loan(svc, db_path, "444444", "9990000000004", 4)
+    executor = app.extensions["payment_executor"]
+    executor.gateway = _gateway()
+
+    resp = client.post("/api/patron/444444/late_fees/pay")
+    assert resp.status_code == 202
+    payment_id = resp.get_json()["payment_id"]
+
+    for _ in range(100):
+        status = client.get(f"/api/payments/{payment_id}").get_json()
+        if status["status"] != "pending":
+            break
+        time.sleep(0.02)
+    assert status["status"] == "completed"
+    assert status["amount"] == 2.0
+    assert len(status["allocations"]) == 1
@@ -0,0 +1,132 @@
+"""
+Concurrent payment executor
+Expectations:
+- Many payments run in parallel on the bounded pool.
+- Results keep input order; per-call timeouts and gateway exceptions become
+  failed results instead of raising.
+- A batch waits at most its timeout in total, not the timeout per call.
+- Callbacks fire when a job finishes and job_status() reports it.
+- A job's gateway call carries the job id as idempotency key.
+- The app waits at least a live gateway's retry budget for a call.
+- The API queues a payment (202) and exposes its status for polling.
+"""
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from services.payment_executor import PaymentExecutor
+from services.payment_service import PaymentGateway
+
+
+@pytest.fixture
+def late_fee_stubs(mocker):
+    mocker.patch("services.library_service.get_book_by_id", return_value={"id": 1, "title": "Late Book"})
+    mocker.patch(
+        "services.library_service.calculate_late_fee_for_book",
+        return_value={"fee_amount": 5.0, "days_overdue": 3, "status": "late"},
+    )
+    mocker.patch("services.library_service.reserve_fee_payments", return_value=True)
+    mocker.patch("services.library_service.complete_fee_payments", return_value=True)
+
+
+def _slow_gateway(delay):
+    gateway = Mock(spec=PaymentGateway)
+
+    def process(patron_id, amount, description, idempotency_key=None):
+        time.sleep(delay)
+        return True, f"txn_{patron_id}", "Approved"
+
+    gateway.process_payment.side_effect = process
+    return gateway
+
+
+def test_payments_run_concurrently(late_fee_stubs):
+    executor = PaymentExecutor(_slow_gateway(0.2), max_workers=10)
+    started = time.perf_counter()
+    results = executor.pay_late_fees_many([(f"{i:06d}", 1) for i in range(10)])
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+
+    assert [r[1] for r in results] == [f"txn_{i:06d}" for i in range(10)]
+    assert all(r[0] for r in results)
+    assert elapsed < 1.0  # serially this would take ~2s
+
+
+def test_timeouts_and_exceptions_become_failures(late_fee_stubs):
+    gateway = _slow_gateway(0.3)
+    executor = PaymentExecutor(gateway, max_workers=1, timeout=0.1)
+    results = executor.pay_late_fees_many([("111111", 1), ("222222", 1)])
+    executor.shutdown()
+    assert results[0][0] is False and "timed out" in results[0][2]
+    assert results[1][0] is False and "not started" in results[1][2]
+
+    broken = Mock(spec=PaymentGateway)
+    broken.process_payment.side_effect = ConnectionError("gateway down")
+    executor = PaymentExecutor(broken, max_workers=2)
+    (result,) = executor.pay_late_fees_many([("333333", 1)])
+    executor.shutdown()
+    assert result[0] is False and "gateway down" in result[2]
+
+
+def test_batch_timeout_is_one_deadline(late_fee_stubs):
+    executor = PaymentExecutor(_slow_gateway(0.5), max_workers=4, timeout=0.2)
+    started = time.perf_counter()
+    results = executor.pay_late_fees_many([(f"{i:06d}", 1) for i in range(4)])
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+    assert all("timed out" in r[2] for r in results)
+    assert elapsed < 0.4  # waiting 0.2s per call would take 0.8s
+
+
+def test_callback_and_job_status(late_fee_stubs):
+    executor = PaymentExecutor(_slow_gateway(0.05), max_workers=2)
+    done = threading.Event()
+    job_id, future = executor.submit_late_fee_payment("444444", 1, callback=lambda f: done.set())
+    assert executor.job_status(job_id)["status"] in {"pending", "completed"}
+
+    assert done.wait(2)
+    status = executor.job_status(job_id)
+    executor.shutdown()
+    assert status["status"] == "completed"
+    assert status["transaction_id"] == "txn_444444"
+    assert executor.job_status("pay_unknown") is None
+
+
+def test_job_id_is_the_idempotency_key(late_fee_stubs):
+    gateway = _slow_gateway(0)
+    executor = PaymentExecutor(gateway, max_workers=1)
+    job_id, future = executor.submit_late_fee_payment("444444", 1)
+    future.result(timeout=2)
+    executor.shutdown()
+    assert gateway.process_payment.call_args.kwargs["idempotency_key"] == job_id
+
+
+def test_timeout_covers_live_retry_budget(app_and_db):
+    from app import create_app
+
+    app = create_app({"PAYMENT_GATEWAY_URL": "http://127.0.0.1:9", "PAYMENT_TIMEOUT": 1.0})
+    executor = app.extensions["payment_executor"]
+    try:
+        assert executor.timeout == executor.gateway.retry_budget > 1.0
+    finally:
+        executor.shutdown()
+    assert app_and_db[0].extensions["payment_executor"].timeout == 10.0
+
+
+def test_pay_api_queues_and_reports(app_and_db, client, late_fee_stubs):
+    app, _ = app_and_db
+    app.extensions["payment_executor"].gateway = _slow_gateway(0.01)
+
+    r = client.post("/api/late_fee/555555/1/pay")
+    assert r.status_code == 202
+    payment_id = r.get_json()["payment_id"]
+
+    for _ in range(100):
+        status = client.get(f"/api/payments/{payment_id}").get_json()
+        if status["status"] != "pending":
+            break
+        time.sleep(0.01)
+    assert status["status"] == "completed"
+    assert client.get("/api/payments/pay_missing").status_code == 404
@@ -0,0 +1,179 @@
+"""
+PaymentGateway over HTTP
+Runs the live gateway client against a local stand-in server that can inject
+latency and errors.
+Expectations:
+- Calls reuse pooled keep-alive connections instead of reconnecting.
+- 5xx responses are retried with the same Idempotency-Key until one succeeds.
+- Declines (4xx) come back as results and are not retried.
+- Slow responses beyond the timeout raise.
+- Retry-After headers are ignored and backoff is capped, so a call never
+  outlasts retry_budget.
+- Repeated failures open the circuit breaker, which then fails fast without
+  calling the server and closes again after a successful trial call.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from services.payment_service import CircuitBreaker, CircuitOpenError, PaymentGateway
+
+
+class _StandIn:
+    """Scripted gateway: `faults` is a list of HTTP statuses to return before succeeding."""
+
+    def __init__(self):
+        self.faults = []
+        self.delay = 0.0
+        self.retry_after = None
+        self.requests = []
+        self.connections = set()
+
+
+def _handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body, headers=()):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _record(self, body=None):
+            state.connections.add(self.client_address)
+            state.requests.append((self.command, self.path, self.headers.get("Idempotency-Key"), body))
+            if state.delay:
+                time.sleep(state.delay)
+            if state.faults:
+                status = state.faults.pop(0)
+                headers = [("Retry-After", str(state.retry_after))] if state.retry_after else []
+                self._reply(status, {"message": f"injected {status}"}, headers)
+                return False
+            return True
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not self._record(body):
+                return
+            if self.path == "/charges":
+                if body["amount"] > 1000:
+                    self._reply(402, {"success": False, "message": "Payment declined: amount exceeds limit"})
+                else:
+                    self._reply(200, {"success": True, "transaction_id": f"txn_{body['customer_id']}_1",
+                                      "message": "Approved"})
+            else:
+                self._reply(200, {"success": True, "message": "Refunded"})
+
+        def do_GET(self):
+            if self._record():
+                self._reply(200, {"transaction_id": self.path.rsplit("/", 1)[1], "status": "completed"})
+
+    return Handler
+
+
+@pytest.fixture
+def stand_in():
+    state = _StandIn()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def _gateway(stand_in, **kwargs):
+    kwargs.setdefault("backoff_factor", 0.01)
+    kwargs.setdefault("timeout", 2.0)
+    return PaymentGateway(base_url=stand_in.url, **kwargs)
+
+
+def test_calls_share_keep_alive_connections(stand_in):
+    gateway = _gateway(stand_in)
+    for _ in range(5):
+        assert gateway.process_payment("123456", 5.0, "Late fee")[0] is True
+    assert gateway.verify_payment_status("txn_123456_1")["status"] == "completed"
+    assert len(stand_in.requests) == 6
+    assert len(stand_in.connections) == 1
+
+
+def test_server_errors_are_retried_with_same_key(stand_in):
+    stand_in.faults = [503, 500]
+    gateway = _gateway(stand_in, max_retries=2)
+
+    success, transaction_id, _ = gateway.process_payment("123456", 5.0, "Late fee", idempotency_key="abc")
+
+    assert success is True
+    assert transaction_id == "txn_123456_1"
+    assert [r[2] for r in stand_in.requests] == ["abc", "abc", "abc"]
+
+
+def test_declines_are_results_not_retries(stand_in):
+    gateway = _gateway(stand_in)
+    success, transaction_id, message = gateway.process_payment("123456", 5000.0, "Too much")
+    assert (success, transaction_id) == (False, "")
+    assert "declined" in message
+    assert len(stand_in.requests) == 1
+    assert gateway.breaker.state == "closed"
+
+
+def test_exhausted_retries_and_timeouts_raise(stand_in):
+    stand_in.faults = [502, 502, 502]
+    with pytest.raises(requests.RequestException):
+        _gateway(stand_in, max_retries=2).refund_payment("txn_123456_1", 5.0)
+
+    stand_in.delay = 0.5
+    with pytest.raises(requests.RequestException):
+        _gateway(stand_in, max_retries=0, timeout=0.1).process_payment("123456", 5.0)
+
+
+def test_retries_stay_within_budget(stand_in):
+    stand_in.faults, stand_in.retry_after = [503, 503], 30
+    gateway = _gateway(stand_in, max_retries=2, backoff_factor=0.1, backoff_max=0.15)
+
+    started = time.monotonic()
+    assert gateway.process_payment("123456", 5.0, "Late fee", idempotency_key="abc")[0] is True
+    assert time.monotonic() - started < 1.0
+    assert gateway.retry_budget == pytest.approx(3 * 2 * 2.0 + 0.1 + 0.15)
+
+
+def test_circuit_breaker_fails_fast_then_recovers(stand_in):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    gateway = _gateway(stand_in, max_retries=0, breaker=breaker)
+    stand_in.faults = [500, 500]
+
+    for _ in range(2):
+        with pytest.raises(requests.RequestException):
+            gateway.process_payment("123456", 5.0)
+    assert breaker.state == "open"
+
+    calls = len(stand_in.requests)
+    started = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        gateway.process_payment("123456", 5.0)
+    assert time.monotonic() - started < 0.05
+    assert len(stand_in.requests) == calls
+
+    time.sleep(0.25)
+    assert breaker.state == "half_open"
+    assert gateway.process_payment("123456", 5.0)[0] is True
+    assert breaker.state == "closed"
+
+
+def test_simulated_gateway_is_the_default():
+    gateway = PaymentGateway()
+    assert gateway.live is False
+    assert gateway.base_url == "https://api.payment-gateway.example.com"
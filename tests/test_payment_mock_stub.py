@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import Mock
+from unittest.mock import ANY, Mock
 
 from services.library_service import (
     pay_late_fees,
@@ -12,6 +12,15 @@ from services.payment_service import PaymentGateway
 # pay_late_fees tests
 # ---------------------------------------------------------------------------
 
+@pytest.fixture(autouse=True)
+def fee_ledger_stubs(mocker):
+    """pay_late_fees reserves and records the fee in fee_payments; keep these unit tests off the database."""
+    mocker.patch("services.library_service.reserve_fee_payments", return_value=True)
+    mocker.patch("services.library_service.complete_fee_payments", return_value=True)
+    mocker.patch("services.library_service.release_fee_payments")
+    mocker.patch("services.library_service.enqueue_payment", return_value="out_stub")
+
+
 def test_pay_late_fees_successful_payment(mocker):
     """Should call payment gateway and succeed when valid late fee exists."""
     # Stubs
@@ -38,6 +47,7 @@ def test_pay_late_fees_successful_payment(mocker):
         "123456",
         5.0,
         "Late fee for book 1",
+        idempotency_key=ANY,
     )
 
 
@@ -0,0 +1,240 @@
+"""
+Payment outbox
+Expectations:
+- Deferred payments and refunds are queued without calling the gateway.
+- A repeated idempotency key returns the entry queued the first time; one
+  reused for a different patron, book, refund or amount is rejected (409
+  from the API), and the API scopes client keys to the patron and book or
+  the refunded transaction.
+- The drain sends every attempt with the entry's idempotency key; exceptions
+  are retried with exponential backoff, declines fail at once, and entries
+  give up after MAX_OUTBOX_ATTEMPTS, releasing their fee reservation.
+- An entry abandoned mid-call is picked up again once its lease expires;
+  with a live gateway the lease covers a whole batch of retried calls.
+- The simulated gateway replays keyed requests instead of charging twice,
+  also when they arrive concurrently, and remembers a bounded number of keys.
+- The API queues keyed payments and refunds and reports their status.
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+
+from services import payment_outbox
+from services.payment_outbox import (
+    claim_due_entries, drain_outbox, get_outbox_entry, outbox_lease_seconds, IdempotencyKeyConflict
+)
+from services.payment_service import PaymentGateway
+
+
+@pytest.fixture
+def late_fee_stubs(mocker):
+    mocker.patch("services.library_service.get_book_by_id", return_value={"id": 1, "title": "Late Book"})
+    mocker.patch(
+        "services.library_service.calculate_late_fee_for_book",
+        return_value={"fee_amount": 5.0, "days_overdue": 3, "status": "late"},
+    )
+    mocker.patch("services.library_service.reserve_fee_payments", return_value=True)
+
+
+def _gateway():
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_123456_1", "Approved")
+    gateway.refund_payment.return_value = (True, "Refunded")
+    return gateway
+
+
+def test_deferred_payment_is_queued_not_charged(app_and_db, svc, late_fee_stubs):
+    gateway = _gateway()
+    success, outbox_id, message = svc.pay_late_fees("123456", 1, gateway, defer=True, idempotency_key="k1")
+
+    assert success is True
+    assert outbox_id.startswith("out_")
+    gateway.process_payment.assert_not_called()
+    entry = get_outbox_entry(outbox_id)
+    assert entry["status"] == "pending"
+    assert entry["amount"] == 5.0
+
+    again = svc.pay_late_fees("123456", 1, gateway, defer=True, idempotency_key="k1")
+    assert again[1] == outbox_id
+
+
+def test_reused_key_for_another_request_is_rejected(app_and_db, svc, late_fee_stubs):
+    _, outbox_id, _ = svc.pay_late_fees("123456", 1, None, defer=True, idempotency_key="shared")
+    with pytest.raises(IdempotencyKeyConflict):
+        svc.pay_late_fees("654321", 1, None, defer=True, idempotency_key="shared")
+    with pytest.raises(IdempotencyKeyConflict):
+        svc.refund_late_fee_payment("txn_123456_1", 2.0, None, defer=True, idempotency_key="shared")
+
+    _, refund_id = svc.refund_late_fee_payment("txn_123456_1", 2.0, None, defer=True, idempotency_key="r1")
+    assert svc.refund_late_fee_payment("txn_123456_1", 2.0, None, defer=True, idempotency_key="r1")[1] == refund_id
+    with pytest.raises(IdempotencyKeyConflict):
+        svc.refund_late_fee_payment("txn_123456_2", 2.0, None, defer=True, idempotency_key="r1")
+    with pytest.raises(IdempotencyKeyConflict):
+        svc.refund_late_fee_payment("txn_123456_1", 3.0, None, defer=True, idempotency_key="r1")
+    assert get_outbox_entry(outbox_id)["patron_id"] == "123456"
+
+
+def test_drain_completes_with_idempotency_key(app_and_db, svc, late_fee_stubs):
+    _, outbox_id, _ = svc.pay_late_fees("123456", 1, None, defer=True)
+    _, refund_id = svc.refund_late_fee_payment("txn_123456_0", 2.5, None, defer=True)
+    gateway = _gateway()
+
+    counts = drain_outbox(gateway)
+
+    assert counts == {"claimed": 2, "completed": 2, "pending": 0, "failed": 0}
+    entry = get_outbox_entry(outbox_id)
+    assert entry["status"] == "completed"
+    assert entry["transaction_id"] == "txn_123456_1"
+    assert gateway.process_payment.call_args.kwargs["idempotency_key"] == entry["idempotency_key"]
+    gateway.refund_payment.assert_called_once_with("txn_123456_0", 2.5,
+                                                   idempotency_key=get_outbox_entry(refund_id)["idempotency_key"])
+    assert drain_outbox(gateway)["claimed"] == 0
+
+
+def test_exceptions_retry_with_backoff_then_give_up(app_and_db, svc, late_fee_stubs):
+    _, outbox_id, _ = svc.pay_late_fees("123456", 1, None, defer=True)
+    gateway = _gateway()
+    gateway.process_payment.side_effect = ConnectionError("gateway unreachable")
+
+    now = datetime.now()
+    assert drain_outbox(gateway, now=now)["pending"] == 1
+    assert drain_outbox(gateway, now=now)["claimed"] == 0          # still backing off
+
+    for attempt in range(2, payment_outbox.MAX_OUTBOX_ATTEMPTS + 1):
+        now += timedelta(seconds=payment_outbox.backoff_delay(attempt - 1))
+        drain_outbox(gateway, now=now)
+
+    entry = get_outbox_entry(outbox_id)
+    assert entry["status"] == "failed"
+    assert entry["attempts"] == payment_outbox.MAX_OUTBOX_ATTEMPTS
+    keys = {c.kwargs["idempotency_key"] for c in gateway.process_payment.call_args_list}
+    assert keys == {entry["idempotency_key"]}
+    assert payment_outbox.backoff_delay(2) == 2 * payment_outbox.backoff_delay(1)
+
+
+def test_giving_up_releases_the_reservation(app_and_db, svc, db_path):
+    svc.add_book_to_catalog("Given Up", "Author", "9990000000101", 1)
+    book_id = svc.get_book_by_isbn("9990000000101")["id"]
+    due = datetime.now() - timedelta(days=10)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO borrows (patron_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?)",
+                     ("515151", book_id, (due - timedelta(days=14)).isoformat(), due.isoformat()))
+    _, outbox_id, _ = svc.pay_late_fees("515151", book_id, None, defer=True)
+    assert svc.calculate_late_fee_for_book("515151", book_id)["fee_amount"] == 0.0
+    gateway = _gateway()
+    gateway.process_payment.side_effect = ConnectionError("gateway unreachable")
+
+    now = datetime.now()
+    for attempt in range(1, payment_outbox.MAX_OUTBOX_ATTEMPTS + 1):
+        drain_outbox(gateway, now=now)
+        now += timedelta(seconds=payment_outbox.backoff_delay(attempt))
+
+    assert get_outbox_entry(outbox_id)["status"] == "failed"
+    assert svc.calculate_late_fee_for_book("515151", book_id)["fee_amount"] == 6.5
+    assert payment_outbox.recover_fee_reservations(now + timedelta(hours=1)) == 0
+    assert get_outbox_entry(outbox_id)["status"] == "failed"
+
+
+def test_decline_fails_without_retry(app_and_db, svc, late_fee_stubs):
+    _, outbox_id, _ = svc.pay_late_fees("123456", 1, None, defer=True)
+    gateway = _gateway()
+    gateway.process_payment.return_value = (False, "", "Payment declined")
+
+    assert drain_outbox(gateway)["failed"] == 1
+    assert get_outbox_entry(outbox_id)["status"] == "failed"
+    assert drain_outbox(gateway, now=datetime.now() + timedelta(hours=1))["claimed"] == 0
+
+
+def test_abandoned_entry_is_reclaimed_after_lease(app_and_db, svc, late_fee_stubs):
+    _, outbox_id, _ = svc.pay_late_fees("123456", 1, None, defer=True)
+    assert len(claim_due_entries()) == 1               # worker "crashes" here
+    assert claim_due_entries() == []
+
+    later = datetime.now() + timedelta(seconds=payment_outbox.OUTBOX_LEASE_SECONDS + 1)
+    assert drain_outbox(_gateway(), now=later)["completed"] == 1
+    assert get_outbox_entry(outbox_id)["attempts"] == 2
+
+
+def test_lease_covers_a_batch_of_live_calls(app_and_db, svc, late_fee_stubs):
+    live = PaymentGateway(base_url="http://127.0.0.1:9", timeout=5.0, max_retries=2)
+    assert outbox_lease_seconds(PaymentGateway()) == payment_outbox.OUTBOX_LEASE_SECONDS
+    assert outbox_lease_seconds(live, batch_size=10) == 10 * live.retry_budget
+
+    svc.pay_late_fees("123456", 1, None, defer=True)
+    now = datetime.now()
+    assert len(claim_due_entries(now=now, lease_seconds=outbox_lease_seconds(live))) == 1
+    assert claim_due_entries(now=now + timedelta(seconds=payment_outbox.OUTBOX_LEASE_SECONDS + 1)) == []
+
+
+def test_simulated_gateway_replays_keyed_requests(mocker):
+    mocker.patch("services.payment_service.time.sleep")
+    gateway = PaymentGateway()
+    first = gateway.process_payment("123456", 5.0, "Late fee", idempotency_key="abc")
+    mocker.patch("services.payment_service.time.time", return_value=time.time() + 10)
+    assert gateway.process_payment("123456", 5.0, "Late fee", idempotency_key="abc") == first
+    assert gateway.process_payment("123456", 5.0, "Late fee")[1] != first[1]
+
+
+def test_simulated_replay_is_locked_per_key_and_bounded(mocker):
+    mocker.patch("services.payment_service.MAX_REPLAYED_KEYS", 2)
+    gateway = PaymentGateway()
+    calls = []
+
+    def charge(patron_id, amount, description):
+        calls.append(patron_id)
+        time.sleep(0.05)
+        return True, f"txn_{len(calls)}", "Approved"
+
+    mocker.patch.object(gateway, "_charge", side_effect=charge)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        gateway.process_payment("123456", 5.0, idempotency_key="same"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and {r[1] for r in results} == {"txn_1"}
+
+    for key in ("k2", "k3"):
+        gateway.process_payment("123456", 5.0, idempotency_key=key)
+    assert list(gateway._idempotent_results) == ["k2", "k3"]
+    assert gateway._key_locks == {}
+
+
+def test_api_queues_keyed_payment_and_refund(client, late_fee_stubs):
+    headers = {"Idempotency-Key": "req-1"}
+    r = client.post("/api/late_fee/123456/1/pay", headers=headers)
+    assert r.status_code == 202
+    payment_id = r.get_json()["payment_id"]
+    assert client.post("/api/late_fee/123456/1/pay", headers=headers).get_json()["payment_id"] == payment_id
+
+    status = client.get(f"/api/payments/{payment_id}").get_json()
+    assert status["status"] == "pending"
+    assert status["kind"] == "payment"
+
+    r = client.post("/api/payments/txn_123456_1/refund", json={"amount": 3.0})
+    assert r.status_code == 202
+    assert client.post("/api/payments/txn_123456_1/refund", json={"amount": 99}).status_code == 400
+    assert client.get("/api/payments/out_missing").status_code == 404
+
+
+def test_api_scopes_idempotency_keys(client, late_fee_stubs):
+    headers = {"Idempotency-Key": "abc"}
+    first = client.post("/api/late_fee/123456/1/pay", headers=headers).get_json()["payment_id"]
+    other = client.post("/api/late_fee/654321/1/pay", headers=headers)
+    assert other.status_code == 202
+    assert other.get_json()["payment_id"] != first
+    assert client.get(f"/api/payments/{other.get_json()['payment_id']}").get_json()["patron_id"] == "654321"
+
+    refund_1 = client.post("/api/payments/txn_1/refund", json={"amount": 2.0}, headers=headers)
+    refund_2 = client.post("/api/payments/txn_2/refund", json={"amount": 2.0}, headers=headers)
+    assert refund_1.status_code == refund_2.status_code == 202
+    assert refund_1.get_json()["payment_id"] != refund_2.get_json()["payment_id"]
+    assert client.get(f"/api/payments/{refund_2.get_json()['payment_id']}").get_json()["transaction_id"] == "txn_2"
+
+    changed = client.post("/api/payments/txn_1/refund", json={"amount": 3.0}, headers=headers)
+    assert changed.status_code == 409
@@ -3,7 +3,11 @@ R2 — Catalog display
 Expectations:
 - Page renders and shows table headers.
 - Availability text shows "X/Y Available" when available_copies > 0.
+- Malformed cursors, including ones with ids SQLite cannot bind, show the
+  first page.
 """
+import base64
+
 def test_catalog_page_renders(client):
     r = client.get("/catalog")
     assert r.status_code == 200
@@ -19,3 +23,39 @@ def test_catalog_shows_availability_text(svc, client, add_and_get_book_id):
     r = client.get("/catalog")
     assert r.status_code == 200
     assert b"1/2 Available" in r.data
+
+def test_catalog_keyset_pages_walk_forward_and_back(svc, add_and_get_book_id):
+    # Sample data contributes 3 books; add 4 more with the same title to exercise the id tiebreak
+    for i in range(4):
+        add_and_get_book_id("Same Title", "A", f"424242424242{i}", 1)
+
+    seen = []
+    page = svc.get_catalog_page(page_size=3)
+    assert page["prev_cursor"] is None
+    pages = [page]
+    while page["next_cursor"]:
+        page = svc.get_catalog_page(page_size=3, after=page["next_cursor"])
+        pages.append(page)
+    for p in pages:
+        seen.extend((b["title"], b["id"]) for b in p["books"])
+
+    assert len(seen) == 7
+    assert seen == sorted(seen)
+    assert [len(p["books"]) for p in pages] == [3, 3, 1]
+
+    # Walking back from the last page returns the middle page unchanged
+    back = svc.get_catalog_page(page_size=3, before=pages[-1]["prev_cursor"])
+    assert back["books"] == pages[1]["books"]
+    assert back["next_cursor"] is not None and back["prev_cursor"] is not None
+
+def test_catalog_page_size_and_bad_cursor(client):
+    r = client.get("/catalog?page_size=2&after=not-a-cursor")
+    assert r.status_code == 200
+    assert b"Next" in r.data
+
+    for raw in ('["A", 9223372036854775808]', '["A", 1e300]', '["A", Infinity]', '["A", -1]'):
+        cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+        for direction in ("after", "before"):
+            r = client.get(f"/catalog?page_size=2&{direction}={cursor}")
+            assert r.status_code == 200
+            assert b"Next" in r.data
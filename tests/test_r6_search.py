@@ -1,11 +1,15 @@
 """
 R6 — Search
 Spec:
-- title/author: partial, case-insensitive
+- title/author: partial, case-insensitive, including non-ASCII letters,
+  answered from the trigram index for terms of three or more characters
 - isbn: exact match
+- offsets beyond SQLite's integer range are clamped, not a server error
 """
 import pytest
 
+import database
+
 def test_search_empty_term_returns_empty(svc):
     assert svc.search_books_in_catalog("", "title") == []
     assert svc.search_books_in_catalog("   ", "author") == []
@@ -39,3 +43,65 @@ def test_search_isbn_exact_match_only(svc, add_and_get_book_id):
     # Should not match partials or wrong ISBN
     assert svc.search_books_in_catalog("666666666666", "isbn") == []
     assert svc.search_books_in_catalog("06666666666666", "isbn") == []
+
+def test_search_escapes_like_wildcards(svc, add_and_get_book_id):
+    add_and_get_book_id("100% Pure", "Someone", "7777777777771", 1)
+    add_and_get_book_id("1000 Pages", "Someone", "7777777777772", 1)
+    res = svc.search_books_in_catalog("100%", "title")
+    assert [r["isbn"] for r in res] == ["7777777777771"]
+
+def test_search_folds_non_ascii_case(svc, add_and_get_book_id):
+    add_and_get_book_id("Élan Vital", "Åsa Øberg", "7777777777771", 1)
+    add_and_get_book_id("Straße der Sterne", "Jürgen Groß", "7777777777772", 1)
+    for term in ("élan", "ÉLAN"):
+        assert [r["isbn"] for r in svc.search_books_in_catalog(term, "title")] == ["7777777777771"]
+    assert [r["isbn"] for r in svc.search_books_in_catalog("åSA ØBERG", "author")] == ["7777777777771"]
+    assert [r["isbn"] for r in svc.search_books_in_catalog("STRAßE", "title")] == ["7777777777772"]
+    # Too short for the trigram index; still folded while scanning
+    assert [r["isbn"] for r in svc.search_books_in_catalog("ÉL", "title")] == ["7777777777771"]
+
+def test_substring_search_uses_trigram_index(svc):
+    with database.read_connection() as conn:
+        sql, params = database._search_sql(conn, "gatsby", "title")
+        plan = " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+    assert "books_trigram" in plan and "casefold" not in sql
+
+def test_search_limit_and_offset_page_results(svc, add_and_get_book_id):
+    for i in range(5):
+        add_and_get_book_id(f"Paged Title {i}", "Pager", f"888888888888{i}", 1)
+    first = svc.search_books_in_catalog("paged title", "title", limit=2, offset=0)
+    second = svc.search_books_in_catalog("paged title", "title", limit=2, offset=2)
+    assert [b["title"] for b in first] == ["Paged Title 0", "Paged Title 1"]
+    assert [b["title"] for b in second] == ["Paged Title 2", "Paged Title 3"]
+
+def test_search_api_is_bounded(client, svc, add_and_get_book_id):
+    for i in range(3):
+        add_and_get_book_id(f"Api Bound {i}", "Pager", f"999999999999{i}", 1)
+    r = client.get("/api/search?q=api%20bound&type=title&limit=2&offset=1")
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data["count"] == 2 and data["limit"] == 2 and data["offset"] == 1
+    assert [b["title"] for b in data["results"]] == ["Api Bound 1", "Api Bound 2"]
+
+def test_fulltext_search_ranks_title_matches_first(svc, add_and_get_book_id):
+    add_and_get_book_id("Gardening Basics", "Ann Python", "1212121212121", 1)
+    add_and_get_book_id("Python Crash Course", "Eric Matthes", "1212121212122", 1)
+    res = svc.search_books_in_catalog("python", "fulltext")
+    assert [r["isbn"] for r in res] == ["1212121212122", "1212121212121"]
+
+def test_fulltext_search_prefix_and_all_words(svc, add_and_get_book_id):
+    add_and_get_book_id("Refactoring Databases", "Scott Ambler", "1313131313131", 1)
+    add_and_get_book_id("Refactoring", "Martin Fowler", "1313131313132", 1)
+    assert {r["isbn"] for r in svc.search_books_in_catalog("refact", "fulltext")} == {"1313131313131", "1313131313132"}
+    assert svc.search_books_in_catalog("refact", "fulltext", prefix=False) == []
+    assert [r["isbn"] for r in svc.search_books_in_catalog("refactoring fowler", "fulltext")] == ["1313131313132"]
+
+def test_fulltext_search_ignores_fts_syntax(svc):
+    assert svc.search_books_in_catalog('"NEAR( * OR', "fulltext") == []
+
+def test_search_huge_offset_is_clamped(client):
+    huge = 2 ** 70
+    r = client.get(f"/api/search?q=gatsby&type=title&offset={huge}")
+    assert r.status_code == 200
+    assert r.get_json()["results"] == [] and r.get_json()["offset"] == 2 ** 63 - 1
+    assert client.get(f"/search?q=gatsby&type=title&offset={huge}").status_code == 200
@@ -5,9 +5,13 @@ We verify two representative shapes:
 1) No history / no loans => zeros and empty lists
 2) Some history with active loans including an overdue one =>
    counts make sense and total_late_fees > 0
+3) A paid fee is no longer counted as owed
 """
 import sqlite3
 from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+from services.payment_service import PaymentGateway
 
 def test_patron_status_no_history(svc):
     report = svc.get_patron_status_report("999999")  # never used in tests
@@ -62,3 +66,52 @@ def test_patron_status_with_active_and_overdue(svc, add_and_get_book_id, db_path
     assert isinstance(cl, list) and len(cl) == 2
     for item in cl:
         assert {"book_id", "title", "author", "borrow_date", "due_date", "days_overdue", "late_fee"} <= set(item.keys())
+
+def test_patron_status_is_one_query(svc, add_and_get_book_id, db_path, monkeypatch):
+    import database
+
+    patron = "787878"
+    for i in range(4):
+        b = add_and_get_book_id(f"Q{i}", "A", f"787878787878{i}", 1)
+        assert svc.borrow_book_by_patron(patron, b)[0]
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE borrows SET due_date = ? WHERE patron_id = ?",
+                     ((datetime.now() - timedelta(days=9)).isoformat(), patron))
+        conn.commit()
+
+    statements = []
+    database.close_connections()  # so pooled connections are reopened through tracing_connect
+    real_connect = database.get_db_connection
+
+    def tracing_connect(read_only=False):
+        conn = real_connect(read_only=read_only)
+        conn.set_trace_callback(lambda sql: statements.append(sql) if sql.lstrip().upper().startswith("SELECT") else None)
+        return conn
+
+    monkeypatch.setattr(database, "get_db_connection", tracing_connect)
+    report = svc.get_patron_status_report(patron)
+
+    assert len(statements) == 1
+    assert report["counts"]["currently_borrowed"] == 4
+    # 9 days overdue: 7 * $0.50 + 2 * $1.00 = $5.50 per loan
+    assert all(l["late_fee"] == 5.50 and l["days_overdue"] == 9 for l in report["current_loans"])
+    assert report["total_late_fees"] == 22.00
+
+def test_patron_status_subtracts_paid_fees(svc, add_and_get_book_id, db_path):
+    patron = "797979"
+    b = add_and_get_book_id("Paid Up", "A", "7979797979791", 1)
+    assert svc.borrow_book_by_patron(patron, b)[0]
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE borrows SET due_date = ? WHERE patron_id = ?",
+                     ((datetime.now() - timedelta(days=10)).isoformat(), patron))
+        conn.commit()
+    assert svc.get_patron_status_report(patron)["total_late_fees"] == 6.5
+
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_report_1", "Approved")
+    assert svc.pay_late_fees(patron, b, gateway)[0]
+
+    report = svc.get_patron_status_report(patron)
+    assert report["total_late_fees"] == 0.0
+    assert report["current_loans"][0]["late_fee"] == 0.0
+    assert report["current_loans"][0]["amount_paid"] == 6.5
@@ -0,0 +1,193 @@
+"""
+Payment reconciliation sweep
+Expectations:
+- Every recorded transaction in the window is verified once, concurrently.
+- Missing transactions, wrong statuses, wrong amounts and failed checks are
+  recorded as issues; matching transactions are not.
+- A sweep stopped early resumes from its checkpoint, and a later sweep only
+  checks transactions recorded since.
+- The walk follows commit order: a charge committed after a sweep is checked
+  by the next one even if its recorded_at is older than the checkpoint, and
+  the checkpoint never passes a transaction recorded after `until`.
+- Per-book late fee charges are recorded and checked like consolidated ones.
+- Each batch is a primary-key range read without a sort.
+- A batch of slow checks waits one deadline per round of the pool, not one
+  timeout per check; checks past it are unverified.
+- The report includes throughput.
+- Late fee reservations left pending by an interrupted charge are handed to
+  the payment outbox under their reference.
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+from database import insert_fee_payment_allocations, reserve_fee_payments
+from services.payment_outbox import get_outbox_entry_by_key
+from services.payment_executor import PaymentExecutor
+from services.payment_service import PaymentGateway
+from services.reconciliation import (
+    _RECORDED_TRANSACTIONS_SQL, get_checkpoint, get_reconciliation_issues, reconcile_payments
+)
+
+
+def _record(txn_ids, start=None, amount=5.0):
+    start = start or datetime(2025, 1, 1, 9, 0)
+    for n, txn in enumerate(txn_ids):
+        insert_fee_payment_allocations(txn, "123456", [(1, 3, amount)], start + timedelta(minutes=n))
+
+
+def _executor(statuses=None, delay=0.0, workers=8, timeout=5.0):
+    statuses = statuses or {}
+    gateway = Mock(spec=PaymentGateway)
+    lock = threading.Lock()
+    gateway.in_flight = gateway.peak = 0
+
+    def verify(txn):
+        with lock:
+            gateway.in_flight += 1
+            gateway.peak = max(gateway.peak, gateway.in_flight)
+        time.sleep(delay)
+        with lock:
+            gateway.in_flight -= 1
+        result = statuses.get(txn, {"status": "completed", "amount": 5.0})
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    gateway.verify_payment_status.side_effect = verify
+    return PaymentExecutor(gateway=gateway, max_workers=workers, timeout=timeout)
+
+
+def test_flags_mismatches_only(app_and_db):
+    _record(["txn_ok", "txn_missing", "txn_pending", "txn_amount", "txn_error"])
+    executor = _executor({
+        "txn_missing": {"status": "not_found"},
+        "txn_pending": {"status": "pending", "amount": 5.0},
+        "txn_amount": {"status": "completed", "amount": 4.0},
+        "txn_error": ConnectionError("gateway down"),
+    })
+
+    report = reconcile_payments(executor, until=datetime(2025, 2, 1))
+    executor.shutdown()
+
+    assert report["checked"] == 5
+    assert report["issues"] == 4
+    assert report["unverified"] == 1
+    assert report["complete"] is True
+    found = {i["transaction_id"]: i["issue"] for i in get_reconciliation_issues()}
+    assert found["txn_missing"] == "missing at gateway"
+    assert found["txn_pending"] == "status mismatch"
+    assert found["txn_amount"] == "amount mismatch"
+    assert found["txn_error"].startswith("unverified")
+    assert "txn_ok" not in found
+
+
+def test_checks_run_concurrently_and_report_throughput(app_and_db):
+    _record([f"txn_{n:03d}" for n in range(40)])
+    executor = _executor(delay=0.05, workers=8)
+
+    report = reconcile_payments(executor, until=datetime(2025, 2, 1), batch_size=20)
+    executor.shutdown()
+
+    assert report["checked"] == 40
+    assert executor.gateway.peak > 1
+    assert report["elapsed_seconds"] < 40 * 0.05
+    assert report["transactions_per_second"] > 0
+
+
+def test_slow_batch_shares_one_deadline(app_and_db):
+    _record([f"txn_slow_{n}" for n in range(8)])
+    executor = _executor(delay=2.0, workers=4, timeout=0.2)
+
+    started = time.perf_counter()
+    report = reconcile_payments(executor, until=datetime(2025, 2, 1))
+    elapsed = time.perf_counter() - started
+    executor.shutdown(wait=False)
+
+    # Two rounds of 0.2s, where a timeout per check would take 1.6s
+    assert elapsed < 1.2
+    assert report["checked"] == 8
+    assert report["unverified"] == 8
+
+
+def test_resumes_from_checkpoint_and_runs_incrementally(app_and_db):
+    _record([f"txn_{n:03d}" for n in range(10)])
+    executor = _executor()
+    until = datetime(2025, 2, 1)
+
+    first = reconcile_payments(executor, until=until, batch_size=3, max_transactions=4)
+    assert (first["checked"], first["complete"]) == (4, False)
+    assert get_checkpoint()["transaction_id"] == "txn_003"
+
+    second = reconcile_payments(executor, until=until, batch_size=3)
+    assert second["checked"] == 6
+    assert second["resumed_from"]["transaction_id"] == "txn_003"
+
+    _record(["txn_new"], start=datetime(2025, 1, 15))
+    third = reconcile_payments(executor, until=until)
+    executor.shutdown()
+    assert third["checked"] == 1
+    checked = [c.args[0] for c in executor.gateway.verify_payment_status.call_args_list]
+    assert sorted(checked) == sorted(set(checked))
+
+
+def test_late_commits_and_until_do_not_skip_transactions(app_and_db):
+    _record(["txn_a", "txn_b"])
+    executor = _executor()
+    assert reconcile_payments(executor)["checked"] == 2
+
+    # Committed after the sweep, but charged before the checkpoint's recorded_at
+    _record(["txn_late"], start=datetime(2024, 12, 31))
+    _record(["txn_future"], start=datetime(2025, 3, 1))
+    _record(["txn_after_future"], start=datetime(2025, 1, 2))
+    early = reconcile_payments(executor, until=datetime(2025, 2, 1))
+    assert early["checked"] == 1 and get_checkpoint()["transaction_id"] == "txn_late"
+
+    assert reconcile_payments(executor)["checked"] == 2
+    executor.shutdown()
+    checked = [c.args[0] for c in executor.gateway.verify_payment_status.call_args_list]
+    assert sorted(checked) == ["txn_a", "txn_after_future", "txn_b", "txn_future", "txn_late"]
+
+
+def test_per_book_charges_are_reconciled(app_and_db, svc, db_path):
+    svc.add_book_to_catalog("Overdue", "Author", "9990000000077", 1)
+    book_id = svc.get_book_by_isbn("9990000000077")["id"]
+    due = datetime.now() - timedelta(days=3)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO borrows (patron_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?)",
+                     ("777777", book_id, (due - timedelta(days=14)).isoformat(), due.isoformat()))
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_book", "Approved")
+    assert svc.pay_late_fees("777777", book_id, gateway)[0] is True
+
+    executor = _executor({"txn_book": {"status": "completed", "amount": 9.0}})
+    report = reconcile_payments(executor)
+    executor.shutdown()
+    assert report["checked"] == 1
+    assert [i["issue"] for i in get_reconciliation_issues()] == ["amount mismatch"]
+    assert get_reconciliation_issues()[0]["ledger_amount"] == 1.5
+
+
+def test_batches_read_by_primary_key(db_path):
+    with sqlite3.connect(db_path) as conn:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + _RECORDED_TRANSACTIONS_SQL,
+                            {"after": 0, "limit": 10}).fetchall()
+    detail = " ".join(str(row[-1]) for row in plan)
+    assert "PRIMARY KEY" in detail and "TEMP B-TREE" not in detail
+
+
+def test_stale_reservations_are_handed_to_outbox(app_and_db):
+    # Borrow 1 is the sample loan of book 3 by patron 123456
+    assert reserve_fee_payments("res_crashed", "123456", [(1, 3, 2.5, 0.0)], datetime.now() - timedelta(hours=1))
+    assert reserve_fee_payments("res_fresh", "123456", [(1, 3, 1.0, 2.5)], datetime.now())
+
+    executor = _executor()
+    report = reconcile_payments(executor)
+    executor.shutdown()
+
+    assert report["reservations_recovered"] == 1
+    entry = get_outbox_entry_by_key("res_crashed")
+    assert entry["status"] == "pending" and entry["amount"] == 2.5
+    assert get_outbox_entry_by_key("res_fresh") is None
@@ -0,0 +1,80 @@
+"""
+SQL tracing
+Expectations:
+- Connections from get_db_connection() count every statement, including the
+  ones behind conn.execute(), and time execute plus fetches.
+- With SQL_TRACE_HEADERS each response carries the request's query count and
+  SQL time.
+- Statements over the threshold are written to the slow-query log with the
+  route that ran them; faster ones are not.
+- Tracing can be switched off.
+"""
+import logging
+import sqlite3
+
+import pytest
+
+import database
+import sql_trace
+
+
+@pytest.fixture
+def restore_trace():
+    saved = (sql_trace.ENABLED, sql_trace.SLOW_QUERY_MS)
+    yield
+    sql_trace.ENABLED, sql_trace.SLOW_QUERY_MS = saved
+
+
+def test_headers_report_queries_per_request(app_and_db, restore_trace):
+    app, _ = app_and_db
+    app.config["SQL_TRACE_HEADERS"] = True
+    client = app.test_client()
+
+    r = client.get("/api/late_fee/123456/3")
+    assert int(r.headers["X-SQL-Queries"]) >= 1
+    assert float(r.headers["X-SQL-Time-Ms"]) >= 0
+
+    app.config["SQL_TRACE_HEADERS"] = False
+    assert "X-SQL-Queries" not in client.get("/catalog").headers
+
+
+def test_request_stats_count_each_statement(app_and_db, restore_trace):
+    app, _ = app_and_db
+    with app.test_request_context("/"):
+        with database.db_connection() as conn:
+            opened = sql_trace.request_stats()      # includes the connection's PRAGMAs
+            conn.execute("SELECT 1").fetchone()
+            conn.execute("SELECT COUNT(*) FROM books").fetchall()
+            list(conn.execute("SELECT id FROM books"))
+        stats = sql_trace.request_stats()
+    assert stats["queries"] - opened["queries"] == 3
+    assert stats["seconds"] > opened["seconds"]
+
+
+def test_slow_queries_are_logged_with_route(app_and_db, restore_trace, caplog):
+    app, _ = app_and_db
+    caplog.set_level(logging.WARNING, logger="library.sql.slow")
+
+    sql_trace.SLOW_QUERY_MS = 1000.0
+    app.test_client().get("/catalog")
+    assert not caplog.records
+
+    sql_trace.SLOW_QUERY_MS = 0.0
+    app.test_client().get("/api/search?q=gatsby&type=title")
+    messages = [rec.getMessage() for rec in caplog.records]
+    assert any("GET /api/search (api.search_books_api)" in m and "SELECT" in m for m in messages)
+
+
+def test_tracing_can_be_disabled(app_and_db, restore_trace):
+    sql_trace.configure(enabled=False)
+    conn = database.get_db_connection()
+    try:
+        assert type(conn) is sqlite3.Connection
+    finally:
+        conn.close()
+    sql_trace.configure(enabled=True)
+    conn = database.get_db_connection()
+    try:
+        assert isinstance(conn.execute("SELECT 1"), sql_trace.TracingCursor)
+    finally:
+        conn.close()
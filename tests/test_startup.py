@@ -0,0 +1,52 @@
+"""
+Application startup
+Expectations:
+- In production mode create_app() migrates the schema but seeds no sample data,
+  unless SEED_SAMPLE_DATA opts in.
+- init_database() only migrates when the stored schema version is behind.
+- Importing the app does not import requests; it is loaded on the first live
+  gateway call.
+"""
+import pathlib
+import sqlite3
+import subprocess
+import sys
+
+import database
+from app import create_app
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def _book_count(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+
+def test_production_mode_skips_sample_data(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "prod.db")
+    monkeypatch.setattr(database, "DATABASE", db_path)
+
+    create_app({"PRODUCTION": True})
+    with sqlite3.connect(db_path) as conn:
+        assert database.get_schema_version(conn) == database.SCHEMA_VERSION
+    assert _book_count(db_path) == 0
+
+    create_app({"PRODUCTION": True, "SEED_SAMPLE_DATA": True})
+    assert _book_count(db_path) == 3
+
+
+def test_development_mode_still_seeds(db_path):
+    assert _book_count(db_path) == 3
+
+
+def test_init_database_migrates_only_when_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "fresh.db"))
+    assert database.init_database() is True
+    assert database.init_database() is False
+
+
+def test_import_does_not_load_requests():
+    code = "import sys, app; app.create_app; print('requests' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "False"